@@ -0,0 +1,132 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asset_metrics import queue_wait_seconds, shed_total
+from deadline import check_deadline, wait_for
+
+# Workers and queued requests per asset type; requests beyond both are shed
+VIDEO_WORKERS = int(os.environ.get('ASSET_VIDEO_WORKERS', 16))
+VIDEO_QUEUE = int(os.environ.get('ASSET_VIDEO_QUEUE', 64))
+IMAGE_WORKERS = int(os.environ.get('ASSET_IMAGE_WORKERS', 32))
+IMAGE_QUEUE = int(os.environ.get('ASSET_IMAGE_QUEUE', 256))
+
+# A request still queued after this many seconds is dropped; its caller has likely given up
+MAX_QUEUE_WAIT = float(os.environ.get('ASSET_MAX_QUEUE_WAIT', 10))
+
+# Seconds a shed caller is told to wait before retrying
+RETRY_AFTER = 1
+
+
+class Overloaded(Exception):
+    """
+    A request was shed instead of queued
+
+    status is 429 when the queue was full on arrival and 503 when the request
+    was dropped after waiting too long in the queue.
+    """
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = RETRY_AFTER
+
+
+class BoundedPool:
+    """
+    Thread pool with a bounded queue for one asset type
+
+    Each asset type gets its own pool, so a burst of slow video lookups can
+    fill the video queue without delaying image lookups.
+    """
+
+    def __init__(self, name, workers, queue_size, max_wait=MAX_QUEUE_WAIT):
+        """
+        Args:
+            name (str): Pool name, used as the metrics label
+            workers (int): Threads running lookups
+            queue_size (int): Lookups allowed to wait for a thread
+            max_wait (float): Seconds a lookup may wait before it is dropped
+        """
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{name}-pool')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.counters = {'queued': 0, 'active': 0}
+
+    def update(self, counter, amount):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def submit(self, function, *args):
+        """
+        Queue function(*args) on the pool
+
+        Returns:
+            Future: Future of the call
+
+        Raises:
+            Overloaded: If the pool and its queue are full
+        """
+        if not self.slots.acquire(blocking=False):
+            shed_total.inc(pool=self.name, reason='queue_full')
+            raise Overloaded(f'Too many {self.name} requests queued, retry later', 429)
+
+        enqueued = time.perf_counter()
+        self.update('queued', 1)
+
+        def run():
+            self.update('queued', -1)
+            waited = time.perf_counter() - enqueued
+            queue_wait_seconds.observe(waited, pool=self.name)
+            if waited > self.max_wait:
+                shed_total.inc(pool=self.name, reason='queue_timeout')
+                raise Overloaded(f'{self.name.capitalize()} request waited {waited:.1f}s in the queue', 503)
+            check_deadline()
+            self.update('active', 1)
+            try:
+                return function(*args)
+            finally:
+                self.update('active', -1)
+
+        try:
+            # The worker sees the caller's deadline
+            future = self.executor.submit(contextvars.copy_context().run, run)
+        except Exception:
+            self.update('queued', -1)
+            self.slots.release()
+            raise
+
+        def release(future):
+            # Also runs if the future is cancelled before it started
+            if future.cancelled():
+                self.update('queued', -1)
+            self.slots.release()
+
+        future.add_done_callback(release)
+        return future
+
+    def run(self, function, *args):
+        """
+        Run function(*args) on the pool and wait for its result, or until the
+        caller's deadline passes or its client disconnects
+        """
+        return wait_for(self.submit(function, *args))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, workers=self.workers, queue_size=self.queue_size)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+pools = {
+    'video': BoundedPool('video', VIDEO_WORKERS, VIDEO_QUEUE),
+    'image': BoundedPool('image', IMAGE_WORKERS, IMAGE_QUEUE),
+}
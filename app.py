@@ -1,20 +1,24 @@
-from flask import Flask, request, jsonify
-import requests
-from pymediainfo import MediaInfo
-from PIL import Image
-from io import BytesIO
+from flask import Flask, Response, request, jsonify
 import logging
 from concurrent.futures import ThreadPoolExecutor
+from admission import Overloaded
+from asset_batch import BATCH_CONCURRENCY, InvalidBatch, iter_batch_results, parse_batch, to_ndjson
+from asset_engine import AssetMetadataError, engine
+from asset_metrics import CONTENT_TYPE, render
+from cache_warmer import InvalidWarmList, parse_warm_list, warm_jobs
+from deadline import Deadline, DeadlineExceeded, deadline_scope, parse_timeout, socket_disconnected
+from host_capabilities import capabilities
+from thumbnails import THUMBNAIL_WIDTH
 
 app = Flask(__name__)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-executor = ThreadPoolExecutor()
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
 
-class InvalidAPIUsage(Exception):
-    pass
+# Fetch strategies, cache and settings are shared with the other services through the engine
+metadata_cache = engine.metadata_cache
 
 @app.route('/asset_metadata', methods=['POST'])
 def get_metadata():
@@ -25,77 +29,123 @@ def get_metadata():
     if not url or not asset_type:
         return jsonify({'error': 'URL and asset_type are required'}), 400
 
+    if asset_type not in ('video', 'image'):
+        return jsonify({'error': 'Unsupported asset type'}), 400
+
     try:
-        if asset_type == 'video':
-            future = executor.submit(handle_video_metadata, url)
-            metadata = future.result()
-        elif asset_type == 'image':
-            metadata = handle_image_metadata(url)
-        else:
-            return jsonify({'error': 'Unsupported asset type'}), 400
+        timeout = parse_timeout(request.headers, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # The lookup is abandoned when the caller's timeout passes or it hangs up
+    environ = request.environ
+    deadline = Deadline(timeout, disconnected=lambda: socket_disconnected(environ))
 
+    try:
+        with deadline_scope(deadline):
+            metadata = handle(url, asset_type, data.get('fields') or ())
         return jsonify(metadata)
-    except InvalidAPIUsage as e:
+    except Overloaded as e:
+        return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+    except DeadlineExceeded as e:
+        return jsonify({'error': str(e)}), e.status
+    except AssetMetadataError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(e)
         return jsonify({'error': 'Something went wrong!'}), 500
 
-def handle_video_metadata(url: str):
-    try:
-        return get_video_metadata(url)
-    except Exception as e:
-        logger.error(e)
-        raise InvalidAPIUsage('Something went wrong with video processing!')
+@app.route('/asset_thumbnail', methods=['GET', 'POST'])
+def get_thumbnail():
+    """
+    Thumbnail of a video from its first, or Nth, keyframe
+
+    Options are read from the query string or a JSON body: url, keyframe
+    (0-based), width and format (jpeg or webp).
+    """
+    data = request.args.to_dict()
+    data.update(request.get_json(silent=True) or {})
+    url = data.get('url')
+
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
 
-def handle_image_metadata(url: str):
     try:
-        return get_image_metadata(url)
-    except Exception as e:
-        logger.error(e)
-        raise InvalidAPIUsage('Something went wrong with image processing!')
+        timeout = parse_timeout(request.headers, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    environ = request.environ
+    deadline = Deadline(timeout, disconnected=lambda: socket_disconnected(environ))
 
-def get_video_metadata(video_url):
     try:
-        headers = {'Range': 'bytes=0-5000000'}
-        response = requests.get(video_url, headers=headers, stream=True)
-        if response.status_code not in (200, 206):
-            logger.info('Range request not supported, attempting full download')
-            raise InvalidAPIUsage('Range request not supported')
-
-        temp_file = BytesIO()
-        for chunk in response.iter_content(chunk_size=1024):
-            if chunk:
-                temp_file.write(chunk)
-
-        temp_file.seek(0)
-        return parse_video_metadata(temp_file)
+        with deadline_scope(deadline):
+            image, content_type = engine.thumbnail(
+                url, data.get('keyframe', 0), data.get('width', THUMBNAIL_WIDTH), data.get('format', 'jpeg'),
+            )
+        return Response(image, content_type=content_type)
+    except Overloaded as e:
+        return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+    except DeadlineExceeded as e:
+        return jsonify({'error': str(e)}), e.status
+    except AssetMetadataError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(e)
-        raise InvalidAPIUsage('Failed to get video metadata with range request')
-
-def parse_video_metadata(temp_file):
-    media_info = MediaInfo.parse(temp_file)
-    for track in media_info.tracks:
-        if track.track_type == "Video":
-            return {
-                'duration': track.duration / 1000,
-                'dimension': f"{track.width}x{track.height}"
-            }
-    raise InvalidAPIUsage('No video stream found')
-
-def get_image_metadata(image_url):
+        return jsonify({'error': 'Something went wrong!'}), 500
+
+@app.route('/asset_metadata/batch', methods=['POST'])
+def get_metadata_batch():
     try:
-        response = requests.get(image_url, stream=True)
-        if response.status_code != 200:
-            raise FileNotFoundError(f'File {image_url} not found')
+        assets, errors = parse_batch(request.json)
+    except InvalidBatch as e:
+        return jsonify({'error': str(e)}), 400
 
-        image = Image.open(BytesIO(response.content))
-        width, height = image.width, image.height
-        return {'dimension': f'{width}x{height}'}
-    except Exception as e:
-        logger.error(e)
-        raise InvalidAPIUsage('Failed to get image metadata')
+    def generate():
+        for record in errors:
+            yield to_ndjson(record)
+        for record in iter_batch_results(assets, handle, batch_executor):
+            yield to_ndjson(record)
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/asset_metadata/warm', methods=['POST'])
+def start_warm_job():
+    """
+    Warm the metadata cache for a list of assets in the background
+
+    Responds 202 with the job; its progress and failures are polled at
+    /asset_metadata/warm/<job_id>.
+    """
+    try:
+        assets = parse_warm_list(request.json)
+    except InvalidWarmList as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        job = warm_jobs.start(assets, handle, engine.is_cached)
+    except Overloaded as e:
+        return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+    return jsonify(job.as_dict()), 202
+
+@app.route('/asset_metadata/warm/<job_id>', methods=['GET'])
+def get_warm_job(job_id):
+    job = warm_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown warm job'}), 404
+    return jsonify(job.as_dict())
+
+@app.route('/asset_metadata/cache', methods=['GET'])
+def get_cache_stats():
+    return jsonify(metadata_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render(**engine.stats()), content_type=CONTENT_TYPE)
+
+@app.route('/asset_metadata/capabilities', methods=['GET'])
+def get_host_capabilities():
+    return jsonify(capabilities.stats())
+
+def handle(url: str, asset_type: str, fields=()):
+    return engine.handle(url, asset_type, fields)
 
 if __name__ == '__main__':
     app.run(port=5000)
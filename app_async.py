@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+from admission import Overloaded
+from asset_batch import BATCH_CONCURRENCY, InvalidBatch, parse_batch, to_ndjson
+from asset_engine import AssetMetadataError, engine
+from asset_engine_async import AsyncAssetEngine
+from asset_fetch_async import create_client
+from asset_metrics import CONTENT_TYPE, render
+from deadline import Deadline, DeadlineExceeded, deadline_scope, parse_timeout, wait_async
+from host_capabilities import capabilities
+from parse_pool import parse_pool
+from thumbnails import THUMBNAIL_WIDTH
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cache, settings, strategy chain and pools are shared with the other services through the engine;
+# only the fetching runs on the event loop
+async_engine = AsyncAssetEngine(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async_engine.client = create_client()
+    yield
+    await async_engine.client.aclose()
+    parse_pool.shutdown()
+
+
+app = FastAPI(title="Asset Metadata API", lifespan=lifespan)
+
+
+class AssetRequest(BaseModel):
+    url: Optional[str] = None
+    type: Optional[str] = None
+    fields: Optional[Union[List[str], str]] = None
+    timeout: Optional[float] = None
+
+
+def error_response(e):
+    if isinstance(e, Overloaded):
+        return JSONResponse({'error': str(e)}, status_code=e.status, headers={'Retry-After': str(e.retry_after)})
+    if isinstance(e, DeadlineExceeded):
+        return JSONResponse({'error': str(e)}, status_code=e.status)
+    if isinstance(e, AssetMetadataError):
+        return JSONResponse({'error': str(e)}, status_code=400)
+    logger.error(e)
+    return JSONResponse({'error': 'Something went wrong!'}, status_code=500)
+
+
+@app.post("/asset_metadata")
+async def get_metadata(asset: AssetRequest, request: Request):
+    if not asset.url or not asset.type:
+        return JSONResponse({'error': 'URL and asset_type are required'}, status_code=400)
+    if asset.type not in ('video', 'image'):
+        return JSONResponse({'error': 'Unsupported asset type'}, status_code=400)
+    try:
+        timeout = parse_timeout(request.headers, {'timeout': asset.timeout})
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    # The lookup is cancelled, closing its streams, when the timeout passes or the client hangs up
+    deadline = Deadline(timeout)
+    try:
+        with deadline_scope(deadline):
+            return await wait_async(handle(asset.url, asset.type, asset.fields or ()), deadline, request.is_disconnected)
+    except Exception as e:
+        return error_response(e)
+
+
+@app.api_route("/asset_thumbnail", methods=['GET', 'POST'])
+async def get_thumbnail(request: Request):
+    """
+    Thumbnail of a video from its first, or Nth, keyframe
+
+    Options are read from the query string or a JSON body: url, keyframe
+    (0-based), width and format (jpeg or webp).
+    """
+    data = dict(request.query_params)
+    if request.method == 'POST':
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            data.update(body)
+    if not data.get('url'):
+        return JSONResponse({'error': 'URL is required'}, status_code=400)
+    try:
+        timeout = parse_timeout(request.headers, data)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    deadline = Deadline(timeout)
+    try:
+        with deadline_scope(deadline):
+            image, content_type = await wait_async(
+                async_engine.thumbnail(
+                    data['url'], data.get('keyframe', 0), data.get('width', THUMBNAIL_WIDTH), data.get('format', 'jpeg'),
+                ),
+                deadline, request.is_disconnected,
+            )
+        return Response(image, media_type=content_type)
+    except Exception as e:
+        return error_response(e)
+
+
+@app.post("/asset_metadata/batch")
+async def get_metadata_batch(request: Request):
+    try:
+        assets, errors = parse_batch(await request.json())
+    except InvalidBatch as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(url, asset_type):
+        async with semaphore:
+            try:
+                return {'url': url, 'type': asset_type, 'metadata': await handle(url, asset_type)}
+            except Exception as e:
+                return {'url': url, 'type': asset_type, 'error': str(e)}
+
+    async def generate():
+        for record in errors:
+            yield to_ndjson(record)
+        tasks = [asyncio.create_task(run(url, asset_type)) for url, asset_type in assets]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield to_ndjson(await task)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+@app.get("/asset_metadata/cache")
+async def get_cache_stats():
+    return engine.metadata_cache.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(render(**async_engine.stats()), media_type=CONTENT_TYPE)
+
+
+@app.get("/asset_metadata/capabilities")
+async def get_host_capabilities():
+    return capabilities.stats()
+
+
+async def handle(url: str, asset_type: str, fields=()):
+    return await async_engine.handle(url, asset_type, fields)
+
+# Run with: uvicorn app_async:app
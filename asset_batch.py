@@ -0,0 +1,79 @@
+import json
+import os
+from concurrent.futures import as_completed
+
+# Number of assets of a batch processed at the same time
+BATCH_CONCURRENCY = int(os.environ.get('ASSET_BATCH_CONCURRENCY', 8))
+
+MAX_BATCH_SIZE = int(os.environ.get('ASSET_MAX_BATCH_SIZE', 500))
+
+ASSET_TYPES = ('video', 'image')
+
+
+class InvalidBatch(Exception):
+    pass
+
+
+def parse_batch(data):
+    """
+    Validate a batch request body and deduplicate its items
+
+    Args:
+        data: Request body, either a list of {url, type} items or {'items': [...]}
+
+    Returns:
+        tuple: (assets, errors) where assets is the list of unique (url, asset_type)
+        pairs in request order and errors holds result records for invalid items
+
+    Raises:
+        InvalidBatch: If the body is not a non-empty list of items or is too large
+    """
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise InvalidBatch('items are required')
+    if len(items) > MAX_BATCH_SIZE:
+        raise InvalidBatch(f'At most {MAX_BATCH_SIZE} items are allowed per batch')
+
+    assets, errors = {}, []
+    for item in items:
+        url = item.get('url') if isinstance(item, dict) else None
+        asset_type = item.get('type') if isinstance(item, dict) else None
+        if not url or not asset_type:
+            errors.append({'url': url, 'type': asset_type, 'error': 'URL and asset_type are required'})
+        elif asset_type not in ASSET_TYPES:
+            errors.append({'url': url, 'type': asset_type, 'error': 'Unsupported asset type'})
+        else:
+            assets[(url, asset_type)] = None
+    return list(assets), errors
+
+
+def iter_batch_results(assets, compute, executor):
+    """
+    Fan a batch out over an executor and yield results in completion order
+
+    Work that has not started is cancelled if the consumer stops early, e.g.
+    because the client disconnected.
+
+    Args:
+        assets (list): (url, asset_type) pairs
+        compute (callable): compute(url, asset_type) returning the metadata dict
+        executor (Executor): Bounded executor the batch runs on
+
+    Yields:
+        dict: {'url', 'type', 'metadata'} or {'url', 'type', 'error'}
+    """
+    futures = {executor.submit(compute, url, asset_type): (url, asset_type) for url, asset_type in assets}
+    try:
+        for future in as_completed(futures):
+            url, asset_type = futures[future]
+            try:
+                yield {'url': url, 'type': asset_type, 'metadata': future.result()}
+            except Exception as e:
+                yield {'url': url, 'type': asset_type, 'error': str(e)}
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def to_ndjson(record):
+    return json.dumps(record) + '\n'
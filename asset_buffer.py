@@ -0,0 +1,309 @@
+import io
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from deadline import check_deadline
+
+logger = logging.getLogger(__name__)
+
+# Downloads larger than this are written to a temp file instead of memory
+SPOOL_THRESHOLD = int(os.environ.get('ASSET_SPOOL_THRESHOLD', 8 * 1024 * 1024))
+
+# Total bytes all in-memory download buffers of the process may hold at once
+MEMORY_BUDGET = int(os.environ.get('ASSET_MEMORY_BUDGET', 256 * 1024 * 1024))
+
+SPOOL_DIR = os.environ.get('ASSET_SPOOL_DIR') or None
+
+# Read size used when the payload size is not known up front
+DEFAULT_CHUNK_SIZE = 256 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class MemoryBudget:
+    """
+    Byte budget shared by all download buffers of the process
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, size):
+        """
+        Returns:
+            bool: True if size bytes were reserved, False if the budget is exhausted
+        """
+        with self.lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self.lock:
+            self.used -= size
+
+
+memory_budget = MemoryBudget(MEMORY_BUDGET)
+
+
+def chunk_size_for(content_length):
+    """
+    Pick a read size that keeps the number of reads per download small
+
+    Args:
+        content_length (int): Expected payload size, or None if unknown
+
+    Returns:
+        int: Bytes to request per read
+    """
+    if not content_length:
+        return DEFAULT_CHUNK_SIZE
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, content_length // 16))
+
+
+class TransferStats:
+    """
+    Counters for one download: bytes, elapsed time, reads and buffer copies
+
+    copies counts how many times a chunk was copied on its way into the buffer:
+    once per read when reading straight into it, twice when a chunk goes through
+    a scratch buffer on its way to a spilled temp file or is handed over as
+    bytes, as by the asyncio client.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.bytes = 0
+        self.reads = 0
+        self.copies = 0
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'bytes': self.bytes,
+            'seconds': round(self.elapsed, 6),
+            'bytes_per_second': round(self.bytes_per_second),
+            'reads': self.reads,
+            'copies': self.copies,
+        }
+
+
+class SpoolBuffer:
+    """
+    Download buffer that keeps small payloads in memory and spills large ones to disk
+
+    Data is written first and read afterwards. A buffer spills to an unnamed temp
+    file once it grows past the threshold, or as soon as the process-wide memory
+    budget cannot cover it. A spilled buffer is read back through mmap, so
+    MediaInfo.parse can seek around it without loading it into memory.
+
+    In memory the data lives in a bytearray that fill() reads straight into, so
+    a download of known size is copied exactly once.
+    """
+
+    def __init__(self, threshold=SPOOL_THRESHOLD, budget=memory_budget):
+        """
+        Args:
+            threshold (int): Size above which the buffer is moved to a temp file
+            budget (MemoryBudget): Budget in-memory bytes are reserved from
+        """
+        self.threshold = threshold
+        self.budget = budget
+        self.reserved = 0
+        self.data = bytearray()
+        self.length = 0
+        self.position = 0
+        self.file = None
+        self.view = None
+        self.reading = False
+        self.closed = False
+        self.stats = TransferStats()
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def reserve(self, size):
+        """
+        Grow the in-memory capacity to size bytes if the threshold and budget allow it
+
+        Returns:
+            bool: True if the buffer can hold size bytes in memory
+        """
+        if self.file is not None or size > self.threshold:
+            return False
+        extra = size - len(self.data)
+        if extra <= 0:
+            return True
+        if not self.budget.reserve(extra):
+            return False
+        self.reserved += extra
+        self.data.extend(bytes(extra))
+        return True
+
+    def write(self, data):
+        if self.reading:
+            raise ValueError('SpoolBuffer is read-only once reading has started')
+        size = len(data)
+        if self.file is None:
+            if self.reserve(self.length + size):
+                self.data[self.length:self.length + size] = data
+                self.length += size
+                return size
+            self.spill()
+        return self.file.write(data)
+
+    def fill(self, reader, size_hint=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Read a stream into the buffer with readinto until it is exhausted
+
+        With a size hint that fits in memory the whole payload is preallocated
+        and read in place. Otherwise chunks go through a reusable scratch buffer.
+
+        Args:
+            reader: Object with a readinto method, e.g. a raw HTTP response
+            size_hint (int): Expected payload size, e.g. from Content-Length
+            chunk_size (int): Bytes requested per readinto call
+
+        Returns:
+            TransferStats: Counters for this download
+        """
+        if size_hint:
+            self.reserve(self.length + size_hint)
+
+        scratch = None
+        while True:
+            # A download nobody waits for any more stops here and its response is closed
+            check_deadline()
+            full = self.file is None and self.length == len(self.data)
+            if full and not (size_hint and self.length >= size_hint):
+                if not self.reserve(self.length + chunk_size):
+                    self.spill()
+                full = False
+
+            if self.file is None and not full:
+                with memoryview(self.data) as view:
+                    count = reader.readinto(view[self.length:self.length + chunk_size])
+                if count:
+                    self.length += count
+                copies = 1
+            else:
+                # Spilled, or the announced size is reached and only end of stream is expected
+                if scratch is None:
+                    scratch = memoryview(bytearray(chunk_size))
+                count = reader.readinto(scratch)
+                if count:
+                    self.write(scratch[:count])
+                copies = 2
+
+            if not count:
+                break
+            self.stats.reads += 1
+            self.stats.copies += copies
+            self.stats.bytes += count
+
+        self.stats.finish()
+        return self.stats
+
+    def spill(self):
+        logger.info(f'Spilling {self.length} byte download buffer to disk')
+        self.file = tempfile.TemporaryFile(dir=SPOOL_DIR)
+        with memoryview(self.data) as view:
+            self.file.write(view[:self.length])
+        self.data = bytearray()
+        self.budget.release(self.reserved)
+        self.reserved = 0
+
+    def reader(self):
+        if not self.reading:
+            self.reading = True
+            if self.file is not None:
+                self.file.flush()
+                if self.file.tell() == 0:
+                    # mmap cannot map an empty file
+                    self.file.close()
+                    self.file = None
+                else:
+                    self.view = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.view
+
+    def read(self, size=-1):
+        view = self.reader()
+        if view is not None:
+            return view.read(size)
+        end = self.length if size is None or size < 0 else min(self.length, self.position + size)
+        start, self.position = self.position, max(self.position, end)
+        with memoryview(self.data) as data:
+            return bytes(data[start:end])
+
+    def readinto(self, buffer):
+        view = self.reader()
+        size = len(view) if view is not None else self.length
+        position = self.tell()
+        length = min(len(buffer), max(0, size - position))
+        with memoryview(view if view is not None else self.data) as source:
+            buffer[:length] = source[position:position + length]
+        self.seek(position + length)
+        return length
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        view = self.reader()
+        if view is not None:
+            view.seek(offset, whence)
+            return view.tell()
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        view = self.reader()
+        return view.tell() if view is not None else self.position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.view is not None:
+            self.view.close()
+        if self.file is not None:
+            self.file.close()
+        self.data = bytearray()
+        self.budget.release(self.reserved)
+        self.reserved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # Backstop so a buffer that is never closed still returns its budget
+        self.close()
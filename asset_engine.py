@@ -0,0 +1,708 @@
+import contextvars
+import logging
+import os
+import struct
+
+import requests
+
+from admission import Overloaded, pools
+from asset_buffer import memory_budget
+from asset_fetch import (
+    FINGERPRINT_SIZE, MAX_BOX_FETCHES, MAX_PROBE_SIZE, MAX_REMOTE_BYTES, MAX_TAIL_SIZE, PROBE_SIZE, REMOTE_BLOCK_SIZE,
+    TAIL_SIZE, AssetFetchError, RangeNotSupported, RemoteFile, SparseFile, UnsupportedContainer, download_to_buffer,
+    fetch_fingerprint, fetch_image_size, fetch_moov_file, fetch_range, fetch_stream_metadata, fetch_tail_moov,
+)
+from asset_metrics import request_seconds, time_strategy
+from deadline import DeadlineExceeded
+from failure_guard import AssetNotFound, CircuitOpen, circuit_breaker, negative_cache
+from fingerprint_index import FingerprintIndex
+from host_capabilities import capabilities
+from media_probe import VIDEO_FIELDS, keyframe_location, read_moov
+from metadata_cache import CACHE_MAX_ENTRIES, CACHE_PATH, CACHE_TTL, MetadataCache
+from parse_pool import parse_pool
+from singleflight import SingleFlight
+from stream_manifest import ManifestError, manifest_kind
+from thumbnails import (
+    MAX_KEYFRAME_SIZE, MOOV_CACHE_BYTES, THUMBNAIL_CACHE_BYTES, THUMBNAIL_FORMATS, THUMBNAIL_WIDTH, MoovCache,
+    ThumbnailCache, ThumbnailError, decode_keyframe, parse_options, render_thumbnail, to_annex_b,
+)
+
+logger = logging.getLogger(__name__)
+
+# Strategies tried for MP4/MOV videos, in order unless the capability store knows better
+VIDEO_STRATEGIES = tuple(os.environ.get('ASSET_VIDEO_STRATEGIES', 'range,tail,full').split(','))
+
+# Strategies tried once the first bytes show a container other than MP4/MOV
+OTHER_CONTAINER_STRATEGIES = ('remote', 'full')
+
+# Strategies the capability store orders; plugged-in ones keep their configured place after these
+ADAPTIVE_STRATEGIES = ('range', 'tail', 'full')
+
+# Failures that end the chain, since every further strategy would fail the same way
+FATAL_ERRORS = (AssetNotFound, CircuitOpen)
+
+# Failures reported to the caller as they are rather than as a failed lookup
+PASSTHROUGH_ERRORS = (DeadlineExceeded, Overloaded)
+
+# Failures to fetch a file, after which the next strategy of the chain may still read it
+FETCH_ERRORS = (AssetFetchError, requests.RequestException, OSError)
+
+# Optional fields that may be requested on top of the default metadata, per asset type
+ASSET_FIELDS = {'video': VIDEO_FIELDS, 'image': ()}
+
+# (url, probe) of the first bytes of the video being looked up, already fetched for its fingerprint
+current_probe = contextvars.ContextVar('asset_probe', default=(None, None))
+
+
+class AssetMetadataError(Exception):
+    pass
+
+
+def parse_fields(asset_type, fields):
+    """
+    Validate the optional fields requested for an asset
+
+    Args:
+        asset_type (str): Type of asset - video or image
+        fields: List of field names or a comma-separated string, may be empty
+
+    Returns:
+        tuple: The requested fields without duplicates, in the order of ASSET_FIELDS
+
+    Raises:
+        AssetMetadataError: If fields is malformed or names a field the asset type does not have
+    """
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    if not isinstance(fields, (list, tuple)) or not all(isinstance(field, str) for field in fields):
+        raise AssetMetadataError('fields must be a list of field names')
+    requested = {field.strip() for field in fields if field.strip()}
+    allowed = ASSET_FIELDS[asset_type]
+    unknown = sorted(requested.difference(allowed))
+    if unknown:
+        raise AssetMetadataError(f'Unsupported fields for {asset_type}: {", ".join(unknown)}')
+    return tuple(field for field in allowed if field in requested)
+
+
+def cache_type(asset_type, fields):
+    """
+    Returns:
+        str: Asset type under which metadata with these fields is cached, e.g. 'video:codec,rotation'
+    """
+    return f'{asset_type}:{",".join(fields)}' if fields else asset_type
+
+
+class EngineConfig:
+    """
+    Settings of the asset metadata engine, shared by every service using it
+    """
+
+    def __init__(self, probe_size=PROBE_SIZE, max_probe_size=MAX_PROBE_SIZE, max_box_fetches=MAX_BOX_FETCHES,
+                 tail_size=TAIL_SIZE, max_tail_size=MAX_TAIL_SIZE,
+                 remote_block_size=REMOTE_BLOCK_SIZE, max_remote_bytes=MAX_REMOTE_BYTES,
+                 video_strategies=VIDEO_STRATEGIES, other_container_strategies=OTHER_CONTAINER_STRATEGIES,
+                 adaptive=True, cache_path=CACHE_PATH, cache_ttl=CACHE_TTL, cache_max_entries=CACHE_MAX_ENTRIES,
+                 fingerprint_size=FINGERPRINT_SIZE, thumbnail_cache_bytes=THUMBNAIL_CACHE_BYTES,
+                 moov_cache_bytes=MOOV_CACHE_BYTES):
+        """
+        Args:
+            probe_size (int): First range request for a video, see moov_plan
+            max_probe_size (int): Largest first range request
+            max_box_fetches (int): Range requests spent walking to moov
+            tail_size (int): First suffix request for a trailing moov
+            max_tail_size (int): Largest suffix request
+            remote_block_size (int): Range granularity when the parser drives the fetch
+            max_remote_bytes (int): Bytes the parser may pull before giving up
+            video_strategies (tuple): Strategy chain for videos
+            other_container_strategies (tuple): Chain once a video turns out not to be MP4/MOV
+            adaptive (bool): Let the capability store reorder the chain and size the first requests
+            cache_path (str): SQLite file of the metadata cache, or None for memory only
+            cache_ttl (int): Seconds cached metadata is served before it is revalidated
+            cache_max_entries (int): Size of the in-process cache tier
+            fingerprint_size (int): Bytes hashed from the start of a video to recognise
+                it under another URL, 0 to disable the fingerprint index
+            thumbnail_cache_bytes (int): Size of the in-process thumbnail cache tier
+            moov_cache_bytes (int): Size of the in-process cache of moov boxes kept for thumbnails
+        """
+        self.probe_size = probe_size
+        self.max_probe_size = max_probe_size
+        self.max_box_fetches = max_box_fetches
+        self.tail_size = tail_size
+        self.max_tail_size = max_tail_size
+        self.remote_block_size = remote_block_size
+        self.max_remote_bytes = max_remote_bytes
+        self.video_strategies = tuple(video_strategies)
+        self.other_container_strategies = tuple(other_container_strategies)
+        self.adaptive = adaptive
+        self.cache_path = cache_path
+        self.cache_ttl = cache_ttl
+        self.cache_max_entries = cache_max_entries
+        self.fingerprint_size = fingerprint_size
+        self.thumbnail_cache_bytes = thumbnail_cache_bytes
+        self.moov_cache_bytes = moov_cache_bytes
+
+
+def probe_size_for(engine, video_url):
+    """
+    Returns:
+        int: Size of the first range request for a video
+    """
+    config = engine.config
+    if config.adaptive:
+        return min(capabilities.probe_size(video_url, config.probe_size), config.max_probe_size)
+    return config.probe_size
+
+
+def probe_for(video_url):
+    """
+    Returns:
+        tuple: (window, total_size) of the start of a video fetched with its
+        fingerprint in this lookup, or None
+    """
+    probe_url, probe = current_probe.get()
+    return probe if probe_url == video_url else None
+
+
+def range_moov(engine, video_url):
+    """
+    Returns:
+        SparseFile: The video with its ftyp and moov boxes fetched by range requests
+    """
+    return fetch_moov_file(
+        video_url, probe_size_for(engine, video_url), engine.config.max_box_fetches, probe_for(video_url),
+    )
+
+
+def tail_size_for(engine, video_url):
+    """
+    Returns:
+        int: Size of the first suffix request for a video
+    """
+    config = engine.config
+    if config.adaptive:
+        return min(capabilities.tail_size(video_url, config.tail_size), config.max_tail_size)
+    return config.tail_size
+
+
+def tail_moov(engine, video_url):
+    """
+    Returns:
+        SparseFile: The video with its head and trailing moov box fetched by range requests
+    """
+    return fetch_tail_moov(
+        video_url, tail_size_for(engine, video_url), engine.config.max_tail_size, probe_for(video_url),
+    )
+
+
+def full_moov(engine, video_url):
+    """
+    Returns:
+        SpoolBuffer: The whole video, for hosts that ignore range requests
+    """
+    return download_to_buffer(video_url)
+
+
+def range_strategy(engine, video_url, fields):
+    """
+    Fetch only the ftyp and moov boxes with range requests, wherever moov sits
+    """
+    sparse_file = range_moov(engine, video_url)
+    engine.remember_moov(video_url, sparse_file)
+    return engine.parse_video(sparse_file, fields)
+
+
+def tail_strategy(engine, video_url, fields):
+    """
+    Fetch the head and the trailing moov box with a suffix range request
+    """
+    sparse_file = tail_moov(engine, video_url)
+    engine.remember_moov(video_url, sparse_file)
+    return engine.parse_video(sparse_file, fields)
+
+
+def remote_strategy(engine, video_url, fields):
+    """
+    Let the parser pull just the ranges it reads, for containers other than MP4/MOV
+    """
+    config = engine.config
+    with RemoteFile(video_url, config.remote_block_size, config.max_remote_bytes) as remote_file:
+        return engine.parse_video(remote_file, fields)
+
+
+def full_strategy(engine, video_url, fields):
+    """
+    Download the whole file; large downloads are spilled to disk rather than held in memory
+    """
+    with full_moov(engine, video_url) as temp_file:
+        head = temp_file.read(1024)
+        temp_file.seek(0)
+        if manifest_kind(video_url, head):
+            raise UnsupportedContainer('File is an HLS or DASH manifest', head)
+        return engine.parse_video(temp_file, fields)
+
+
+# How the moov box of a video is fetched for thumbnails, by the strategy it corresponds to
+MOOV_FETCHERS = {
+    'range': range_moov,
+    'tail': tail_moov,
+    'full': full_moov,
+}
+
+
+def manifest_strategy(engine, stream_url, fields):
+    """
+    Read an HLS or DASH stream's metadata from its manifest, without fetching media segments
+
+    Manifests only state duration and resolution, so optional fields are left unknown.
+    """
+    return fetch_stream_metadata(stream_url)
+
+
+def with_fields(metadata, fields):
+    """
+    Returns:
+        dict: The metadata with each requested field, None where the video does not record it
+    """
+    return dict(metadata, **{field: metadata.get(field) for field in fields})
+
+
+def chain_failed(tried):
+    """
+    Returns:
+        AssetMetadataError: The error reported once every strategy of a video's chain failed
+    """
+    if 'manifest' in tried:
+        return AssetMetadataError('Failed to get stream metadata')
+    return AssetMetadataError('Failed to get video metadata')
+
+
+def locate_keyframe(moov, keyframe):
+    """
+    Locate a keyframe in the sample tables of a moov box, see media_probe.keyframe_location
+
+    Raises:
+        ThumbnailError: If there is no such keyframe, it is too large or the moov box is malformed
+    """
+    try:
+        location = keyframe_location(moov, keyframe)
+    except (struct.error, IndexError, ValueError) as e:
+        raise ThumbnailError(f'Malformed sample tables: {e}')
+    if location is None:
+        raise ThumbnailError(f'No H.264 or HEVC keyframe {keyframe} in the video')
+    if location['size'] > MAX_KEYFRAME_SIZE:
+        raise ThumbnailError(f'Keyframe {keyframe} is too large ({location["size"]} bytes)')
+    return location
+
+
+class AssetEngine:
+    """
+    Metadata lookups for videos and images, shared by all services
+
+    A lookup goes through the metadata cache, then coalesces with identical
+    lookups in flight and is admitted to the pool of its asset type. A video
+    already parsed under another URL is then recognised by its fingerprint;
+    otherwise it runs a chain of fetch strategies: the container is sniffed from the
+    URL (HLS/DASH manifests) or from the first bytes read, and MP4/MOV goes
+    through range, tail and full download until one yields metadata.
+    Strategies are plain functions strategy(engine, url, fields) registered
+    by name, where fields are the optional fields the caller asked for.
+    """
+
+    def __init__(self, config=None):
+        """
+        Args:
+            config (EngineConfig): Settings, by default from the environment
+        """
+        self.config = config or EngineConfig()
+        self.metadata_cache = MetadataCache(
+            self.config.cache_path, self.config.cache_ttl, self.config.cache_max_entries,
+        )
+        self.fingerprints = FingerprintIndex(
+            self.config.cache_path, self.config.cache_max_entries, self.config.cache_ttl,
+        )
+        self.thumbnail_cache = ThumbnailCache(
+            self.config.cache_path, self.config.cache_ttl, self.config.thumbnail_cache_bytes,
+        )
+        self.moovs = MoovCache(self.config.cache_ttl, self.config.moov_cache_bytes)
+        # Concurrent requests for the same asset share one fetch and parse
+        self.inflight = SingleFlight()
+        self.strategies = {}
+        self.ranged = set()
+        self.register('range', range_strategy)
+        self.register('tail', tail_strategy)
+        self.register('remote', remote_strategy)
+        self.register('full', full_strategy, ranged=False)
+        self.register('manifest', manifest_strategy, ranged=False)
+
+    def register(self, name, strategy, ranged=True):
+        """
+        Add or replace a video fetch strategy
+
+        Args:
+            name (str): Name used in the configured chains and in metrics
+            strategy (callable): strategy(engine, video_url, fields) returning the metadata dict
+            ranged (bool): Whether it relies on range requests, so it is skipped
+                for hosts that ignore them
+        """
+        self.strategies[name] = strategy
+        if ranged:
+            self.ranged.add(name)
+        else:
+            self.ranged.discard(name)
+
+    def handle(self, url, asset_type, fields=()):
+        """
+        Get the metadata of an asset, from the cache when possible
+
+        Args:
+            url (str): URL of the asset
+            asset_type (str): Type of asset - video or image
+            fields: Optional fields to add, see ASSET_FIELDS; only these are parsed
+                beyond duration and dimension, from the bytes fetched anyway
+
+        Returns:
+            dict: Metadata containing duration (if video), dimension and the requested fields
+
+        Raises:
+            AssetMetadataError: If the metadata could not be read or a field is not supported
+            Overloaded: If the pool for the asset type is saturated
+            DeadlineExceeded: If the caller's deadline passed or it disconnected
+        """
+        if asset_type not in pools:
+            raise AssetMetadataError('Unsupported asset type')
+        fields = parse_fields(asset_type, fields)
+
+        def compute(url, _):
+            return self.compute(url, asset_type, fields)
+
+        with request_seconds.time(type=asset_type):
+            # Each field set is cached on its own, so plain lookups never pay for extra parsing
+            metadata = self.metadata_cache.get_hit(url, cache_type(asset_type, fields))
+            if metadata is not None:
+                return metadata
+            # Only misses and stale entries pay for coalescing
+            return self.inflight.do(
+                (url, asset_type, fields), self.metadata_cache.get_or_compute, url, cache_type(asset_type, fields), compute,
+            )
+
+    def compute(self, url, asset_type, fields=()):
+        # Each asset type has its own bounded pool, so queued videos never delay images
+        return pools[asset_type].run(self.lookup, url, asset_type, fields)
+
+    def lookup(self, url, asset_type, fields=()):
+        """
+        Get the metadata of an asset without the cache, reusing that of an
+        identical asset seen under another URL
+        """
+        fingerprint, probe = self.fingerprint(url, asset_type)
+        if fingerprint is not None:
+            metadata = self.fingerprints.get(fingerprint, cache_type(asset_type, fields))
+            if metadata is not None:
+                logger.info(f'{url} matches an asset already seen ({fingerprint})')
+                return metadata
+        # The range and tail strategies start from the bytes fetched for the fingerprint
+        token = current_probe.set((url, probe))
+        try:
+            metadata = self.get_metadata(url, asset_type, fields)
+        finally:
+            current_probe.reset(token)
+        if fingerprint is not None and metadata:
+            self.fingerprints.put(fingerprint, cache_type(asset_type, fields), metadata)
+        return metadata
+
+    def fingerprint(self, url, asset_type):
+        """
+        Returns:
+            tuple: (fingerprint, probe) of a video, see fetch_fingerprint, or
+            (None, None) if it is not worth or not possible to take
+        """
+        if not self.wants_fingerprint(url, asset_type):
+            return None, None
+        try:
+            with time_strategy('fingerprint'):
+                return fetch_fingerprint(url, self.config.fingerprint_size, probe_size_for(self, url))
+        except PASSTHROUGH_ERRORS:
+            raise
+        except RangeNotSupported as e:
+            logger.info(e)
+            capabilities.record_range_support(url, False)
+        except Exception as e:
+            logger.info(f'No fingerprint for {url}: {e}')
+        return None, None
+
+    def wants_fingerprint(self, url, asset_type):
+        """
+        Returns:
+            bool: True if an asset is worth fingerprinting before it is parsed
+        """
+        # Image headers are about as cheap to read as a fingerprint, and streams have no single file
+        if asset_type != 'video' or not self.config.fingerprint_size or manifest_kind(url):
+            return False
+        return 'range' in capabilities.video_strategies(url)
+
+    def is_cached(self, url, asset_type):
+        return self.metadata_cache.contains(url, asset_type)
+
+    def get_metadata(self, url, asset_type, fields=()):
+        """
+        Get the metadata of an asset without the cache
+        """
+        if asset_type == 'video':
+            return self.video_metadata(url, fields)
+        return self.image_metadata(url)
+
+    def video_chain(self, video_url):
+        """
+        Returns:
+            tuple: Names of the strategies to try for a video, in order
+        """
+        if manifest_kind(video_url):
+            return ('manifest',)
+        configured = self.config.video_strategies
+        if not self.config.adaptive:
+            return configured
+        # Hosts known to ignore ranges or to keep moov at the end skip straight to what works
+        preferred = tuple(name for name in capabilities.video_strategies(video_url) if name in configured)
+        return preferred + tuple(name for name in configured if name not in ADAPTIVE_STRATEGIES)
+
+    def video_metadata(self, video_url, fields=()):
+        """
+        Get the metadata of a video, trying each strategy of its chain in turn
+
+        Args:
+            video_url (str): URL of the video
+            fields (tuple): Optional fields to read as well, see media_probe.VIDEO_FIELDS
+
+        Returns:
+            dict: Metadata containing duration, dimension and the requested
+            fields, None for those the video does not record
+        """
+        chain = list(self.video_chain(video_url))
+        tried = []
+        while chain:
+            name = chain.pop(0)
+            tried.append(name)
+            try:
+                return with_fields(self.run_strategy(name, video_url, fields), fields)
+            except Exception as e:
+                chain = self.next_strategies(video_url, name, e, chain, tried)
+        raise chain_failed(tried)
+
+    def next_strategies(self, video_url, name, error, chain, tried):
+        """
+        Decide what to try after a strategy of a video's chain failed
+
+        Shared with the asyncio chain, see asset_engine_async.
+
+        Args:
+            video_url (str): URL of the video
+            name (str): Strategy that failed
+            error (Exception): What it raised
+            chain (list): Strategies still to try
+            tried (list): Strategies tried so far, name included
+
+        Returns:
+            list: Strategies to try next, empty to give up
+
+        Raises:
+            The error itself if it is reported as it is, or AssetMetadataError
+            if the video was read and there is nothing more to try
+        """
+        if isinstance(error, PASSTHROUGH_ERRORS):
+            raise error
+        if isinstance(error, FATAL_ERRORS):
+            logger.info(error)
+            return []
+        if isinstance(error, UnsupportedContainer):
+            if manifest_kind(video_url, error.head) and 'manifest' not in tried:
+                # Playlists are not always served under a .m3u8 or .mpd path
+                logger.info(f'{video_url} is an HLS or DASH manifest')
+                return ['manifest']
+            logger.info(f'{error}, parsing {video_url} with on-demand range requests')
+            return [name for name in self.config.other_container_strategies if name not in tried]
+        if isinstance(error, RangeNotSupported):
+            logger.info(error)
+            return [name for name in chain if name not in self.ranged]
+        # The file was read and parsed; another strategy would only read the same bytes
+        if isinstance(error, AssetMetadataError):
+            raise error
+        if isinstance(error, ManifestError):
+            raise AssetMetadataError(f'Failed to get stream metadata: {error}')
+        if isinstance(error, FETCH_ERRORS):
+            logger.info(f'{name} strategy failed for {video_url}: {error}')
+            return chain
+        logger.error(f'{name} strategy failed for {video_url}: {error}')
+        return []
+
+    def run_strategy(self, name, video_url, fields=()):
+        """
+        Run a single video strategy, without falling back to others
+        """
+        with time_strategy(name):
+            return self.strategies[name](self, video_url, fields)
+
+    def parse_video(self, temp_file, fields=()):
+        """
+        Read the container headers directly, using MediaInfo only for layouts the probe does not know
+        """
+        metadata = parse_pool.parse_video(temp_file, fields)
+        if metadata:
+            return metadata
+        raise AssetMetadataError('No video stream found')
+
+    def image_metadata(self, image_url):
+        """
+        Returns:
+            dict: Metadata containing dimension
+        """
+        try:
+            width, height = fetch_image_size(image_url)
+        except PASSTHROUGH_ERRORS:
+            raise
+        except Exception as e:
+            logger.error(e)
+            raise AssetMetadataError('Failed to get image metadata')
+        return {'dimension': f'{width}x{height}'}
+
+    def thumbnail(self, video_url, keyframe=0, width=THUMBNAIL_WIDTH, image_format='jpeg'):
+        """
+        Get a thumbnail of a video from one of its keyframes, from the cache when possible
+
+        Only the moov box, located as for metadata, and the keyframe sample
+        itself are fetched; the sample is decoded with ffmpeg.
+
+        Args:
+            video_url (str): URL of an MP4/MOV video with H.264 or HEVC video
+            keyframe (int): 0-based index of the keyframe, 0 for the first
+            width (int): Largest width of the thumbnail; frames are never scaled up
+            image_format (str): jpeg or webp
+
+        Returns:
+            tuple: (image, content_type) of the encoded thumbnail
+
+        Raises:
+            AssetMetadataError: If an option is invalid or the keyframe could not be read
+            Overloaded: If the video pool is saturated
+            DeadlineExceeded: If the caller's deadline passed or it disconnected
+        """
+        try:
+            options = parse_options(keyframe, width, image_format)
+        except ThumbnailError as e:
+            raise AssetMetadataError(str(e))
+
+        def compute():
+            return pools['video'].run(self.render_thumbnail, video_url, *options)
+
+        cache_key = ':'.join(map(str, options))
+        with request_seconds.time(type='thumbnail'):
+            image = self.thumbnail_cache.get_hit(video_url, cache_key)
+            if image is None:
+                image = self.inflight.do(
+                    ('thumbnail', video_url, options), self.thumbnail_cache.get_or_compute,
+                    video_url, cache_key, compute,
+                )
+        return image, THUMBNAIL_FORMATS[options[2]][1]
+
+    def render_thumbnail(self, video_url, keyframe, width, image_format):
+        """
+        Fetch, decode and encode a keyframe without the cache
+        """
+        try:
+            location, sample = self.fetch_keyframe(video_url, keyframe)
+            stream = to_annex_b(sample, location['nal_length_size'], location['parameter_sets'])
+            image = decode_keyframe(location['codec'], stream)
+            return render_thumbnail(image, width, image_format, location['rotation'])
+        except PASSTHROUGH_ERRORS:
+            raise
+        except (ThumbnailError, UnsupportedContainer) as e:
+            raise AssetMetadataError(str(e))
+
+    def fetch_keyframe(self, video_url, keyframe):
+        """
+        Fetch the moov box of a video, from the moov cache or trying the fetch
+        strategies of its chain in turn, and then the sample of the keyframe
+
+        Returns:
+            tuple: (location, sample) where location is as returned by media_probe.keyframe_location
+        """
+        if manifest_kind(video_url):
+            raise ThumbnailError('Thumbnails are not supported for HLS or DASH streams')
+        moov = self.moovs.get(video_url)
+        if moov is not None:
+            location = locate_keyframe(moov, keyframe)
+            try:
+                sample, _ = fetch_range(video_url, location['offset'], location['offset'] + location['size'] - 1)
+                return location, sample
+            except PASSTHROUGH_ERRORS + FATAL_ERRORS:
+                raise
+            except FETCH_ERRORS as e:
+                logger.info(f'Cached moov of {video_url} not usable: {e}')
+
+        chain = [name for name in self.video_chain(video_url) if name in MOOV_FETCHERS]
+        while chain:
+            name = chain.pop(0)
+            try:
+                with time_strategy(f'thumbnail_{name}'), MOOV_FETCHERS[name](self, video_url) as file:
+                    moov = read_moov(file)
+                    if moov is None:
+                        file.seek(0)
+                        if manifest_kind(video_url, file.read(1024)):
+                            raise ThumbnailError('Thumbnails are not supported for HLS or DASH streams')
+                        raise ThumbnailError('No moov box found')
+                    location = locate_keyframe(moov, keyframe)
+                    if isinstance(file, SparseFile):
+                        # Only range requests can fetch other keyframes against a cached moov
+                        self.moovs.put(video_url, moov)
+                        sample, _ = fetch_range(video_url, location['offset'], location['offset'] + location['size'] - 1)
+                    else:
+                        file.seek(location['offset'])
+                        sample = file.read(location['size'])
+                    return location, sample
+            except PASSTHROUGH_ERRORS + (ThumbnailError,):
+                raise
+            except UnsupportedContainer as e:
+                if manifest_kind(video_url, e.head):
+                    raise ThumbnailError('Thumbnails are not supported for HLS or DASH streams')
+                raise
+            except FATAL_ERRORS as e:
+                logger.info(e)
+                break
+            except RangeNotSupported as e:
+                logger.info(e)
+                chain = [name for name in chain if name not in self.ranged]
+            except FETCH_ERRORS as e:
+                logger.info(f'{name} moov fetch failed for {video_url}: {e}')
+            except Exception as e:
+                logger.error(f'{name} moov fetch failed for {video_url}: {e}')
+                break
+        raise AssetMetadataError('Failed to get video keyframe')
+
+    def remember_moov(self, video_url, sparse_file):
+        """
+        Keep the moov box fetched for a video's metadata, for thumbnails of it
+        """
+        moov = read_moov(sparse_file)
+        sparse_file.seek(0)
+        if moov is not None:
+            self.moovs.put(video_url, moov)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Stats of the engine's parts, keyed by the name they are exported under on /metrics
+        """
+        return {
+            'cache': self.metadata_cache.stats(),
+            'fingerprints': self.fingerprints.stats(),
+            'thumbnails': self.thumbnail_cache.stats(),
+            'moovs': self.moovs.stats(),
+            'singleflight': self.inflight.stats(),
+            'memory_budget': {'used_bytes': memory_budget.used, 'limit_bytes': memory_budget.limit},
+            'negative_cache': negative_cache.stats(),
+            'circuit_breaker': circuit_breaker.stats(),
+            'video_pool': pools['video'].stats(),
+            'image_pool': pools['image'].stats(),
+        }
+
+
+engine = AssetEngine()
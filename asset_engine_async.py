@@ -0,0 +1,236 @@
+import asyncio
+import contextvars
+import logging
+
+from admission import pools
+from asset_engine import (
+    PASSTHROUGH_ERRORS, AssetMetadataError, cache_type, chain_failed, current_probe, parse_fields, probe_for,
+    probe_size_for, tail_size_for, with_fields,
+)
+from asset_fetch import RangeNotSupported, UnsupportedContainer, moov_plan, tail_moov_plan
+from asset_fetch_async import fetch_fingerprint, fetch_full, fetch_image_size, fetch_stream_metadata, run_plan
+from asset_metrics import request_seconds, time_strategy
+from host_capabilities import capabilities
+from http_session import collect_validators
+from singleflight import AsyncSingleFlight
+from stream_manifest import manifest_kind
+from thumbnails import THUMBNAIL_WIDTH
+
+logger = logging.getLogger(__name__)
+
+
+async def range_strategy(engine, video_url, fields):
+    """
+    Async counterpart of asset_engine.range_strategy
+    """
+    plan = moov_plan(probe_size_for(engine, video_url), engine.config.max_box_fetches, probe_for(video_url))
+    sparse_file = await run_plan(engine.client, video_url, plan)
+    engine.remember_moov(video_url, sparse_file)
+    return await engine.parse_video(sparse_file, fields)
+
+
+async def tail_strategy(engine, video_url, fields):
+    """
+    Async counterpart of asset_engine.tail_strategy
+    """
+    plan = tail_moov_plan(tail_size_for(engine, video_url), engine.config.max_tail_size, probe_for(video_url))
+    sparse_file = await run_plan(engine.client, video_url, plan)
+    engine.remember_moov(video_url, sparse_file)
+    return await engine.parse_video(sparse_file, fields)
+
+
+async def full_strategy(engine, video_url, fields):
+    """
+    Async counterpart of asset_engine.full_strategy
+    """
+    with await fetch_full(engine.client, video_url) as temp_file:
+        head = temp_file.read(1024)
+        temp_file.seek(0)
+        if manifest_kind(video_url, head):
+            raise UnsupportedContainer('File is an HLS or DASH manifest', head)
+        return await engine.parse_video(temp_file, fields)
+
+
+async def manifest_strategy(engine, stream_url, fields):
+    """
+    Async counterpart of asset_engine.manifest_strategy
+    """
+    return await fetch_stream_metadata(engine.client, stream_url)
+
+
+class AsyncAssetEngine:
+    """
+    asyncio front of an AssetEngine
+
+    Lookups share the engine's metadata cache, fingerprint index, settings,
+    strategy chain and pools, but fetch with an httpx client on the event
+    loop, so one process keeps thousands of fetches in flight. Strategies
+    registered here run on the loop; any other strategy of the engine's
+    chain, such as 'remote' whose parser pulls ranges as it reads, runs as it
+    is on the video pool. Parses always run on the pools.
+    """
+
+    def __init__(self, engine, client=None):
+        """
+        Args:
+            engine (AssetEngine): Engine whose caches, settings and chain are used
+            client (AssetClient): Client for the fetches, see asset_fetch_async.create_client
+        """
+        self.engine = engine
+        self.config = engine.config
+        self.client = client
+        # Lookups on the loop coalesce here; thumbnails still go through the engine's own
+        self.inflight = AsyncSingleFlight()
+        self.strategies = {}
+        self.register('range', range_strategy)
+        self.register('tail', tail_strategy)
+        self.register('full', full_strategy)
+        self.register('manifest', manifest_strategy)
+
+    def register(self, name, strategy):
+        """
+        Add or replace the async counterpart of a strategy of the engine
+
+        Args:
+            name (str): Name of the strategy in the engine's chains
+            strategy (callable): Coroutine function strategy(async_engine, video_url, fields)
+                returning the metadata dict
+        """
+        self.strategies[name] = strategy
+
+    async def in_thread(self, function, *args):
+        # Cache and index lookups may hit SQLite, which must not block the loop
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def run_in_pool(self, asset_type, function, *args):
+        # Admitted to, and shed by, the same pools as the blocking services; the worker sees the deadline
+        return await asyncio.wrap_future(pools[asset_type].submit(function, *args))
+
+    async def handle(self, url, asset_type, fields=()):
+        """
+        Async counterpart of AssetEngine.handle
+        """
+        if asset_type not in pools:
+            raise AssetMetadataError('Unsupported asset type')
+        fields = parse_fields(asset_type, fields)
+        with request_seconds.time(type=asset_type):
+            return await self.inflight.do((url, asset_type, fields), self.get_or_compute, url, asset_type, fields)
+
+    async def get_or_compute(self, url, asset_type, fields):
+        """
+        Like MetadataCache.get_or_compute, except that stale entries are
+        looked up again rather than revalidated
+        """
+        cache = self.engine.metadata_cache
+        key = cache_type(asset_type, fields)
+        metadata = await self.in_thread(cache.get_fresh, url, key)
+        if metadata is not None:
+            return metadata
+        with collect_validators() as validators:
+            metadata = await self.lookup(url, asset_type, fields)
+        if metadata:
+            etag, last_modified = validators.get(url, (None, None))
+            await self.in_thread(cache.put, url, key, metadata, etag, last_modified)
+        return metadata
+
+    async def lookup(self, url, asset_type, fields=()):
+        """
+        Async counterpart of AssetEngine.lookup
+        """
+        fingerprints = self.engine.fingerprints
+        fingerprint, probe = await self.fingerprint(url, asset_type)
+        if fingerprint is not None:
+            metadata = await self.in_thread(fingerprints.get, fingerprint, cache_type(asset_type, fields))
+            if metadata is not None:
+                logger.info(f'{url} matches an asset already seen ({fingerprint})')
+                return metadata
+        token = current_probe.set((url, probe))
+        try:
+            metadata = await self.get_metadata(url, asset_type, fields)
+        finally:
+            current_probe.reset(token)
+        if fingerprint is not None and metadata:
+            await self.in_thread(fingerprints.put, fingerprint, cache_type(asset_type, fields), metadata)
+        return metadata
+
+    async def fingerprint(self, url, asset_type):
+        """
+        Async counterpart of AssetEngine.fingerprint
+        """
+        if not self.engine.wants_fingerprint(url, asset_type):
+            return None, None
+        try:
+            with time_strategy('fingerprint'):
+                return await fetch_fingerprint(
+                    self.client, url, self.config.fingerprint_size, probe_size_for(self, url),
+                )
+        except PASSTHROUGH_ERRORS:
+            raise
+        except RangeNotSupported as e:
+            logger.info(e)
+            capabilities.record_range_support(url, False)
+        except Exception as e:
+            logger.info(f'No fingerprint for {url}: {e}')
+        return None, None
+
+    async def get_metadata(self, url, asset_type, fields=()):
+        if asset_type == 'video':
+            return await self.video_metadata(url, fields)
+        return await self.image_metadata(url)
+
+    async def video_metadata(self, video_url, fields=()):
+        """
+        Async counterpart of AssetEngine.video_metadata, with the same chain and fallbacks
+        """
+        chain = list(self.engine.video_chain(video_url))
+        tried = []
+        while chain:
+            name = chain.pop(0)
+            tried.append(name)
+            try:
+                return with_fields(await self.run_strategy(name, video_url, fields), fields)
+            except Exception as e:
+                chain = self.engine.next_strategies(video_url, name, e, chain, tried)
+        raise chain_failed(tried)
+
+    async def run_strategy(self, name, video_url, fields=()):
+        with time_strategy(name):
+            strategy = self.strategies.get(name)
+            if strategy is not None:
+                return await strategy(self, video_url, fields)
+            return await self.run_in_pool('video', self.engine.strategies[name], self.engine, video_url, fields)
+
+    async def parse_video(self, temp_file, fields=()):
+        return await self.run_in_pool('video', self.engine.parse_video, temp_file, fields)
+
+    def remember_moov(self, video_url, sparse_file):
+        self.engine.remember_moov(video_url, sparse_file)
+
+    async def image_metadata(self, image_url):
+        """
+        Async counterpart of AssetEngine.image_metadata
+        """
+        try:
+            width, height = await fetch_image_size(self.client, image_url)
+        except PASSTHROUGH_ERRORS:
+            raise
+        except Exception as e:
+            logger.error(e)
+            raise AssetMetadataError('Failed to get image metadata')
+        return {'dimension': f'{width}x{height}'}
+
+    async def thumbnail(self, video_url, keyframe=0, width=THUMBNAIL_WIDTH, image_format='jpeg'):
+        """
+        AssetEngine.thumbnail on a thread; decoding the keyframe dominates its cost
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, context.run, self.engine.thumbnail, video_url, keyframe, width, image_format,
+        )
+
+    def stats(self):
+        """
+        Returns:
+            dict: The engine's stats, with those of the lookups coalesced on the loop
+        """
+        return dict(self.engine.stats(), async_singleflight=self.inflight.stats())
@@ -0,0 +1,808 @@
+import hashlib
+import io
+import logging
+import os
+import re
+
+import requests
+from PIL import Image
+
+from asset_buffer import SpoolBuffer, chunk_size_for
+from asset_metrics import bytes_fetched, phase_seconds, record_transfer, time_phase
+from deadline import check_deadline
+from host_capabilities import capabilities
+from http_session import get_session
+from media_probe import is_iso_bmff, is_sniffable_image, read_box_header, sniff_image_size
+from stream_manifest import stream_plan
+
+logger = logging.getLogger(__name__)
+
+# First request made for a video; large enough to hold ftyp and a faststart moov header
+PROBE_SIZE = 64 * 1024
+
+# Largest first request for a video however big the moov boxes seen on its host;
+# the rest of a larger moov is fetched by one more range request
+MAX_PROBE_SIZE = 4 * 1024 * 1024
+
+# Upper bound on range requests spent walking top-level boxes before giving up
+MAX_BOX_FETCHES = 6
+
+# Initial and maximum size of the suffix request used to find a trailing moov
+TAIL_SIZE = 512 * 1024
+MAX_TAIL_SIZE = 16 * 1024 * 1024
+
+# Block size of on-demand range requests made while a parser reads a remote file
+REMOTE_BLOCK_SIZE = 256 * 1024
+
+# Bytes a parser may pull from a remote file before it is cheaper to download it whole
+MAX_REMOTE_BYTES = int(os.environ.get('ASSET_MAX_REMOTE_BYTES', 16 * 1024 * 1024))
+
+# Largest HLS playlist, DASH MPD or init segment read while probing a stream
+MAX_MANIFEST_SIZE = 8 * 1024 * 1024
+
+# Images are streamed in chunks of this size until their dimensions are known
+IMAGE_CHUNK_SIZE = 16 * 1024
+
+# Most headers fit in a few KB, but JPEG EXIF/ICC segments can push SOF further out
+MAX_IMAGE_HEADER_SIZE = 1024 * 1024
+
+# Bytes hashed from the start of a file to fingerprint its content, with its size
+FINGERPRINT_SIZE = 4 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class AssetFetchError(Exception):
+    pass
+
+
+class RangeNotSupported(AssetFetchError):
+    pass
+
+
+class UnsupportedContainer(AssetFetchError):
+    def __init__(self, message, head=b''):
+        super().__init__(message)
+        # First bytes of the file, so the caller can sniff what it is instead
+        self.head = head
+
+
+class SparseFile(io.RawIOBase):
+    """
+    Read-only file of a known size of which only a few segments were fetched
+
+    Unfetched gaps read as zeros, so boxes keep their original offsets and
+    MediaInfo can be handed the file as if it had been downloaded whole.
+    """
+
+    def __init__(self, size, segments, moov=None):
+        """
+        Args:
+            size (int): Size of the remote file
+            segments (list): (offset, bytes) pairs that were fetched
+            moov (tuple): (offset, size) of the moov box, if known
+        """
+        super().__init__()
+        self.segments = sorted((offset, data) for offset, data in segments if data)
+        self.size = max([size or 0] + [offset + len(data) for offset, data in self.segments])
+        self.moov = moov
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), max(0, self.size - self.position))
+        view[:length] = bytes(length)
+        start, end = self.position, self.position + length
+        for offset, data in self.segments:
+            lo, hi = max(start, offset), min(end, offset + len(data))
+            if lo < hi:
+                view[lo - start:hi - start] = data[lo - offset:hi - offset]
+        self.position = end
+        return length
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    Read-only file over a URL that fetches byte ranges only when they are read
+
+    Handing this to MediaInfo.parse makes it drive the download: pymediainfo
+    feeds libmediainfo through its buffer API, stops reading as soon as the
+    parser reports it is done and turns the parser's seek requests into seeks
+    here, which become new range requests. Reads are served from block-aligned
+    ranges, and adjacent missing blocks are fetched in one request.
+    """
+
+    def __init__(self, url, block_size=REMOTE_BLOCK_SIZE, max_bytes=MAX_REMOTE_BYTES):
+        """
+        Args:
+            url (str): URL of the file
+            block_size (int): Granularity of range requests
+            max_bytes (int): Bytes that may be fetched before reads fail
+        """
+        super().__init__()
+        self.url = url
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.blocks = {}
+        self.size = None
+        self.position = 0
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fetch_blocks(self, first, last):
+        """
+        Fetch blocks first..last (inclusive) in a single range request
+
+        Raises:
+            AssetFetchError: If the file has already cost max_bytes
+        """
+        start, end = first * self.block_size, (last + 1) * self.block_size - 1
+        if self.bytes_fetched + end - start + 1 > self.max_bytes:
+            raise AssetFetchError(f'Parser read more than {self.max_bytes} bytes of {self.url}')
+        try:
+            data, total_size = fetch_range(self.url, start, end)
+        except RangeNotSupported:
+            capabilities.record_range_support(self.url, False)
+            raise
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        if total_size is not None:
+            self.size = total_size
+        elif len(data) < end - start + 1:
+            self.size = start + len(data)
+        for index in range(first, last + 1):
+            offset = (index - first) * self.block_size
+            self.blocks[index] = data[offset:offset + self.block_size]
+
+    def get_size(self):
+        if self.size is None:
+            self.fetch_blocks(0, 0)
+        return self.size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.get_size()
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        size = self.get_size()
+        length = min(len(view), max(0, size - self.position))
+        if not length:
+            return 0
+
+        first = self.position // self.block_size
+        last = (self.position + length - 1) // self.block_size
+        index = first
+        while index <= last:
+            if index in self.blocks:
+                index += 1
+                continue
+            run_end = index
+            while run_end + 1 <= last and run_end + 1 not in self.blocks:
+                run_end += 1
+            self.fetch_blocks(index, run_end)
+            index = run_end + 1
+
+        written = 0
+        while written < length:
+            index, offset = divmod(self.position + written, self.block_size)
+            chunk = self.blocks[index][offset:offset + length - written]
+            if not chunk:
+                break
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+        self.position += written
+        return written
+
+    def close(self):
+        if not self.closed and self.requests:
+            logger.info(f'Parsed {self.url} from {self.bytes_fetched} bytes in {self.requests} range requests')
+        self.blocks = {}
+        super().close()
+
+
+def read_content(response, kind):
+    """
+    Read a whole response body, recording time to first byte, transfer time and size
+
+    Args:
+        response (requests.Response): Streamed response
+        kind (str): Kind of request the bytes are counted under, e.g. 'range'
+
+    Returns:
+        bytes: The body
+    """
+    phase_seconds.observe(response.elapsed.total_seconds(), phase='ttfb')
+    with time_phase('body'):
+        content = response.content
+    bytes_fetched.inc(len(content), kind=kind)
+    return content
+
+
+def fetch_range(url, start, end):
+    """
+    Fetch a byte range of a remote file
+
+    Args:
+        url (str): URL of the file
+        start (int): First byte offset
+        end (int): Last byte offset (inclusive)
+
+    Returns:
+        tuple: (bytes, total_size) where total_size is None if the server did not report it
+
+    Raises:
+        RangeNotSupported: If the server ignored the Range header
+        FileNotFoundError: If the server returned an error status
+    """
+    headers = {'Range': f'bytes={start}-{end}'}
+    with get_session().get(url, headers=headers, stream=True) as response:
+        if response.status_code == 200:
+            raise RangeNotSupported(f'Range request not supported for {url}')
+        if response.status_code != 206:
+            raise FileNotFoundError(f'File {url} not found')
+
+        total_size = None
+        match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+        if match and match.group(3) != '*':
+            total_size = int(match.group(3))
+        return read_content(response, 'range'), total_size
+
+
+def download_to_buffer(url):
+    """
+    Stream a whole remote file into a SpoolBuffer
+
+    The body is read with readinto straight into the buffer, in chunks sized
+    from Content-Length, and the transfer counters are kept on buffer.stats.
+
+    Args:
+        url (str): URL of the file
+
+    Returns:
+        SpoolBuffer: The downloaded bytes, positioned at the start. The caller closes it.
+
+    Raises:
+        FileNotFoundError: If the server returned an error status
+    """
+    with get_session().get(url, stream=True) as response:
+        if response.status_code != 200:
+            raise FileNotFoundError(f'File {url} not found')
+
+        phase_seconds.observe(response.elapsed.total_seconds(), phase='ttfb')
+        content_length = int(response.headers.get('Content-Length') or 0) or None
+        # Let urllib3 undo any Content-Encoding so readinto yields the payload itself
+        response.raw.decode_content = True
+        buffer = SpoolBuffer()
+        try:
+            stats = buffer.fill(response.raw, content_length, chunk_size_for(content_length))
+        except Exception:
+            buffer.close()
+            raise
+        logger.info(f'Downloaded {url}: {stats.as_dict()}')
+        record_transfer(stats)
+        phase_seconds.observe(stats.elapsed, phase='body')
+        bytes_fetched.inc(stats.bytes, kind='full')
+        buffer.seek(0)
+        return buffer
+
+
+def fetch_suffix(url, length):
+    """
+    Fetch the last bytes of a remote file with a suffix range request
+
+    Args:
+        url (str): URL of the file
+        length (int): Number of trailing bytes to fetch
+
+    Returns:
+        tuple: (bytes, offset) where offset is the position of the first returned byte
+
+    Raises:
+        RangeNotSupported: If the server ignored the Range header
+        FileNotFoundError: If the server returned an error status
+    """
+    headers = {'Range': f'bytes=-{length}'}
+    with get_session().get(url, headers=headers, stream=True) as response:
+        if response.status_code == 200:
+            raise RangeNotSupported(f'Range request not supported for {url}')
+        if response.status_code != 206:
+            raise FileNotFoundError(f'File {url} not found')
+
+        match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+        if not match:
+            raise AssetFetchError(f'Missing Content-Range in suffix response for {url}')
+        return read_content(response, 'suffix'), int(match.group(1))
+
+
+def fetch_content_length(url):
+    """
+    Learn the size of a remote file with a HEAD request
+
+    Args:
+        url (str): URL of the file
+
+    Returns:
+        int: Content-Length of the file
+
+    Raises:
+        RangeNotSupported: If the server advertises that it does not accept ranges
+        FileNotFoundError: If the server returned an error status
+    """
+    response = get_session().head(url, allow_redirects=True)
+    if response.status_code != 200:
+        raise FileNotFoundError(f'File {url} not found')
+    if response.headers.get('Accept-Ranges', '').lower() == 'none':
+        raise RangeNotSupported(f'Range request not supported for {url}')
+    if 'Content-Length' not in response.headers:
+        raise AssetFetchError(f'No Content-Length for {url}')
+    return int(response.headers['Content-Length'])
+
+
+def fetch_fingerprint(url, size=FINGERPRINT_SIZE, probe_size=PROBE_SIZE):
+    """
+    Fingerprint the content of a remote file from its size and its first bytes
+
+    The same file served under another URL, e.g. a mirror, another path
+    prefix or a re-signed query string, yields the same fingerprint. A single
+    range request reads the first probe_size bytes, which is the window
+    moov_plan starts from, so a file that is not in the index is parsed
+    without requesting them again.
+
+    Args:
+        url (str): URL of the file
+        size (int): Bytes hashed from the start of the file
+        probe_size (int): Bytes fetched, at least size
+
+    Returns:
+        tuple: (fingerprint, probe) where fingerprint is '<size>:<sha256 of the first bytes>'
+        and probe the (window, total_size) fetched, to be passed on to moov_plan
+        or tail_moov_plan
+
+    Raises:
+        RangeNotSupported: If the server ignored the Range header
+        FileNotFoundError: If the server returned an error status
+        AssetFetchError: If the server did not report the size of the file
+    """
+    window, total_size = fetch_range(url, 0, max(size, probe_size) - 1)
+    if total_size is None:
+        raise AssetFetchError(f'Unknown size of {url}')
+    return fingerprint_of(window, total_size, size), (window, total_size)
+
+
+def fingerprint_of(window, total_size, size=FINGERPRINT_SIZE):
+    """
+    Returns:
+        str: Fingerprint of a file from its size and its first bytes, see fetch_fingerprint
+    """
+    return f'{total_size}:{hashlib.sha256(window[:size]).hexdigest()}'
+
+
+def is_unchanged(url, etag, last_modified):
+    """
+    Check with a conditional HEAD request whether a remote file is unchanged
+
+    Args:
+        url (str): URL of the file
+        etag (str): ETag seen when the file was last read
+        last_modified (str): Last-Modified seen when the file was last read
+
+    Returns:
+        bool: True if the server confirms the file has not changed
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        response = get_session().head(url, headers=headers, allow_redirects=True)
+    except requests.RequestException as e:
+        logger.info(f'Could not revalidate {url}: {e}')
+        return False
+    if response.status_code == 304:
+        return True
+    if response.status_code == 200 and etag:
+        return response.headers.get('ETag') == etag
+    return False
+
+
+def find_tail_moov(tail, tail_start, total_size):
+    """
+    Find a moov box in the trailing bytes of an MP4/MOV file
+
+    Candidates are only accepted if the boxes from there on chain exactly to the
+    end of the file, so a stray 'moov' inside media data is not mistaken for one.
+
+    Args:
+        tail (bytes): Trailing bytes of the file
+        tail_start (int): Offset of the first byte of tail in the file
+        total_size (int): Size of the file
+
+    Returns:
+        int: Offset of the moov box in the file, or None if it was not found
+    """
+    position = tail.rfind(b'moov')
+    while position >= 4:
+        box_start = position - 4
+        offset = box_start
+        while offset < len(tail):
+            header = read_box_header(tail, offset)
+            if header is None or header[1] is None or header[1] < header[2]:
+                break
+            offset += header[1]
+        if tail_start + offset == total_size:
+            return tail_start + box_start
+        position = tail.rfind(b'moov', 0, position)
+    return None
+
+
+def moov_plan(probe_size=PROBE_SIZE, max_fetches=MAX_BOX_FETCHES, probe=None):
+    """
+    Plan the requests that locate and fetch the moov box of an MP4/MOV file
+
+    A small probe is fetched first and the top-level box headers are walked from
+    there. Boxes that are skipped over (usually mdat) are never downloaded; only
+    the window holding the next header and then exactly the moov box are requested.
+
+    The plan does no I/O itself: it is a generator that yields requests such as
+    ('range', start, end) and is sent back their results, so the same logic
+    drives both the blocking fetchers here and the asyncio ones.
+
+    Args:
+        probe_size (int): Size of the initial probe and of each header window
+        max_fetches (int): Maximum number of range requests to spend
+        probe (tuple): (window, total_size) of the start of the file if already
+            fetched, see fetch_fingerprint
+
+    Returns:
+        SparseFile: The file with the fetched windows and the moov box filled in
+
+    Raises:
+        UnsupportedContainer: If the file is not ISO-BMFF
+        AssetFetchError: If moov could not be located
+    """
+    if probe is None:
+        probe = yield 'range', 0, probe_size - 1
+    window, total_size = probe
+    if not is_iso_bmff(window):
+        raise UnsupportedContainer('File is not an MP4/MOV file', window)
+
+    fetches = 1
+    window_start = 0
+    offset = 0
+    segments = [(0, window)]
+    while total_size is None or offset < total_size:
+        header = read_box_header(window, offset - window_start)
+        if header is None:
+            # The next header lies outside what has been fetched so far
+            if window_start == offset or fetches >= max_fetches:
+                break
+            window_start = offset
+            window, total_size = yield 'range', offset, offset + probe_size - 1
+            segments.append((offset, window))
+            fetches += 1
+            continue
+
+        box_type, box_size, header_size = header
+        if box_size is None:
+            if total_size is None:
+                break
+            box_size = total_size - offset
+        if box_size < header_size:
+            raise AssetFetchError(f'Corrupt {box_type} box at offset {offset}')
+
+        if box_type == 'moov':
+            fetched_end = window_start + len(window)
+            if fetched_end < offset + box_size:
+                rest, _ = yield 'range', fetched_end, offset + box_size - 1
+                segments.append((fetched_end, rest))
+                fetches += 1
+            logger.info(f'Found moov at offset {offset} after {fetches} requests')
+            return SparseFile(total_size, segments, moov=(offset, box_size))
+
+        offset += box_size
+
+    raise AssetFetchError('Could not locate moov box')
+
+
+def tail_moov_plan(tail_size=TAIL_SIZE, max_tail_size=MAX_TAIL_SIZE, probe=None):
+    """
+    Plan the requests that fetch the head and trailing moov box of a non-faststart MP4/MOV file
+
+    A HEAD request gives the file size and a range request the head, unless
+    both come with an already fetched probe, then a suffix range request pulls
+    the end of the file. The suffix grows until it holds the whole moov box.
+    See moov_plan for how plans are driven.
+
+    Args:
+        tail_size (int): Size of the first suffix request
+        max_tail_size (int): Largest suffix to try before giving up
+        probe (tuple): (window, total_size) of the start of the file if already
+            fetched, see fetch_fingerprint
+
+    Returns:
+        SparseFile: The file with its head and tail filled in
+
+    Raises:
+        UnsupportedContainer: If the file is not ISO-BMFF
+        AssetFetchError: If no moov box was found within max_tail_size
+    """
+    head, total_size = probe if probe is not None else (None, None)
+    if total_size is None:
+        total_size = yield 'length',
+    if head is None:
+        head, _ = yield 'range', 0, PROBE_SIZE - 1
+    if not is_iso_bmff(head):
+        raise UnsupportedContainer('File is not an MP4/MOV file', head)
+
+    while True:
+        tail, tail_start = yield 'suffix', tail_size
+        moov_offset = find_tail_moov(tail, tail_start, total_size)
+        if moov_offset is not None:
+            logger.info(f'Found trailing moov at offset {moov_offset} with a {len(tail)} byte suffix')
+            moov_size = read_box_header(tail, moov_offset - tail_start)[1]
+            return SparseFile(total_size, [(0, head), (tail_start, tail)], moov=(moov_offset, moov_size))
+        if tail_start == 0 or tail_size >= max_tail_size:
+            raise AssetFetchError('Could not locate trailing moov box')
+        tail_size = min(tail_size * 4, max_tail_size)
+
+
+def record_plan_outcome(url, result):
+    """
+    Remember in the capability store what a finished plan learned about its host
+
+    Args:
+        url (str): URL the plan was run against
+        result: Value returned by the plan
+    """
+    capabilities.record_range_support(url, True)
+    moov = getattr(result, 'moov', None)
+    if moov is not None:
+        capabilities.record_moov(url, moov[0], moov[1], result.size)
+
+
+def run_plan(url, plan):
+    """
+    Drive a request plan with blocking requests on the shared session
+
+    What the plan learns about the host, e.g. that it ignores Range headers,
+    is recorded in the capability store.
+
+    Args:
+        url (str): URL of the file
+        plan (generator): Plan such as moov_plan()
+
+    Returns:
+        The value returned by the plan
+
+    Raises:
+        RangeNotSupported: If the server ignored the Range header
+        FileNotFoundError: If the server returned an error status
+    """
+    fetchers = {'range': fetch_range, 'suffix': fetch_suffix, 'length': fetch_content_length}
+    try:
+        request = next(plan)
+        while True:
+            kind, *args = request
+            request = plan.send(fetchers[kind](url, *args))
+    except StopIteration as stop:
+        record_plan_outcome(url, stop.value)
+        return stop.value
+    except RangeNotSupported:
+        capabilities.record_range_support(url, False)
+        raise
+
+
+def fetch_moov_file(video_url, probe_size=None, max_fetches=MAX_BOX_FETCHES, probe=None):
+    """
+    Locate and fetch the moov box of a remote MP4/MOV file, see moov_plan
+
+    Args:
+        video_url (str): URL of the video
+        probe_size (int): Size of the initial probe and of each header window,
+            by default large enough for the moov boxes typically seen on the host
+        max_fetches (int): Maximum number of range requests to spend
+        probe (tuple): (window, total_size) of the start of the file if already fetched
+
+    Returns:
+        SparseFile: The file with the fetched windows and the moov box filled in
+
+    Raises:
+        UnsupportedContainer: If the file is not ISO-BMFF
+        RangeNotSupported: If the server ignored the Range header
+        AssetFetchError: If moov could not be located
+    """
+    probe_size = probe_size or min(capabilities.probe_size(video_url, PROBE_SIZE), MAX_PROBE_SIZE)
+    return run_plan(video_url, moov_plan(probe_size, max_fetches, probe))
+
+
+def fetch_tail_moov(video_url, tail_size=None, max_tail_size=MAX_TAIL_SIZE, probe=None):
+    """
+    Fetch the head and the trailing moov box of a remote MP4/MOV file, see tail_moov_plan
+
+    Args:
+        video_url (str): URL of the video
+        tail_size (int): Size of the first suffix request, by default large
+            enough for the trailing moov boxes typically seen on the host
+        max_tail_size (int): Largest suffix to try before giving up
+        probe (tuple): (window, total_size) of the start of the file if already fetched
+
+    Returns:
+        SparseFile: The file with its head and tail filled in
+
+    Raises:
+        UnsupportedContainer: If the file is not ISO-BMFF
+        RangeNotSupported: If the server does not accept ranges
+        AssetFetchError: If no moov box was found within max_tail_size
+    """
+    tail_size = tail_size or min(capabilities.tail_size(video_url, TAIL_SIZE), max_tail_size)
+    return run_plan(video_url, tail_moov_plan(tail_size, max_tail_size, probe))
+
+
+def fetch_bytes(url, byte_range=None, max_size=MAX_MANIFEST_SIZE):
+    """
+    Fetch a small resource such as a playlist or an init segment
+
+    Args:
+        url (str): URL of the resource
+        byte_range (tuple): (start, end) inclusive, or None for the whole resource
+        max_size (int): Largest body accepted
+
+    Returns:
+        bytes: The body, or the requested range of it
+
+    Raises:
+        FileNotFoundError: If the server returned an error status
+        AssetFetchError: If the body is larger than max_size
+    """
+    headers = {'Range': f'bytes={byte_range[0]}-{byte_range[1]}'} if byte_range else None
+    with get_session().get(url, headers=headers, stream=True) as response:
+        if response.status_code not in (200, 206):
+            raise FileNotFoundError(f'File {url} not found')
+
+        # A server that ignores the range sends the whole resource; read only up to the range
+        limit = byte_range[1] + 1 if byte_range and response.status_code == 200 else max_size
+        buffer = bytearray()
+        for chunk in response.iter_content(chunk_size=IMAGE_CHUNK_SIZE):
+            check_deadline()
+            buffer += chunk
+            if len(buffer) >= limit:
+                break
+        bytes_fetched.inc(len(buffer), kind='manifest')
+        if len(buffer) >= max_size:
+            raise AssetFetchError(f'{url} is larger than {max_size} bytes')
+        if byte_range and response.status_code == 200:
+            return bytes(buffer[byte_range[0]:byte_range[1] + 1])
+        return bytes(buffer)
+
+
+def fetch_stream_metadata(stream_url):
+    """
+    Get the metadata of an HLS or DASH stream from its manifest, see stream_manifest.stream_plan
+
+    Args:
+        stream_url (str): URL of the .m3u8 playlist or .mpd manifest
+
+    Returns:
+        dict: Metadata containing duration and dimension
+    """
+    plan = stream_plan(stream_url)
+    try:
+        request = next(plan)
+        while True:
+            _, url, byte_range = request
+            request = plan.send(fetch_bytes(url, byte_range))
+    except StopIteration as stop:
+        return stop.value
+
+
+def sniff_partial_image(buffer):
+    """
+    Check whether the bytes streamed so far reveal an image's dimensions
+
+    Args:
+        buffer (bytes): Leading bytes of the image
+
+    Returns:
+        tuple: (stop, size) where stop is True once streaming more of the image
+        will not help and size is (width, height) if it was found
+    """
+    if len(buffer) < 32:
+        return False, None
+    if not is_sniffable_image(buffer):
+        return True, None
+    size = sniff_image_size(buffer)
+    if size:
+        return True, size
+    return len(buffer) >= MAX_IMAGE_HEADER_SIZE, None
+
+
+def open_image_size(buffer):
+    """
+    Read image dimensions with PIL, which only parses the header on open
+
+    Returns:
+        tuple: (width, height)
+    """
+    image = Image.open(io.BytesIO(buffer))
+    return image.width, image.height
+
+
+def fetch_image_size(image_url):
+    """
+    Get the dimensions of a remote image while downloading as little of it as possible
+
+    The image is streamed until its header reveals the dimensions and the
+    connection is then closed. Unknown formats, or headers that could not be
+    read, fall back to PIL on the partial buffer and finally on the whole file.
+
+    Args:
+        image_url (str): URL of the image
+
+    Returns:
+        tuple: (width, height)
+
+    Raises:
+        FileNotFoundError: If the server returned an error status
+    """
+    with get_session().get(image_url, stream=True) as response:
+        if response.status_code != 200:
+            raise FileNotFoundError(f'File {image_url} not found')
+
+        phase_seconds.observe(response.elapsed.total_seconds(), phase='ttfb')
+        buffer = bytearray()
+        chunks = response.iter_content(chunk_size=IMAGE_CHUNK_SIZE)
+        try:
+            with time_phase('body'):
+                for chunk in chunks:
+                    check_deadline()
+                    buffer += chunk
+                    stop, size = sniff_partial_image(buffer)
+                    if size:
+                        return size
+                    if stop:
+                        break
+
+            try:
+                return open_image_size(buffer)
+            except Exception as e:
+                logger.info(f'Partial image header unreadable ({e}), downloading the rest')
+
+            with time_phase('body'):
+                for chunk in chunks:
+                    check_deadline()
+                    buffer += chunk
+            return open_image_size(buffer)
+        finally:
+            bytes_fetched.inc(len(buffer), kind='image')
@@ -0,0 +1,316 @@
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from asset_buffer import SpoolBuffer, chunk_size_for
+from asset_metrics import bytes_fetched, phase_seconds, record_transfer, time_phase
+from asset_fetch import (
+    CONTENT_RANGE_RE, FINGERPRINT_SIZE, IMAGE_CHUNK_SIZE, MAX_MANIFEST_SIZE, PROBE_SIZE, AssetFetchError,
+    RangeNotSupported, fingerprint_of, open_image_size, record_plan_outcome, sniff_partial_image,
+)
+from failure_guard import guard, record_error, record_status
+from host_capabilities import capabilities
+from http_session import CONNECT_TIMEOUT, READ_TIMEOUT, RETRIES, current_validators
+from stream_manifest import stream_plan
+
+logger = logging.getLogger(__name__)
+
+# Unlike the blocking session, one event loop can keep thousands of fetches in flight
+MAX_CONNECTIONS = int(os.environ.get('ASSET_ASYNC_MAX_CONNECTIONS', 1000))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('ASSET_ASYNC_MAX_KEEPALIVE', 100))
+
+
+class AssetClient(httpx.AsyncClient):
+    """
+    AsyncClient that consults the negative cache and circuit breaker, and
+    collects validators, like AssetSession
+    """
+
+    async def send(self, request, **kwargs):
+        url = str(request.url)
+        guard(url)
+        try:
+            response = await super().send(request, **kwargs)
+        except httpx.TransportError:
+            record_error(url)
+            raise
+        record_status(url, response.status_code)
+        validators = current_validators.get()
+        if validators is not None and response.status_code in (200, 206):
+            validators.setdefault(url, (response.headers.get('ETag'), response.headers.get('Last-Modified')))
+        return response
+
+
+def create_client():
+    """
+    Create the async HTTP client used by the asyncio service
+
+    Returns:
+        AssetClient: Client with pooled keep-alive connections and timeouts
+    """
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+    )
+    return AssetClient(
+        transport=httpx.AsyncHTTPTransport(retries=RETRIES, limits=limits),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+
+
+def traced(url):
+    """
+    Request extensions that report connection setup, including TLS, as the connect phase
+
+    Returns:
+        dict: Extensions for the request
+    """
+    started = []
+    connected = 'connection.start_tls.complete' if url.startswith('https') else 'connection.connect_tcp.complete'
+
+    async def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            started.append(time.perf_counter())
+        elif event_name == connected and started:
+            phase_seconds.observe(time.perf_counter() - started.pop(), phase='connect')
+
+    return {'trace': trace}
+
+
+@asynccontextmanager
+async def open_stream(client, url, headers=None):
+    """
+    Like client.stream('GET', ...), also recording connect time and time to first byte
+
+    Yields:
+        httpx.Response: The open streamed response
+    """
+    started = time.perf_counter()
+    request = client.build_request('GET', url, headers=headers, extensions=traced(url))
+    response = await client.send(request, stream=True)
+    try:
+        phase_seconds.observe(time.perf_counter() - started, phase='ttfb')
+        yield response
+    finally:
+        await response.aclose()
+
+
+async def read_content(response, kind):
+    """
+    Async counterpart of asset_fetch.read_content
+    """
+    with time_phase('body'):
+        content = await response.aread()
+    bytes_fetched.inc(len(content), kind=kind)
+    return content
+
+
+async def fetch_range(client, url, start, end):
+    """
+    Async counterpart of asset_fetch.fetch_range
+
+    Returns:
+        tuple: (bytes, total_size) where total_size is None if the server did not report it
+    """
+    headers = {'Range': f'bytes={start}-{end}'}
+    async with open_stream(client, url, headers) as response:
+        if response.status_code == 200:
+            raise RangeNotSupported(f'Range request not supported for {url}')
+        if response.status_code != 206:
+            raise FileNotFoundError(f'File {url} not found')
+
+        total_size = None
+        match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+        if match and match.group(3) != '*':
+            total_size = int(match.group(3))
+        return await read_content(response, 'range'), total_size
+
+
+async def fetch_suffix(client, url, length):
+    """
+    Async counterpart of asset_fetch.fetch_suffix
+
+    Returns:
+        tuple: (bytes, offset) where offset is the position of the first returned byte
+    """
+    headers = {'Range': f'bytes=-{length}'}
+    async with open_stream(client, url, headers) as response:
+        if response.status_code == 200:
+            raise RangeNotSupported(f'Range request not supported for {url}')
+        if response.status_code != 206:
+            raise FileNotFoundError(f'File {url} not found')
+
+        match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+        if not match:
+            raise AssetFetchError(f'Missing Content-Range in suffix response for {url}')
+        return await read_content(response, 'suffix'), int(match.group(1))
+
+
+async def fetch_content_length(client, url):
+    """
+    Async counterpart of asset_fetch.fetch_content_length
+
+    Returns:
+        int: Content-Length of the file
+    """
+    response = await client.head(url)
+    if response.status_code != 200:
+        raise FileNotFoundError(f'File {url} not found')
+    if response.headers.get('Accept-Ranges', '').lower() == 'none':
+        raise RangeNotSupported(f'Range request not supported for {url}')
+    if 'Content-Length' not in response.headers:
+        raise AssetFetchError(f'No Content-Length for {url}')
+    return int(response.headers['Content-Length'])
+
+
+async def fetch_fingerprint(client, url, size=FINGERPRINT_SIZE, probe_size=PROBE_SIZE):
+    """
+    Async counterpart of asset_fetch.fetch_fingerprint
+
+    Returns:
+        tuple: (fingerprint, probe) where probe is the (window, total_size) fetched
+    """
+    window, total_size = await fetch_range(client, url, 0, max(size, probe_size) - 1)
+    if total_size is None:
+        raise AssetFetchError(f'Unknown size of {url}')
+    return fingerprint_of(window, total_size, size), (window, total_size)
+
+
+async def run_plan(client, url, plan):
+    """
+    Drive a request plan such as asset_fetch.moov_plan() with async requests
+
+    Returns:
+        The value returned by the plan
+    """
+    fetchers = {'range': fetch_range, 'suffix': fetch_suffix, 'length': fetch_content_length}
+    try:
+        request = next(plan)
+        while True:
+            kind, *args = request
+            request = plan.send(await fetchers[kind](client, url, *args))
+    except StopIteration as stop:
+        record_plan_outcome(url, stop.value)
+        return stop.value
+    except RangeNotSupported:
+        capabilities.record_range_support(url, False)
+        raise
+
+
+async def fetch_full(client, url):
+    """
+    Download a whole file
+
+    Returns:
+        SpoolBuffer: The file contents. The caller closes it.
+    """
+    async with open_stream(client, url) as response:
+        if response.status_code != 200:
+            raise FileNotFoundError(f'File {url} not found')
+
+        content_length = int(response.headers.get('Content-Length') or 0) or None
+        buffer = SpoolBuffer()
+        if content_length:
+            buffer.reserve(content_length)
+        stats = buffer.stats
+        try:
+            # httpx has no readinto for async streams: each chunk arrives as new bytes and is
+            # copied again into the buffer, where the blocking download reads straight into it
+            async for chunk in response.aiter_bytes(chunk_size_for(content_length)):
+                buffer.write(chunk)
+                stats.reads += 1
+                stats.copies += 2
+                stats.bytes += len(chunk)
+        except BaseException:
+            buffer.close()
+            raise
+        stats.finish()
+        logger.info(f'Downloaded {url}: {stats.as_dict()}')
+        record_transfer(stats)
+        phase_seconds.observe(stats.elapsed, phase='body')
+        bytes_fetched.inc(stats.bytes, kind='full')
+        buffer.seek(0)
+        return buffer
+
+
+async def fetch_bytes(client, url, byte_range=None, max_size=MAX_MANIFEST_SIZE):
+    """
+    Async counterpart of asset_fetch.fetch_bytes
+
+    Returns:
+        bytes: The body, or the requested range of it
+    """
+    headers = {'Range': f'bytes={byte_range[0]}-{byte_range[1]}'} if byte_range else None
+    async with open_stream(client, url, headers) as response:
+        if response.status_code not in (200, 206):
+            raise FileNotFoundError(f'File {url} not found')
+
+        limit = byte_range[1] + 1 if byte_range and response.status_code == 200 else max_size
+        buffer = bytearray()
+        async for chunk in response.aiter_bytes(IMAGE_CHUNK_SIZE):
+            buffer += chunk
+            if len(buffer) >= limit:
+                break
+        bytes_fetched.inc(len(buffer), kind='manifest')
+        if len(buffer) >= max_size:
+            raise AssetFetchError(f'{url} is larger than {max_size} bytes')
+        if byte_range and response.status_code == 200:
+            return bytes(buffer[byte_range[0]:byte_range[1] + 1])
+        return bytes(buffer)
+
+
+async def fetch_stream_metadata(client, stream_url):
+    """
+    Async counterpart of asset_fetch.fetch_stream_metadata
+
+    Returns:
+        dict: Metadata containing duration and dimension
+    """
+    plan = stream_plan(stream_url)
+    try:
+        request = next(plan)
+        while True:
+            _, url, byte_range = request
+            request = plan.send(await fetch_bytes(client, url, byte_range))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def fetch_image_size(client, image_url):
+    """
+    Async counterpart of asset_fetch.fetch_image_size
+
+    Returns:
+        tuple: (width, height)
+    """
+    async with open_stream(client, image_url) as response:
+        if response.status_code != 200:
+            raise FileNotFoundError(f'File {image_url} not found')
+
+        buffer = bytearray()
+        chunks = response.aiter_bytes(IMAGE_CHUNK_SIZE)
+        try:
+            with time_phase('body'):
+                async for chunk in chunks:
+                    buffer += chunk
+                    stop, size = sniff_partial_image(buffer)
+                    if size:
+                        return size
+                    if stop:
+                        break
+
+            try:
+                return open_image_size(buffer)
+            except Exception as e:
+                logger.info(f'Partial image header unreadable ({e}), downloading the rest')
+
+            with time_phase('body'):
+                async for chunk in chunks:
+                    buffer += chunk
+            return open_image_size(buffer)
+        finally:
+            bytes_fetched.inc(len(buffer), kind='image')
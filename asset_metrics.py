@@ -0,0 +1,190 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Bytes per second, from a slow origin to a fast local network
+THROUGHPUT_BUCKETS = (100000, 500000, 1000000, 5000000, 10000000, 25000000, 50000000, 100000000, 250000000, 500000000, 1000000000)
+
+# Name of the fetch strategy running, for metrics recorded deep inside it
+current_strategy = contextvars.ContextVar('asset_strategy', default='none')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f'{self.name}{format_labels(self.labels, key)} {value}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        bucket_labels = self.labels + ('le',)
+        for key, (counts, total, count) in sorted(self.values.items()):
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts + [count]):
+                yield f'{self.name}_bucket{format_labels(bucket_labels, key + (bound,))} {bucket_count}'
+            yield f'{self.name}_sum{format_labels(self.labels, key)} {total}'
+            yield f'{self.name}_count{format_labels(self.labels, key)} {count}'
+
+
+# Network phases (connect, ttfb, body) and parse phases (probe, mediainfo, image) of a lookup
+phase_seconds = Histogram(
+    'asset_phase_seconds', 'Time spent per phase of fetching and parsing an asset', ('phase',),
+)
+request_seconds = Histogram(
+    'asset_request_seconds', 'End-to-end time of a metadata lookup', ('type',),
+)
+strategy_seconds = Histogram(
+    'asset_strategy_seconds', 'Time spent in a video fetch strategy', ('strategy', 'outcome'),
+)
+strategy_total = Counter(
+    'asset_strategy_total', 'Video fetch strategies tried, by outcome', ('strategy', 'outcome'),
+)
+bytes_fetched = Counter(
+    'asset_bytes_fetched_total', 'Response body bytes read from asset hosts', ('kind',),
+)
+queue_wait_seconds = Histogram(
+    'asset_queue_wait_seconds', 'Time a lookup waited for a worker of its asset type', ('pool',),
+)
+shed_total = Counter(
+    'asset_shed_total', 'Lookups rejected instead of queued', ('pool', 'reason'),
+)
+# Whole downloads into a SpoolBuffer, see asset_buffer.TransferStats
+transfer_bytes = Counter(
+    'asset_transfer_bytes_total', 'Bytes downloaded into buffers', ('strategy',),
+)
+transfer_reads = Counter(
+    'asset_transfer_reads_total', 'Reads made while downloading into buffers', ('strategy',),
+)
+transfer_copies = Counter(
+    'asset_transfer_copies_total', 'Copies of downloaded chunks on their way into buffers', ('strategy',),
+)
+transfer_throughput = Histogram(
+    'asset_transfer_bytes_per_second', 'Throughput of downloads into buffers', ('strategy',), THROUGHPUT_BUCKETS,
+)
+
+METRICS = (
+    phase_seconds, request_seconds, strategy_seconds, strategy_total, bytes_fetched,
+    queue_wait_seconds, shed_total, transfer_bytes, transfer_reads, transfer_copies, transfer_throughput,
+)
+
+
+def time_phase(phase):
+    return phase_seconds.time(phase=phase)
+
+
+@contextmanager
+def time_strategy(strategy):
+    """
+    Time a video fetch strategy and count it as a success unless it raises
+    """
+    started = time.perf_counter()
+    outcome = 'failure'
+    token = current_strategy.set(strategy)
+    try:
+        yield
+        outcome = 'success'
+    finally:
+        current_strategy.reset(token)
+        strategy_seconds.observe(time.perf_counter() - started, strategy=strategy, outcome=outcome)
+        strategy_total.inc(strategy=strategy, outcome=outcome)
+
+
+def record_transfer(stats):
+    """
+    Export the counters of a finished download under the strategy that made it
+
+    Args:
+        stats (TransferStats): Counters of the download
+    """
+    strategy = current_strategy.get()
+    transfer_bytes.inc(stats.bytes, strategy=strategy)
+    transfer_reads.inc(stats.reads, strategy=strategy)
+    transfer_copies.inc(stats.copies, strategy=strategy)
+    if stats.elapsed > 0:
+        transfer_throughput.observe(stats.bytes_per_second, strategy=strategy)
+
+
+def render(**sources):
+    """
+    Render all metrics in the Prometheus text exposition format
+
+    Args:
+        sources: Named stats dicts, e.g. cache=metadata_cache.stats(); each
+            numeric value is exported as a gauge asset_<source>_<key>
+
+    Returns:
+        str: The exposition text
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for source, stats in sources.items():
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                name = f'asset_{source}_{key}'
+                lines.extend([f'# TYPE {name} gauge', f'{name} {value}'])
+    return '\n'.join(lines) + '\n'
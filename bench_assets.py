@@ -0,0 +1,351 @@
+"""
+Benchmark the asset metadata strategies against a local stand-in CDN
+
+Serves synthetic fixtures (a faststart MP4, a tail-moov MP4, a large PNG and a
+large JPEG) from an in-process HTTP server with optional range support,
+per-connection bandwidth limit and added latency, then runs each strategy of
+the asset engine against them and reports throughput, latency percentiles,
+bytes read by the client, peak RSS and its growth over the RSS before the case.
+Bytes are counted where the engine reads them (asset_bytes_fetched_total), so
+a lookup that stops after an image header is not charged for what the server
+had already pushed into the socket buffers.
+
+Each case starts from a blank capability store, negative cache and circuit
+breaker, so earlier cases do not change its strategy or probe sizes or fail
+it fast. Single strategy cases run on an engine with adaptive sizing off.
+
+Usage:
+    python bench_assets.py --iterations 20 --concurrency 4 --bandwidth 20000000 --latency 20
+    python bench_assets.py --no-ranges --cases full_faststart,range_faststart
+"""
+import argparse
+import io
+import logging
+import os
+import re
+import resource
+import statistics
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Keep the benchmark off the on-disk cache and any configured proxy
+os.environ.setdefault('ASSET_CACHE_PATH', '')
+os.environ.setdefault('NO_PROXY', '127.0.0.1,localhost')
+
+from PIL import Image
+
+from asset_engine import AssetEngine, EngineConfig, engine
+from asset_metrics import bytes_fetched
+from failure_guard import circuit_breaker, negative_cache
+from host_capabilities import capabilities
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+SEND_CHUNK_SIZE = 16 * 1024
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type.encode()) + payload
+
+
+def build_moov(width, height, duration_ms, padding):
+    """
+    Build a moov box with one video track; padding stands in for the sample tables
+    """
+    mvhd = box('mvhd', bytes(4) + struct.pack('>IIII', 0, 0, 1000, duration_ms) + bytes(80))
+    tkhd = bytearray(84)
+    struct.pack_into('>I', tkhd, 20, duration_ms)
+    struct.pack_into('>II', tkhd, 76, width << 16, height << 16)
+    mdhd = box('mdhd', bytes(4) + struct.pack('>IIII', 0, 0, 1000, duration_ms) + bytes(4))
+    hdlr = box('hdlr', bytes(8) + b'vide' + bytes(12) + b'\0')
+    trak = box('trak', box('tkhd', bytes(tkhd)) + box('mdia', mdhd + hdlr))
+    return box('moov', mvhd + trak + box('free', bytes(padding)))
+
+
+def build_mp4(media_size, faststart, width=1920, height=1080, duration_ms=95000, moov_padding=256 * 1024):
+    ftyp = box('ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2avc1mp41')
+    moov = build_moov(width, height, duration_ms, moov_padding)
+    # Incompressible but cheap to generate: one random block repeated
+    block = os.urandom(1024 * 1024)
+    mdat = box('mdat', (block * (media_size // len(block) + 1))[:media_size])
+    return ftyp + moov + mdat if faststart else ftyp + mdat + moov
+
+
+def build_image(image_format, width, height):
+    image = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    output = io.BytesIO()
+    image.save(output, image_format, **({'quality': 95} if image_format == 'JPEG' else {}))
+    return output.getvalue()
+
+
+def build_fixtures(video_size, image_width, image_height):
+    # The videos sit under their own path prefix so they are profiled apart, see host_capabilities.profile_keys
+    return {
+        '/faststart/video.mp4': build_mp4(video_size, faststart=True),
+        '/tail/video.mp4': build_mp4(video_size, faststart=False),
+        '/large.png': build_image('PNG', image_width, image_height),
+        '/large.jpg': build_image('JPEG', image_width, image_height),
+    }
+
+
+class StandInCDN(ThreadingHTTPServer):
+    """
+    HTTP server serving in-memory fixtures like a CDN would, with knobs for range
+    support, per-connection bandwidth and latency before the response headers
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixtures, ranges=True, bandwidth=0, latency=0.0):
+        super().__init__(('127.0.0.1', 0), CDNRequestHandler)
+        self.fixtures = fixtures
+        self.ranges = ranges
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+
+
+class CDNRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        data = server.fixtures.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end, status = 0, len(data) - 1, 200
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if server.ranges and match:
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), end) if last else end
+            elif last:
+                start = max(0, len(data) - int(last))
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', f'"{len(data):x}"')
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.end_headers()
+        if send_body:
+            self.send_body(memoryview(data)[start:end + 1])
+
+    def send_body(self, body):
+        bandwidth = self.server.bandwidth
+        try:
+            for offset in range(0, len(body), SEND_CHUNK_SIZE):
+                chunk = body[offset:offset + SEND_CHUNK_SIZE]
+                self.wfile.write(chunk)
+                if bandwidth:
+                    time.sleep(len(chunk) / bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early, e.g. once an image header was parsed
+            self.close_connection = True
+
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """
+    Track the peak resident set size of the process while a block runs, and the size before it
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, current_rss())
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+# Runs single strategies with the configured probe and tail sizes rather than learned ones
+fixed_engine = AssetEngine(EngineConfig(adaptive=False))
+
+
+def strategy(name):
+    return lambda url: fixed_engine.run_strategy(name, url)
+
+
+CASES = {
+    'range_faststart': (strategy('range'), '/faststart/video.mp4'),
+    'range_tail': (strategy('range'), '/tail/video.mp4'),
+    'tail_tail': (strategy('tail'), '/tail/video.mp4'),
+    'full_faststart': (strategy('full'), '/faststart/video.mp4'),
+    'full_tail': (strategy('full'), '/tail/video.mp4'),
+    'chain_tail': (engine.video_metadata, '/tail/video.mp4'),
+    'image_png': (engine.image_metadata, '/large.png'),
+    'image_jpeg': (engine.image_metadata, '/large.jpg'),
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def reset_state():
+    """
+    Forget what earlier cases taught the process-wide capability store and failure guards
+    """
+    capabilities.clear()
+    negative_cache.clear()
+    circuit_breaker.clear()
+
+
+def run_case(server, name, iterations, concurrency):
+    function, path = CASES[name]
+    url = server.base_url + path
+
+    def timed_call(_):
+        started = time.perf_counter()
+        try:
+            function(url)
+            return time.perf_counter() - started, None
+        except Exception as e:
+            return time.perf_counter() - started, e
+
+    reset_state()
+    server.reset_counters()
+    fetched = bytes_fetched.total()
+    with RssSampler() as rss, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        started = time.perf_counter()
+        results = list(executor.map(timed_call, range(iterations)))
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, error in results if error is None]
+    errors = [error for _, error in results if error is not None]
+    return {
+        'case': name,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'rps': len(results) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p90_ms': percentile(latencies, 0.9) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else None,
+        'bytes_per_call': (bytes_fetched.total() - fetched) // max(1, len(results)),
+        'requests_per_call': server.requests / max(1, len(results)),
+        'peak_rss_mb': rss.peak / (1024 * 1024),
+        'rss_delta_mb': (rss.peak - rss.baseline) / (1024 * 1024),
+        'first_error': str(errors[0]) if errors else '',
+    }
+
+
+def format_row(row):
+    def ms(value):
+        return f'{value:9.1f}' if value is not None else f'{"-":>9}'
+
+    return (
+        f'{row["case"]:<16} {row["ok"]:>4} {row["errors"]:>4} {row["rps"]:8.1f} '
+        f'{ms(row["p50_ms"])} {ms(row["p90_ms"])} {ms(row["p99_ms"])} '
+        f'{row["bytes_per_call"]:>13,} {row["requests_per_call"]:6.1f} {row["peak_rss_mb"]:9.1f} '
+        f'{row["rss_delta_mb"]:9.1f}'
+    )
+
+
+HEADER = (
+    f'{"case":<16} {"ok":>4} {"err":>4} {"rps":>8} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} '
+    f'{"bytes/call":>13} {"reqs":>6} {"rss MB":>9} {"+rss MB":>9}'
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10, help='Calls per case')
+    parser.add_argument('--concurrency', type=int, default=1, help='Concurrent calls per case')
+    parser.add_argument('--no-ranges', action='store_true', help='Serve every request whole, ignoring Range')
+    parser.add_argument('--bandwidth', type=int, default=0, help='Per-connection bytes per second, 0 for unlimited')
+    parser.add_argument('--latency', type=float, default=0.0, help='Milliseconds added before each response')
+    parser.add_argument('--video-size', type=int, default=50, help='Size of the video fixtures in MB')
+    parser.add_argument('--image-size', default='4000x3000', help='Dimension of the image fixtures')
+    parser.add_argument('--cases', default=','.join(CASES), help='Comma separated cases to run')
+    parser.add_argument('--output', help='Also append the report to this file, e.g. bench_output.txt')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    image_width, image_height = (int(value) for value in args.image_size.split('x'))
+    fixtures = build_fixtures(args.video_size * 1024 * 1024, image_width, image_height)
+    server = StandInCDN(fixtures, ranges=not args.no_ranges, bandwidth=args.bandwidth, latency=args.latency / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    lines = [
+        f'ranges={not args.no_ranges} bandwidth={args.bandwidth or "unlimited"} latency={args.latency}ms '
+        f'iterations={args.iterations} concurrency={args.concurrency} video={args.video_size}MB image={args.image_size}',
+        HEADER,
+    ]
+    print('\n'.join(lines), flush=True)
+    try:
+        for name in args.cases.split(','):
+            row = run_case(server, name, args.iterations, args.concurrency)
+            line = format_row(row)
+            if row['first_error']:
+                line += f'  ({row["first_error"]})'
+            lines.append(line)
+            print(line, flush=True)
+    finally:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, 'a') as output:
+            output.write('\n'.join(lines) + '\n\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+Warm the metadata cache for a list of asset URLs ahead of traffic
+
+URLs are read from any text file, e.g. one URL per line, a JSON list or a
+Python list such as the arr list of a campaign. Lookups run with bounded
+concurrency and a per-host rate limit and go through the asset engine, so
+results land in the same on-disk cache (ASSET_CACHE_PATH) the services read.
+
+Usage:
+    python cache_warmer.py campaign_urls.txt --concurrency 4 --rate 2
+    python cache_warmer.py images.json --type image
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from admission import Overloaded
+from asset_batch import ASSET_TYPES
+from stream_manifest import manifest_kind
+
+# Lookups per warm run in flight at once, and lookups started per second per host
+WARM_CONCURRENCY = int(os.environ.get('ASSET_WARM_CONCURRENCY', 4))
+WARM_RATE = float(os.environ.get('ASSET_WARM_RATE', 5))
+
+MAX_WARM_SIZE = int(os.environ.get('ASSET_MAX_WARM_SIZE', 10000))
+
+# Failures kept per job for reporting; the rest are only counted
+MAX_REPORTED_FAILURES = 100
+
+# Warm jobs running at once, and finished jobs kept for status lookups
+MAX_JOBS = 20
+
+URL_RE = re.compile(r'''https?://[^\s'"<>,\]\)]+''')
+
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.webm', '.mkv', '.avi', '.m3u8', '.mpd')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff', '.avif', '.heic')
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidWarmList(Exception):
+    pass
+
+
+def guess_asset_type(url, default='video'):
+    path = urlsplit(url).path.lower()
+    if manifest_kind(url) or path.endswith(VIDEO_EXTENSIONS):
+        return 'video'
+    if path.endswith(IMAGE_EXTENSIONS):
+        return 'image'
+    return default
+
+
+def read_url_list(text, default_type='video'):
+    """
+    Extract asset URLs from free-form text, in order and without duplicates
+
+    Returns:
+        list: (url, asset_type) pairs, the type guessed from the extension
+    """
+    urls = dict.fromkeys(URL_RE.findall(text))
+    return [(url, guess_asset_type(url, default_type)) for url in urls]
+
+
+def parse_warm_list(data):
+    """
+    Validate the body of a warm request
+
+    Args:
+        data: {'items': [...], 'type': default type} or a bare list, where each
+            item is a URL or a {url, type} object
+
+    Returns:
+        list: Unique (url, asset_type) pairs in request order
+
+    Raises:
+        InvalidWarmList: If there are no items, too many, or an invalid one
+    """
+    default_type = (data.get('type') if isinstance(data, dict) else None) or 'video'
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise InvalidWarmList('items are required')
+    if len(items) > MAX_WARM_SIZE:
+        raise InvalidWarmList(f'At most {MAX_WARM_SIZE} items are allowed per warm request')
+
+    assets = {}
+    for item in items:
+        if isinstance(item, str):
+            url, asset_type = item, guess_asset_type(item, default_type)
+        elif isinstance(item, dict) and item.get('url'):
+            url = item['url']
+            asset_type = item.get('type') or guess_asset_type(url, default_type)
+        else:
+            raise InvalidWarmList(f'Invalid item: {item!r}')
+        if asset_type not in ASSET_TYPES:
+            raise InvalidWarmList(f'Unsupported asset type for {url}: {asset_type}')
+        assets[(url, asset_type)] = None
+    return list(assets)
+
+
+class HostRateLimiter:
+    """
+    Space out lookups to the same host so warming does not hammer one origin
+    """
+
+    def __init__(self, rate=WARM_RATE):
+        """
+        Args:
+            rate (float): Lookups started per second per host, 0 for no limit
+        """
+        self.interval = 1 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def acquire(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class WarmJob:
+    """
+    Progress of one warm run
+    """
+
+    def __init__(self, assets):
+        self.id = uuid.uuid4().hex
+        self.assets = assets
+        self.lock = threading.Lock()
+        self.state = 'queued'
+        self.counters = {'done': 0, 'warmed': 0, 'cached': 0, 'failed': 0}
+        self.failures = []
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, url, asset_type, outcome, error=None):
+        with self.lock:
+            self.counters['done'] += 1
+            self.counters[outcome] += 1
+            if error is not None and len(self.failures) < MAX_REPORTED_FAILURES:
+                self.failures.append({'url': url, 'type': asset_type, 'error': error})
+
+    def as_dict(self):
+        with self.lock:
+            finished = self.finished_at or time.time()
+            return dict(
+                self.counters,
+                id=self.id,
+                state=self.state,
+                total=len(self.assets),
+                elapsed=round(finished - self.started_at, 3) if self.started_at else 0.0,
+                failures=list(self.failures),
+            )
+
+
+def warm(job, compute, is_cached=None, concurrency=WARM_CONCURRENCY, rate=WARM_RATE, progress=None):
+    """
+    Look up every asset of a job so its metadata is cached
+
+    Args:
+        job (WarmJob): Job to run and report progress on
+        compute (callable): compute(url, asset_type), e.g. the service's handle
+        is_cached (callable): is_cached(url, asset_type), to skip assets already fresh in the cache
+        concurrency (int): Lookups in flight at once
+        rate (float): Lookups started per second per host
+        progress (callable): Called with (job, url, asset_type, outcome) after each asset
+
+    Returns:
+        WarmJob: The finished job
+    """
+    limiter = HostRateLimiter(rate)
+    job.state = 'running'
+    job.started_at = time.time()
+
+    def run(asset):
+        url, asset_type = asset
+        if is_cached is not None and is_cached(url, asset_type):
+            outcome, error = 'cached', None
+        else:
+            limiter.acquire(url)
+            try:
+                compute(url, asset_type)
+                outcome, error = 'warmed', None
+            except Exception as e:
+                outcome, error = 'failed', str(e)
+        job.record(url, asset_type, outcome, error)
+        if progress is not None:
+            progress(job, url, asset_type, outcome)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='warm') as executor:
+        list(executor.map(run, job.assets))
+    job.finished_at = time.time()
+    job.state = 'finished'
+    logger.info(f'Warm job {job.id} finished: {job.counters}')
+    return job
+
+
+class WarmJobs:
+    """
+    Warm runs started through the service, each on its own background thread
+
+    At most max_jobs run at once; of the finished ones, the latest max_jobs
+    are kept for status lookups.
+    """
+
+    def __init__(self, max_jobs=MAX_JOBS):
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def start(self, assets, compute, is_cached=None, concurrency=WARM_CONCURRENCY, rate=WARM_RATE):
+        """
+        Returns:
+            WarmJob: The started job, whose progress is available through get
+
+        Raises:
+            Overloaded: If max_jobs warm jobs are still running
+        """
+        job = WarmJob(assets)
+        with self.lock:
+            finished = [job_id for job_id, other in self.jobs.items() if other.state == 'finished']
+            if len(self.jobs) - len(finished) >= self.max_jobs:
+                raise Overloaded(f'{self.max_jobs} warm jobs are already running, retry later', 429)
+            for job_id in finished[:-self.max_jobs]:
+                del self.jobs[job_id]
+            self.jobs[job.id] = job
+        threading.Thread(
+            target=warm, args=(job, compute, is_cached, concurrency, rate), daemon=True,
+        ).start()
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+
+warm_jobs = WarmJobs()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='File containing the asset URLs, or - for stdin')
+    parser.add_argument('--type', default='video', choices=ASSET_TYPES,
+                        help='Asset type of URLs whose extension does not tell')
+    parser.add_argument('--concurrency', type=int, default=WARM_CONCURRENCY, help='Lookups in flight at once')
+    parser.add_argument('--rate', type=float, default=WARM_RATE, help='Lookups per second per host, 0 for no limit')
+    parser.add_argument('--force', action='store_true', help='Look up assets that are already cached too')
+    args = parser.parse_args()
+
+    if args.path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.path) as file:
+            text = file.read()
+    assets = read_url_list(text, args.type)
+    if not assets:
+        parser.error(f'No URLs found in {args.path}')
+
+    # Imported late: the engine opens its cache on import
+    from asset_engine import engine
+
+    def report(job, url, asset_type, outcome):
+        counters = job.as_dict()
+        print(f'[{counters["done"]}/{counters["total"]}] {outcome:<6} {asset_type} {url}', file=sys.stderr, flush=True)
+
+    is_cached = None if args.force else engine.is_cached
+    job = warm(WarmJob(assets), engine.handle, is_cached, args.concurrency, args.rate, progress=report)
+
+    summary = job.as_dict()
+    print(
+        f'{summary["total"]} assets in {summary["elapsed"]}s: {summary["warmed"]} warmed, '
+        f'{summary["cached"]} already cached, {summary["failed"]} failed'
+    )
+    for failure in summary['failures']:
+        print(f'  failed {failure["type"]} {failure["url"]}: {failure["error"]}')
+    sys.exit(1 if summary['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
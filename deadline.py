@@ -0,0 +1,267 @@
+import asyncio
+import contextvars
+import os
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+# Request header and body field carrying the caller's timeout in seconds
+TIMEOUT_HEADER = 'X-Request-Timeout'
+TIMEOUT_FIELD = 'timeout'
+
+# Upper bound on a requested timeout; requests without one have no deadline
+MAX_REQUEST_TIMEOUT = float(os.environ.get('ASSET_MAX_REQUEST_TIMEOUT', 300))
+
+# How often a waiting request thread checks its deadline and the client connection
+POLL_INTERVAL = 0.25
+
+current_deadline = contextvars.ContextVar('asset_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    status = 504
+
+
+class ClientDisconnected(DeadlineExceeded):
+    # nginx's code for a request the client closed; nobody reads the response
+    status = 499
+
+
+class Deadline:
+    """
+    Point in time after which the work for a request is abandoned
+
+    The deadline is carried in a context variable, so fetches and parses deep
+    in the call stack can check it without it being passed along. Work is
+    abandoned cooperatively: checks raise DeadlineExceeded, which closes the
+    HTTP stream being read through its context manager.
+    """
+
+    def __init__(self, timeout=None, disconnected=None):
+        """
+        Args:
+            timeout (float): Seconds until the deadline, or None for no deadline
+            disconnected (callable): Returns True once the client has gone away
+        """
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self.disconnected = disconnected
+        self.cancelled = threading.Event()
+        self.error = None
+
+    def remaining(self):
+        """
+        Returns:
+            float: Seconds left, or None if there is no deadline
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancel(self, error):
+        if not self.cancelled.is_set():
+            self.error = error
+            self.cancelled.set()
+
+    def expired(self):
+        if self.cancelled.is_set():
+            return True
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            self.cancel(DeadlineExceeded('Deadline exceeded'))
+            return True
+        return False
+
+    def check(self):
+        """
+        Raises:
+            DeadlineExceeded: If the deadline passed or the request was cancelled
+        """
+        if self.expired():
+            raise self.error
+
+    def poll(self):
+        """
+        Like check, also looking at the client connection; called by the waiting request thread
+        """
+        if self.disconnected is not None and not self.cancelled.is_set() and self.disconnected():
+            self.cancel(ClientDisconnected('Client disconnected'))
+        self.check()
+
+    def poll_interval(self):
+        remaining = self.remaining()
+        return POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, remaining)
+
+
+class SharedDeadline(Deadline):
+    """
+    Deadline of work shared by several callers, such as a coalesced lookup
+
+    It lasts as long as the latest deadline of the callers still waiting and
+    is cancelled once the last of them has gone, so one caller timing out or
+    disconnecting does not abandon the work for the others.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.waiters = []
+
+    def join(self, deadline):
+        """
+        Args:
+            deadline (Deadline): Deadline of the caller, or None if it has none
+
+        Returns:
+            bool: False if the shared work was already abandoned and cannot be joined
+        """
+        with self.lock:
+            if self.expired():
+                return False
+            self.waiters.append(deadline)
+            self.update()
+            return True
+
+    def leave(self, deadline):
+        with self.lock:
+            self.waiters.remove(deadline)
+            if not self.waiters:
+                self.cancel(DeadlineExceeded('Every caller has gone'))
+            else:
+                self.update()
+
+    def update(self):
+        ends = [deadline.expires_at if deadline is not None else None for deadline in self.waiters]
+        self.expires_at = None if None in ends else max(ends)
+
+
+@contextmanager
+def deadline_scope(deadline):
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def check_deadline():
+    """
+    Raise DeadlineExceeded if the current request's deadline has passed
+    """
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def request_timeout(timeout):
+    """
+    Clamp a (connect, read) timeout to what is left of the current deadline
+
+    Returns:
+        tuple: The timeout to use for the next request
+    """
+    deadline = current_deadline.get()
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is None:
+        return timeout
+    remaining = max(remaining, 0.001)
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return min(connect, remaining), min(read, remaining)
+
+
+def wait_for(future):
+    """
+    Wait for a concurrent future within the current deadline
+
+    Raises:
+        DeadlineExceeded: If the deadline passed or the client disconnected
+            first; the future is cancelled if it has not started, and running
+            work notices the cancelled deadline at its next check
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return future.result()
+    # Woken by the future's own callback; the timeout only paces the deadline and connection checks
+    done = threading.Event()
+    future.add_done_callback(lambda _: done.set())
+    while True:
+        if done.wait(deadline.poll_interval()):
+            # Work that failed because it was abandoned reports the deadline, not its own error
+            if future.exception() is not None and deadline.expired():
+                raise deadline.error
+            return future.result()
+        try:
+            deadline.poll()
+        except DeadlineExceeded:
+            future.cancel()
+            raise
+
+
+async def wait_async(awaitable, deadline, disconnected=None):
+    """
+    Await a coroutine within a deadline, cancelling it once the deadline
+    passes or the client disconnects
+
+    Args:
+        awaitable: Coroutine or task to run
+        deadline (Deadline): Deadline of the request
+        disconnected (callable): Coroutine function returning True once the client has gone away
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=deadline.poll_interval())
+            if done:
+                if task.exception() is not None and deadline.expired():
+                    raise deadline.error
+                return task.result()
+            if disconnected is not None and await disconnected():
+                deadline.cancel(ClientDisconnected('Client disconnected'))
+            deadline.check()
+    finally:
+        if not task.done():
+            # Also stops parses running on threads, which check the deadline
+            deadline.cancel(DeadlineExceeded('Request cancelled'))
+            task.cancel()
+
+
+def parse_timeout(headers, body):
+    """
+    Read the caller's timeout from the X-Request-Timeout header or the body's timeout field
+
+    Returns:
+        float: Seconds, capped at MAX_REQUEST_TIMEOUT, or None if not given
+
+    Raises:
+        ValueError: If the timeout is not a positive number
+    """
+    value = headers.get(TIMEOUT_HEADER)
+    if value is None and isinstance(body, dict):
+        value = body.get(TIMEOUT_FIELD)
+    if value is None or value == '':
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid timeout: {value!r}') from None
+    if not seconds > 0:
+        raise ValueError(f'Invalid timeout: {value!r}')
+    return min(seconds, MAX_REQUEST_TIMEOUT)
+
+
+def socket_disconnected(environ):
+    """
+    Check whether the client of a WSGI request has closed its connection
+
+    Works with servers that expose the connection socket in the environ
+    (werkzeug's development server and gunicorn); otherwise reports False.
+    """
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # A readable socket with nothing to peek at has been closed by the peer
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return False
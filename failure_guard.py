@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Seconds a definitive failure is remembered; short, so a re-uploaded asset shows up quickly
+NEGATIVE_TTL = float(os.environ.get('ASSET_NEGATIVE_TTL', 60))
+
+NEGATIVE_MAX_ENTRIES = int(os.environ.get('ASSET_NEGATIVE_MAX_ENTRIES', 10000))
+
+# Statuses a retry will not change
+DEFINITIVE_STATUSES = (403, 404, 410)
+
+# Statuses that say the host, rather than the asset, is in trouble
+HOST_FAILURE_STATUSES = (429, 500, 502, 503, 504)
+
+# Consecutive host failures that open the circuit
+BREAKER_THRESHOLD = int(os.environ.get('ASSET_BREAKER_THRESHOLD', 5))
+
+# Seconds an open circuit fails fast before a single probe request is let through
+BREAKER_COOLDOWN = float(os.environ.get('ASSET_BREAKER_COOLDOWN', 30))
+
+
+class AssetNotFound(FileNotFoundError):
+    def __init__(self, url, status):
+        super().__init__(f'File {url} not found (status {status}, cached)')
+        self.status = status
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class NegativeCache:
+    """
+    Short-lived memory of URLs that failed definitively, e.g. with a 404
+
+    Every fetch strategy and every retry of a lookup would otherwise request
+    the same missing asset again.
+    """
+
+    def __init__(self, ttl=NEGATIVE_TTL, max_entries=NEGATIVE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'stored': 0}
+
+    def get(self, url):
+        """
+        Returns:
+            int: Status the URL failed with, or None if it is not known to fail
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            expires_at, status = entry
+            if time.monotonic() >= expires_at:
+                del self.entries[url]
+                return None
+            self.counters['hits'] += 1
+            return status
+
+    def put(self, url, status):
+        with self.lock:
+            self.entries[url] = (time.monotonic() + self.ttl, status)
+            self.entries.move_to_end(url)
+            self.counters['stored'] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class Circuit:
+    def __init__(self):
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker
+
+    After BREAKER_THRESHOLD consecutive connection errors, timeouts or 5xx
+    responses from a host, requests to it fail fast with CircuitOpen. Once the
+    cooldown has passed the circuit half-opens: one probe request goes
+    through, and its outcome closes the circuit or opens it again.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.circuits = {}
+        self.lock = threading.Lock()
+        self.counters = {'opened': 0, 'rejected': 0, 'probes': 0}
+
+    def clear(self):
+        with self.lock:
+            self.circuits.clear()
+
+    def before_request(self, url):
+        """
+        Raises:
+            CircuitOpen: If the host's circuit is open, or half-open with a probe in flight
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            circuit = self.circuits.get(host)
+            if circuit is None or circuit.state == 'closed':
+                return
+            now = time.monotonic()
+            if circuit.state == 'open' and now - circuit.opened_at >= self.cooldown:
+                circuit.state = 'half_open'
+                circuit.probe_started = now
+                self.counters['probes'] += 1
+                return
+            # A probe that never reported back is replaced after another cooldown
+            if circuit.state == 'half_open' and now - circuit.probe_started >= self.cooldown:
+                circuit.probe_started = now
+                self.counters['probes'] += 1
+                return
+            self.counters['rejected'] += 1
+        raise CircuitOpen(f'Circuit open for {host}, failing fast')
+
+    def record(self, url, ok):
+        """
+        Args:
+            url (str): URL that was requested
+            ok (bool): False if the request failed because of the host
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            circuit = self.circuits.get(host)
+            if ok:
+                if circuit is not None:
+                    if circuit.state != 'closed':
+                        logger.info(f'Circuit for {host} closed')
+                    del self.circuits[host]
+                return
+            if circuit is None:
+                circuit = self.circuits[host] = Circuit()
+            circuit.failures += 1
+            if circuit.state == 'half_open' or circuit.failures >= self.threshold:
+                if circuit.state != 'open':
+                    self.counters['opened'] += 1
+                    logger.warning(f'Circuit for {host} opened after {circuit.failures} failures')
+                circuit.state = 'open'
+                circuit.opened_at = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            states = [circuit.state for circuit in self.circuits.values()]
+            return dict(
+                self.counters,
+                open_hosts=states.count('open'),
+                half_open_hosts=states.count('half_open'),
+            )
+
+
+negative_cache = NegativeCache()
+circuit_breaker = CircuitBreaker()
+
+
+def guard(url):
+    """
+    Fail fast on a request that is known to fail
+
+    Raises:
+        AssetNotFound: If the URL failed definitively within the negative TTL
+        CircuitOpen: If the host's circuit is open
+    """
+    status = negative_cache.get(url)
+    if status is not None:
+        raise AssetNotFound(url, status)
+    circuit_breaker.before_request(url)
+
+
+def record_status(url, status):
+    if status in DEFINITIVE_STATUSES:
+        negative_cache.put(url, status)
+    circuit_breaker.record(url, ok=status not in HOST_FAILURE_STATUSES)
+
+
+def record_error(url):
+    """
+    Count a connection error or timeout against the URL's host
+    """
+    circuit_breaker.record(url, ok=False)
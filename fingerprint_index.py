@@ -0,0 +1,108 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metadata_cache import CACHE_MAX_ENTRIES, CACHE_PATH, CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class FingerprintIndex:
+    """
+    Metadata of assets keyed by a fingerprint of their content rather than their URL
+
+    The same creative is served under many URLs (path prefixes, signed query
+    strings, mirrors). Once one of them has been parsed, any other resolves
+    from its fingerprint, see asset_fetch.fetch_fingerprint, without fetching
+    or parsing the asset again. Like the metadata cache, entries are held in
+    an in-process LRU backed by a SQLite file and expire after its TTL, so the
+    index never serves metadata the metadata cache would have looked up again.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        """
+        Args:
+            path (str): SQLite file for the on-disk tier, or None to keep the index in memory only
+            max_entries (int): Size of the in-process LRU
+            ttl (int): Seconds an entry is served after it was stored
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'expired': 0, 'stored': 0}
+        self.db = None
+        if path:
+            try:
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS asset_fingerprints ('
+                    'fingerprint TEXT, asset_type TEXT, metadata TEXT, stored_at REAL, '
+                    'PRIMARY KEY (fingerprint, asset_type))'
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.error(f'Fingerprint index disabled on disk: {e}')
+                self.db = None
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, memory_entries=len(self.entries))
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, fingerprint, asset_type):
+        """
+        Returns:
+            dict: Metadata of an asset with this fingerprint stored within the
+            TTL, or None if none was seen
+        """
+        key = (fingerprint, asset_type)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.db is not None:
+                try:
+                    row = self.db.execute(
+                        'SELECT metadata, stored_at FROM asset_fingerprints WHERE fingerprint = ? AND asset_type = ?',
+                        key
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logger.error(e)
+                    row = None
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1])
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            if time.time() - entry[1] >= self.ttl:
+                # Parsed again and stored afresh by the lookup that follows
+                self.entries.pop(key, None)
+                self.counters['expired'] += 1
+                return None
+            self.remember(key, entry)
+            self.counters['hits'] += 1
+            return entry[0]
+
+    def put(self, fingerprint, asset_type, metadata):
+        key = (fingerprint, asset_type)
+        stored_at = time.time()
+        with self.lock:
+            self.remember(key, (metadata, stored_at))
+            self.counters['stored'] += 1
+            if self.db is None:
+                return
+            try:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO asset_fingerprints VALUES (?, ?, ?, ?)',
+                    key + (json.dumps(metadata), stored_at)
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.error(e)
@@ -0,0 +1,158 @@
+import os
+import re
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from urllib.parse import urlsplit
+
+# Observations kept per profile; older ones no longer influence decisions
+HISTORY_SIZE = int(os.environ.get('ASSET_CAPABILITY_HISTORY', 20))
+
+# Observations a profile needs before its moov placement is trusted
+MIN_SAMPLES = 3
+
+# A host seen ignoring Range is retried with ranges after this many seconds
+RANGE_SUPPORT_TTL = int(os.environ.get('ASSET_RANGE_SUPPORT_TTL', 60 * 60))
+
+# Path segments that are ids or hash shards rather than part of a layout
+ID_SEGMENT_RE = re.compile(r'^([0-9a-fA-F-]+|\d+)(\.\w+)?$')
+
+
+def profile_keys(url):
+    """
+    Keys an asset URL is profiled under, most specific first
+
+    The path pattern keeps the first path segment unless it looks like an id or
+    hash shard, plus the file extension, e.g. 'cdn.example.com/yt/*.mp4'.
+
+    Returns:
+        tuple: (pattern_key, host_key)
+    """
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    prefix = '*'
+    if len(segments) > 1 and not ID_SEGMENT_RE.match(segments[0]):
+        prefix = segments[0]
+    extension = os.path.splitext(segments[-1])[1].lower() if segments else ''
+    return f'{parts.netloc}/{prefix}/*{extension}', parts.netloc
+
+
+class HostProfile:
+    def __init__(self):
+        self.range_support = None
+        self.range_checked_at = 0.0
+        self.moov = deque(maxlen=HISTORY_SIZE)
+
+    def moov_location(self):
+        if len(self.moov) < MIN_SAMPLES:
+            return None
+        return Counter(location for location, _ in self.moov).most_common(1)[0][0]
+
+    def moov_size(self):
+        # The median rather than the largest, so one outsized moov does not inflate every first request
+        location = self.moov_location()
+        sizes = [size for seen, size in self.moov if seen == location]
+        return int(statistics.median(sizes)) if sizes else None
+
+    def as_dict(self):
+        return {
+            'range_support': self.range_support,
+            'moov_location': self.moov_location(),
+            'moov_size': self.moov_size(),
+            'samples': len(self.moov),
+        }
+
+
+class CapabilityStore:
+    """
+    What has been learned about each host and path pattern serving assets
+
+    Records whether Range requests are honoured and where the moov box of
+    videos usually sits and how big it is, so the cheapest fetch strategy can
+    be picked up front instead of after a failed first attempt.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = {}
+
+    def profiles_for(self, url):
+        return [self.profiles.setdefault(key, HostProfile()) for key in profile_keys(url)]
+
+    def record_range_support(self, url, supported):
+        with self.lock:
+            for profile in self.profiles_for(url):
+                profile.range_support = supported
+                profile.range_checked_at = time.time()
+
+    def record_moov(self, url, offset, size, total_size):
+        """
+        Args:
+            url (str): URL of the video
+            offset (int): Offset of the moov box
+            size (int): Size of the moov box
+            total_size (int): Size of the file, if known
+        """
+        location = 'tail' if total_size and offset > total_size // 2 else 'head'
+        with self.lock:
+            for profile in self.profiles_for(url):
+                profile.moov.append((location, offset + size if location == 'head' else size))
+
+    def lookup(self, url):
+        """
+        Returns:
+            tuple: (range_profile, moov_profile), for each the path pattern
+            profile if it has observed that property, else the host profile
+        """
+        with self.lock:
+            pattern, host = self.profiles_for(url)
+            range_profile = pattern if pattern.range_support is not None else host
+            moov_profile = pattern if len(pattern.moov) >= MIN_SAMPLES else host
+            return range_profile, moov_profile
+
+    def video_strategies(self, url):
+        """
+        Order in which video fetch strategies should be tried for an asset
+
+        Returns:
+            tuple: Strategy names out of 'range' (probe and walk to moov),
+            'tail' (suffix request for a trailing moov) and 'full' (download everything)
+        """
+        range_profile, moov_profile = self.lookup(url)
+        if range_profile.range_support is False and time.time() - range_profile.range_checked_at < RANGE_SUPPORT_TTL:
+            return ('full',)
+        if moov_profile.moov_location() == 'tail':
+            return ('tail', 'range', 'full')
+        return ('range', 'tail', 'full')
+
+    def probe_size(self, url, default):
+        """
+        Returns:
+            int: Initial probe size large enough to hold a typical head moov; callers cap it
+        """
+        _, profile = self.lookup(url)
+        if profile.moov_location() != 'head':
+            return default
+        return max(default, profile.moov_size() or 0)
+
+    def tail_size(self, url, default):
+        """
+        Returns:
+            int: Initial suffix size large enough to hold a typical tail moov; callers cap it
+        """
+        _, profile = self.lookup(url)
+        if profile.moov_location() != 'tail':
+            return default
+        return max(default, int((profile.moov_size() or 0) * 1.25))
+
+    def stats(self):
+        with self.lock:
+            return {key: profile.as_dict() for key, profile in self.profiles.items()}
+
+    def clear(self):
+        with self.lock:
+            self.profiles.clear()
+
+
+capabilities = CapabilityStore()
@@ -0,0 +1,171 @@
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from asset_metrics import time_phase
+from deadline import check_deadline, request_timeout
+from failure_guard import guard, record_error, record_status
+
+# Number of hosts to keep connection pools for
+POOL_HOSTS = int(os.environ.get('ASSET_POOL_HOSTS', 10))
+
+# Connections kept alive per host; requests beyond this wait for a free connection
+POOL_SIZE_PER_HOST = int(os.environ.get('ASSET_POOL_SIZE_PER_HOST', 32))
+
+RETRIES = int(os.environ.get('ASSET_RETRIES', 3))
+RETRY_BACKOFF = float(os.environ.get('ASSET_RETRY_BACKOFF', 0.2))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+CONNECT_TIMEOUT = float(os.environ.get('ASSET_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('ASSET_READ_TIMEOUT', 30))
+
+current_validators = contextvars.ContextVar('asset_validators', default=None)
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        with time_phase('connect'):
+            super().connect()
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # Covers DNS, TCP and the TLS handshake
+        with time_phase('connect'):
+            super().connect()
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose new connections report their setup time as the connect phase
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+@contextmanager
+def collect_validators():
+    """
+    Collect the ETag and Last-Modified of the responses to requests made in this scope
+
+    Lets a lookup cache its result with the validators of the responses it
+    read anyway, rather than asking for them with another request.
+
+    Yields:
+        dict: {url: (etag, last_modified)} of the first successful response per URL
+    """
+    validators = {}
+    token = current_validators.set(validators)
+    try:
+        yield validators
+    finally:
+        current_validators.reset(token)
+
+
+def as_pair(timeout):
+    return timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+
+class AssetSession(requests.Session):
+    """
+    Session with pooled keep-alive connections, retries and a default timeout
+
+    Cookies are never stored, so a single instance can be shared by all
+    request threads without them mutating a common cookie jar.
+    """
+
+    def __init__(self, pool_hosts=POOL_HOSTS, pool_size_per_host=POOL_SIZE_PER_HOST,
+                 retries=RETRIES, retry_backoff=RETRY_BACKOFF,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        """
+        Args:
+            pool_hosts (int): Number of per-host connection pools to keep
+            pool_size_per_host (int): Maximum connections per host
+            retries (int): Retries for connection errors and retryable statuses
+            retry_backoff (float): Backoff factor between retries, in seconds
+            timeout (tuple): Default (connect, read) timeout in seconds
+        """
+        super().__init__()
+        self.timeout = timeout
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=retry_backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=('GET', 'HEAD'),
+            raise_on_status=False,
+        )
+        adapter = TimedHTTPAdapter(
+            pool_connections=pool_hosts,
+            pool_maxsize=pool_size_per_host,
+            pool_block=True,
+            max_retries=retry,
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        # No request outlives the deadline of the lookup it is made for
+        check_deadline()
+        timeout = kwargs.get('timeout') or self.timeout
+        kwargs['timeout'] = request_timeout(timeout)
+        # URLs that just 404'd and hosts that keep failing are not requested again
+        guard(url)
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.Timeout:
+            # A timeout shortened to fit the caller's deadline says nothing about the host
+            if as_pair(kwargs['timeout']) != as_pair(timeout):
+                check_deadline()
+            else:
+                record_error(url)
+            raise
+        except requests.ConnectionError:
+            record_error(url)
+            raise
+        record_status(url, response.status_code)
+        validators = current_validators.get()
+        if validators is not None and response.status_code in (200, 206):
+            validators.setdefault(url, (response.headers.get('ETag'), response.headers.get('Last-Modified')))
+        return response
+
+
+session = None
+session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Get the process-wide session used for all asset fetches
+
+    Returns:
+        AssetSession: The shared session
+    """
+    global session
+    if session is None:
+        with session_lock:
+            if session is None:
+                session = AssetSession()
+    return session
@@ -1,15 +1,9 @@
-import requests
-from pymediainfo import MediaInfo
-from PIL import Image
-from io import BytesIO
 import logging
+from asset_engine import engine
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class InvalidAPIUsage(Exception):
-    pass
-
 def handle(url: str, asset_type: str):
     """
     Args: 
@@ -17,153 +11,10 @@ def handle(url: str, asset_type: str):
     Returns:
         dict: Metadata of the asset
     Raises:
-        InvalidAPIUsage
-    """
-    try:
-        return get_asset_metadata(url, asset_type)
-    except Exception as e:
-        print(e)
-        raise InvalidAPIUsage('Something went wrong!')
-
-def get_asset_metadata(asset_url, asset_type):
-    """
-    Get the metadata of an asset
-
-    Args:
-        asset_url(str): URL to the asset
-        asset_type(str): Type of asset - video or image
-
-    Returns:
-        dict: Metadata containing duration (if video) and dimension
-    """
-    metadata = {}
-    if asset_type == 'video':
-        try:
-            # metadata = get_video_metadata(asset_url)
-            metadata = get_video_metadata_full_download(asset_url)
-        except Exception as e:
-            print(e)
-            raise InvalidAPIUsage('Failed to get video metadata')
-        return metadata
-    elif asset_type == 'image':
-        try:
-            metadata = get_image_metadata(asset_url)
-        except Exception as e:
-            print(e)
-            raise InvalidAPIUsage('Failed to get image metadata')
-        return metadata
-    else:
-        return metadata
-
-def get_video_metadata(video_url):
-    """
-    Get the metadata of a video from its URL using pymediainfo with range requests
-
-    Args:
-        video_url (str): URL of the video
-
-    Returns:
-        dict: Metadata containing duration and dimension
-    """
-    try:
-        headers = {'Range': 'bytes=0-2000000'}  # Adjust range as needed
-        response = requests.get(video_url, headers=headers, stream=True)
-        # if response.status_code not in (200, 206):
-        #     raise FileNotFoundError(f'File {video_url} not found or range not supported')
-        if response.status_code not in (200, 206):
-            logger.info('Range request not supported, attempting full download')
-            response = requests.get(video_url)
-            if response.status_code != 200:
-                raise FileNotFoundError(f'File {video_url} not found')
-
-        # temp_file = BytesIO(response.content)
-        # Load the streamed response content into a BytesIO object
-        temp_file = BytesIO()
-        for chunk in response.iter_content(chunk_size=1024):
-            if chunk:  # Filter out keep-alive new chunks
-                temp_file.write(chunk)
-
-        # Reset the file pointer to the beginning
-        temp_file.seek(0)
-        media_info = MediaInfo.parse(temp_file)
-
-        for track in media_info.tracks:
-            if track.track_type == "Video":
-                print(track, response)
-                metadata = {
-                    'duration': track.duration / 1000,  # Convert from ms to seconds
-                    'dimension': f"{track.width}x{track.height}"
-                }
-                return metadata
-        raise InvalidAPIUsage('No video stream found')
-    except Exception as e:
-        print(e)
-        raise InvalidAPIUsage('Failed to get video metadata')
-
-def get_video_metadata_full_download(video_url):
-    """
-    Fallback: Get the metadata of a video by downloading the full file
-
-    Args:
-        video_url (str): URL of the video
-
-    Returns:
-        dict: Metadata containing duration and dimension
-    """
-    try:
-        response = requests.get(video_url, stream=True)
-        if response.status_code != 200:
-            raise FileNotFoundError(f'File {video_url} not found')
-
-        temp_file = BytesIO()
-        for chunk in response.iter_content(chunk_size=1024):
-            if chunk:
-                temp_file.write(chunk)
-
-        temp_file.seek(0)
-        
-        media_info = MediaInfo.parse(temp_file)
-        
-        for track in media_info.tracks:
-            if track.track_type == "Video":
-                metadata = {
-                    'duration': track.duration / 1000,  # Convert from ms to seconds
-                    'dimension': f"{track.width}x{track.height}"
-                }
-                return metadata
-        
-        raise InvalidAPIUsage('No video stream found after full download')
-    except Exception as e:
-        print(e)
-        raise InvalidAPIUsage('Failed to get video metadata after full download')
-
-def get_image_metadata(image_url):
-    """
-    Get the metadata of an image from its URL
-
-    Args:
-        image_url (str): URL of the image
-
-    Returns:
-        dict: Metadata containing dimension
+        AssetMetadataError
     """
-    try:
-        response = requests.get(image_url, stream=True)
-        if response.status_code != 200:
-            raise FileNotFoundError(f'File {image_url} not found')
-
-        image = Image.open(BytesIO(response.content))
-        width, height = image.width, image.height
-        return {
-            'dimension': f'{width}x{height}'
-        }
-    except Exception as e:
-        print(e)
-        raise InvalidAPIUsage('Failed to get image metadata')
-
-# Example usage
-# print(handle("https://example.com/video.mp4", "video"))
-# print(handle("https://example.com/image.jpg", "image"))
+    # Same strategies, cache and settings as the services
+    return engine.handle(url, asset_type)
 
 arr = [
   "https://adint-assets.datamagic.rocks/e/ed/ed6/ed69/ed69e/ed69eb/ed69eb76-788d-4456-872c-3c513dede1d1/1806c77b-fe95-469c-9aaa-9917053bc253.mp4", 
@@ -0,0 +1,888 @@
+import math
+import struct
+
+# Optional video fields, parsed only when requested; the container may not record all of them
+VIDEO_FIELDS = ('codec', 'bitrate', 'frame_rate', 'rotation', 'has_audio')
+
+# Box types that may legitimately appear at the top level of an MP4/MOV file
+TOP_LEVEL_BOXES = {
+    'ftyp', 'moov', 'mdat', 'free', 'skip', 'wide', 'pnot', 'uuid',
+    'moof', 'mfra', 'sidx', 'styp', 'meta', 'pdin', 'prft', 'emsg',
+}
+
+
+def read_box_header(data, offset=0):
+    """
+    Read an ISO-BMFF box header
+
+    Args:
+        data (bytes): Buffer containing the header
+        offset (int): Position of the header in the buffer
+
+    Returns:
+        tuple: (box_type, box_size, header_size), or None if the buffer does not
+        hold the complete header. box_size is None for a box that runs to the
+        end of the file.
+    """
+    if len(data) - offset < 8:
+        return None
+
+    box_size, box_type = struct.unpack_from('>I4s', data, offset)
+    header_size = 8
+    if box_size == 1:
+        if len(data) - offset < 16:
+            return None
+        box_size = struct.unpack_from('>Q', data, offset + 8)[0]
+        header_size = 16
+    elif box_size == 0:
+        box_size = None
+
+    return box_type.decode('latin-1'), box_size, header_size
+
+
+def is_iso_bmff(data):
+    """
+    Check whether a buffer looks like the start of an MP4/MOV file
+
+    Args:
+        data (bytes): First bytes of the file
+
+    Returns:
+        bool: True if the first box is a known top-level box
+    """
+    header = read_box_header(data)
+    if header is None:
+        return False
+    box_type, box_size, header_size = header
+    if box_size is not None and box_size < header_size:
+        return False
+    return box_type in TOP_LEVEL_BOXES
+
+
+# Matroska/WebM element IDs (marker bits included)
+EBML_HEADER = 0x1A45DFA3
+MKV_SEGMENT = 0x18538067
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_DEFAULT_DURATION = 0x23E383
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_CLUSTER = 0x1F43B675
+
+# How much of a Matroska file is read when looking for its headers, at first and at most
+EBML_FIRST_READ_SIZE = 64 * 1024
+EBML_READ_SIZE = 1024 * 1024
+
+
+def iter_boxes(data):
+    """
+    Iterate over the child boxes of an ISO-BMFF container box
+
+    Args:
+        data (bytes): Payload of the container box
+
+    Yields:
+        tuple: (box_type, payload)
+    """
+    offset = 0
+    while True:
+        header = read_box_header(data, offset)
+        if header is None:
+            return
+        box_type, box_size, header_size = header
+        if box_size is None:
+            box_size = len(data) - offset
+        if box_size < header_size or offset + box_size > len(data):
+            return
+        yield box_type, data[offset + header_size:offset + box_size]
+        offset += box_size
+
+
+def find_box(data, *path):
+    """
+    Find a nested box by its path of box types, e.g. find_box(trak, 'mdia', 'mdhd')
+
+    Returns:
+        bytes: Payload of the first matching box, or None
+    """
+    for box_type in path:
+        data = next((payload for child, payload in iter_boxes(data) if child == box_type), None)
+        if data is None:
+            return None
+    return data
+
+
+def read_duration_box(payload):
+    """
+    Read timescale and duration from an mvhd or mdhd box payload
+
+    Returns:
+        tuple: (timescale, duration)
+    """
+    if payload[0] == 1:
+        return struct.unpack_from('>IQ', payload, 20)
+    return struct.unpack_from('>II', payload, 12)
+
+
+def iter_traks(moov, handler):
+    """
+    Iterate over the tracks of a moov box payload with the given handler type
+
+    Yields:
+        bytes: Payload of each trak box whose handler is e.g. b'vide' or b'soun'
+    """
+    for box_type, trak in iter_boxes(moov):
+        if box_type != 'trak':
+            continue
+        hdlr = find_box(trak, 'mdia', 'hdlr')
+        if hdlr is not None and hdlr[8:12] == handler:
+            yield trak
+
+
+def iter_video_traks(moov):
+    """
+    Iterate over the video tracks of a moov box payload
+
+    Yields:
+        bytes: Payload of each trak box whose handler is 'vide'
+    """
+    return iter_traks(moov, b'vide')
+
+
+def read_track_dimension(trak):
+    """
+    Read the width and height of a video track
+
+    Returns:
+        tuple: (width, height), zeros if the track does not record them
+    """
+    # The sample entry holds the coded size, which is what MediaInfo reports
+    width, height = 0, 0
+    stsd = find_box(trak, 'mdia', 'minf', 'stbl', 'stsd')
+    if stsd is not None and len(stsd) >= 44:
+        width, height = struct.unpack_from('>HH', stsd, 8 + 8 + 24)
+    tkhd = find_box(trak, 'tkhd')
+    if not (width and height) and tkhd is not None:
+        offset = 88 if tkhd[0] == 1 else 76
+        width, height = (value >> 16 for value in struct.unpack_from('>II', tkhd, offset))
+    return width, height
+
+
+def read_sample_count(stbl):
+    """
+    Returns:
+        int: Number of samples in a track's stts box, 0 if it has none
+    """
+    stts = find_box(stbl, 'stts')
+    if stts is None:
+        return 0
+    count = struct.unpack_from('>I', stts, 4)[0]
+    return sum(struct.unpack_from(f'>{count * 2}I', stts, 8)[::2])
+
+
+def read_sample_bytes(stbl):
+    """
+    Returns:
+        int: Total size of a track's samples according to its stsz box, 0 if it has none
+    """
+    stsz = find_box(stbl, 'stsz')
+    if stsz is None:
+        return 0
+    sample_size, count = struct.unpack_from('>II', stsz, 4)
+    if sample_size:
+        return sample_size * count
+    return sum(struct.unpack_from(f'>{count}I', stsz, 12))
+
+
+def read_rotation(trak):
+    """
+    Returns:
+        int: Clockwise rotation of a track in degrees from its display matrix, or None without tkhd
+    """
+    tkhd = find_box(trak, 'tkhd')
+    if tkhd is None:
+        return None
+    # First row of the display matrix, in 16.16 fixed point
+    a, b = struct.unpack_from('>ii', tkhd, 52 if tkhd[0] == 1 else 40)
+    return round(math.degrees(math.atan2(b, a))) % 360
+
+
+def read_track_fields(moov, trak, seconds, fields):
+    """
+    Read the requested optional fields of a video track from the moov box
+
+    Args:
+        moov (bytes): Payload of the moov box
+        trak (bytes): Payload of the video track
+        seconds (float): Duration of the track
+        fields (tuple): Names out of VIDEO_FIELDS
+
+    Returns:
+        dict: Value of each requested field, None where the file does not record it
+    """
+    details = {}
+    stbl = find_box(trak, 'mdia', 'minf', 'stbl') or b''
+    if 'codec' in fields:
+        stsd = find_box(stbl, 'stsd')
+        details['codec'] = stsd[12:16].decode('latin-1') if stsd is not None and len(stsd) >= 16 else None
+    if 'bitrate' in fields:
+        # Fragmented files keep their sample tables in moof boxes, so these are empty
+        sample_bytes = read_sample_bytes(stbl)
+        details['bitrate'] = round(sample_bytes * 8 / seconds) if sample_bytes else None
+    if 'frame_rate' in fields:
+        samples = read_sample_count(stbl)
+        details['frame_rate'] = round(samples / seconds, 3) if samples else None
+    if 'rotation' in fields:
+        details['rotation'] = read_rotation(trak)
+    if 'has_audio' in fields:
+        details['has_audio'] = next(iter_traks(moov, b'soun'), None) is not None
+    return details
+
+
+def parse_moov(moov, fields=()):
+    """
+    Extract video duration and dimension from the payload of a moov box
+
+    Args:
+        moov (bytes): Payload of the moov box
+        fields (tuple): Optional fields to read as well, see VIDEO_FIELDS
+
+    Returns:
+        dict: Metadata containing duration and dimension, or None if there is no
+        usable video track
+    """
+    mvhd = find_box(moov, 'mvhd')
+    if mvhd is None:
+        return None
+    movie_timescale, _ = read_duration_box(mvhd)
+
+    for trak in iter_video_traks(moov):
+        timescale, duration = 0, 0
+        mdhd = find_box(trak, 'mdia', 'mdhd')
+        if mdhd is not None:
+            timescale, duration = read_duration_box(mdhd)
+        tkhd = find_box(trak, 'tkhd')
+        if not (timescale and duration) and tkhd is not None:
+            timescale = movie_timescale
+            if tkhd[0] == 1:
+                duration = struct.unpack_from('>Q', tkhd, 28)[0]
+            else:
+                duration = struct.unpack_from('>I', tkhd, 20)[0]
+        if not (timescale and duration):
+            return None
+
+        width, height = read_track_dimension(trak)
+        if not (width and height):
+            return None
+
+        metadata = {
+            'duration': round(duration * 1000 / timescale) / 1000,
+            'dimension': f'{width}x{height}'
+        }
+        if fields:
+            metadata.update(read_track_fields(moov, trak, duration / timescale, fields))
+        return metadata
+    return None
+
+
+def init_segment_dimension(data):
+    """
+    Read the video dimension from a fragmented MP4 init segment
+
+    Init segments carry a moov box without durations, so parse_moov cannot be used.
+
+    Args:
+        data (bytes): The init segment
+
+    Returns:
+        tuple: (width, height), or None if there is no video track
+    """
+    moov = find_box(data, 'moov')
+    if moov is None:
+        return None
+    for trak in iter_video_traks(moov):
+        width, height = read_track_dimension(trak)
+        if width and height:
+            return width, height
+    return None
+
+
+def read_sample_size(stsz, number):
+    """
+    Returns:
+        int: Size of a sample, by 1-based sample number, or None past the last sample
+    """
+    sample_size, count = struct.unpack_from('>II', stsz, 4)
+    if not 1 <= number <= count:
+        return None
+    return sample_size or struct.unpack_from('>I', stsz, 8 + 4 * number)[0]
+
+
+def read_chunk_offsets(stbl):
+    """
+    Returns:
+        tuple: File offset of each chunk, from the stco or co64 box
+    """
+    stco = find_box(stbl, 'stco')
+    if stco is not None:
+        count = struct.unpack_from('>I', stco, 4)[0]
+        return struct.unpack_from(f'>{count}I', stco, 8)
+    co64 = find_box(stbl, 'co64')
+    if co64 is not None:
+        count = struct.unpack_from('>I', co64, 4)[0]
+        return struct.unpack_from(f'>{count}Q', co64, 8)
+    return ()
+
+
+def locate_sample(stbl, number):
+    """
+    Find where a sample is stored, following the sample-to-chunk table
+
+    Args:
+        stbl (bytes): Payload of the track's stbl box
+        number (int): 1-based sample number
+
+    Returns:
+        tuple: (offset, size) of the sample in the file, or None
+    """
+    stsc, stsz = find_box(stbl, 'stsc'), find_box(stbl, 'stsz')
+    offsets = read_chunk_offsets(stbl)
+    if stsc is None or stsz is None or not offsets:
+        return None
+    count = struct.unpack_from('>I', stsc, 4)[0]
+    runs = [struct.unpack_from('>III', stsc, 8 + 12 * index) for index in range(count)]
+
+    first_sample = 1
+    for index, (first_chunk, samples_per_chunk, _) in enumerate(runs):
+        last_chunk = runs[index + 1][0] - 1 if index + 1 < len(runs) else len(offsets)
+        run_samples = (last_chunk - first_chunk + 1) * samples_per_chunk
+        if number < first_sample + run_samples:
+            chunk = first_chunk + (number - first_sample) // samples_per_chunk
+            first_in_chunk = number - (number - first_sample) % samples_per_chunk
+            if chunk > len(offsets):
+                return None
+            offset = offsets[chunk - 1] + sum(read_sample_size(stsz, item) for item in range(first_in_chunk, number))
+            return offset, read_sample_size(stsz, number)
+        first_sample += run_samples
+    return None
+
+
+def read_decoder_config(stsd):
+    """
+    Read the codec and the parameter sets of an H.264 or HEVC sample entry
+
+    Returns:
+        tuple: (codec, nal_length_size, parameter_sets), parameter_sets being
+        the SPS/PPS (and VPS for HEVC) NAL units, or None for other codecs
+    """
+    entry_size = struct.unpack_from('>I', stsd, 8)[0]
+    codec = stsd[12:16].decode('latin-1')
+    # Child boxes follow the 78 bytes of VisualSampleEntry fields
+    for box_type, config in iter_boxes(stsd[16 + 78:8 + entry_size]):
+        parameter_sets = []
+        if box_type == 'avcC':
+            length_size = (config[4] & 3) + 1
+            position = 5
+            for mask in (0x1F, 0xFF):
+                count = config[position] & mask
+                position += 1
+                for _ in range(count):
+                    length = struct.unpack_from('>H', config, position)[0]
+                    parameter_sets.append(config[position + 2:position + 2 + length])
+                    position += 2 + length
+            return codec, length_size, parameter_sets
+        if box_type == 'hvcC':
+            length_size = (config[21] & 3) + 1
+            position = 23
+            for _ in range(config[22]):
+                count = struct.unpack_from('>H', config, position + 1)[0]
+                position += 3
+                for _ in range(count):
+                    length = struct.unpack_from('>H', config, position)[0]
+                    parameter_sets.append(config[position + 2:position + 2 + length])
+                    position += 2 + length
+            return codec, length_size, parameter_sets
+    return None
+
+
+def keyframe_location(moov, index=0):
+    """
+    Locate a keyframe of the first video track using the sample tables of the moov box
+
+    Args:
+        moov (bytes): Payload of the moov box
+        index (int): 0-based index of the keyframe, e.g. 0 for the first one
+
+    Returns:
+        dict: offset and size of the keyframe sample in the file, the codec,
+        nal_length_size and parameter_sets needed to decode it and the track's
+        rotation, or None if there is no such keyframe or the codec is not
+        H.264/HEVC
+    """
+    for trak in iter_video_traks(moov):
+        stbl = find_box(trak, 'mdia', 'minf', 'stbl')
+        stsd = find_box(stbl, 'stsd') if stbl is not None else None
+        if stsd is None or len(stsd) < 16:
+            return None
+        config = read_decoder_config(stsd)
+        if config is None:
+            return None
+
+        # Without an stss box every sample is a keyframe
+        stss = find_box(stbl, 'stss')
+        if stss is None:
+            number = index + 1
+        elif index < struct.unpack_from('>I', stss, 4)[0]:
+            number = struct.unpack_from('>I', stss, 8 + 4 * index)[0]
+        else:
+            return None
+        location = locate_sample(stbl, number)
+        if location is None or not location[1]:
+            return None
+
+        codec, length_size, parameter_sets = config
+        return {
+            'offset': location[0],
+            'size': location[1],
+            'codec': codec,
+            'nal_length_size': length_size,
+            'parameter_sets': parameter_sets,
+            'rotation': read_rotation(trak) or 0,
+        }
+    return None
+
+
+def read_moov(file):
+    """
+    Read the moov box of an MP4/MOV file by walking its top-level boxes
+
+    Args:
+        file: Seekable binary file object
+
+    Returns:
+        bytes: Payload of the moov box, or None
+    """
+    file.seek(0, 2)
+    size = file.tell()
+    offset = 0
+    while offset < size:
+        file.seek(offset)
+        header = read_box_header(file.read(16))
+        if header is None:
+            return None
+        box_type, box_size, header_size = header
+        if box_size is None:
+            box_size = size - offset
+        if box_size < header_size:
+            return None
+        if box_type == 'moov':
+            file.seek(offset + header_size)
+            return file.read(box_size - header_size)
+        offset += box_size
+    return None
+
+
+def parse_mp4(file, fields=()):
+    """
+    Extract video metadata from an MP4/MOV file by reading its moov box
+
+    Args:
+        file: Seekable binary file object
+        fields (tuple): Optional fields to read as well, see VIDEO_FIELDS
+
+    Returns:
+        dict: Metadata containing duration and dimension, or None
+    """
+    moov = read_moov(file)
+    if moov is None:
+        return None
+    return parse_moov(moov, fields)
+
+
+def read_vint(data, position, keep_marker=False):
+    """
+    Read an EBML variable length integer
+
+    Args:
+        data (bytes): Buffer to read from
+        position (int): Offset of the integer
+        keep_marker (bool): Keep the length marker bit, as element IDs do
+
+    Returns:
+        tuple: (value, next_position). value is -1 for an unknown element size
+        and None if the buffer ends before the integer does.
+    """
+    if position >= len(data) or data[position] == 0:
+        return None, position
+    first = data[position]
+    length = 9 - first.bit_length()
+    if position + length > len(data):
+        return None, position
+    value = first if keep_marker else first & ((1 << (8 - length)) - 1)
+    for byte in data[position + 1:position + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = -1
+    return value, position + length
+
+
+def iter_elements(data, start=0, end=None):
+    """
+    Iterate over the EBML elements between start and end
+
+    Yields:
+        tuple: (element_id, payload_start, payload_end). payload_end is clamped
+        to end for elements of unknown size or that run past the buffer.
+    """
+    end = len(data) if end is None else end
+    position = start
+    while position < end:
+        element_id, position = read_vint(data, position, keep_marker=True)
+        if element_id is None:
+            return
+        size, position = read_vint(data, position)
+        if size is None:
+            return
+        payload_end = end if size < 0 else min(position + size, end)
+        yield element_id, position, payload_end
+        if size < 0:
+            return
+        position = payload_end
+
+
+def read_ebml_uint(data, start, end):
+    return int.from_bytes(data[start:end], 'big')
+
+
+def read_ebml_float(data, start, end):
+    if end - start == 4:
+        return struct.unpack('>f', data[start:end])[0]
+    if end - start == 8:
+        return struct.unpack('>d', data[start:end])[0]
+    return 0.0
+
+
+def matroska_headers_read(data):
+    """
+    Check whether the Info and Tracks elements of a Matroska file are wholly within data
+
+    Both are complete once another element of the segment starts after them.
+    """
+    segment = next((element for element in iter_elements(data) if element[0] == MKV_SEGMENT), None)
+    if segment is None:
+        return False
+    seen = set()
+    for element_id, _, _ in iter_elements(data, segment[1], segment[2]):
+        if MKV_INFO in seen and MKV_TRACKS in seen:
+            return True
+        seen.add(element_id)
+    return False
+
+
+def read_matroska_head(file, magic):
+    """
+    Read the leading bytes of a Matroska file up to the end of its Tracks
+
+    Reads start at EBML_FIRST_READ_SIZE and double up to EBML_READ_SIZE in
+    all, so the few kilobytes of headers most files have are not read a
+    megabyte at a time.
+
+    Args:
+        file: Binary file object positioned right after the EBML magic
+        magic (bytes): The four bytes already read
+
+    Returns:
+        bytes: The leading bytes of the file
+    """
+    data = bytearray(magic)
+    read_size = EBML_FIRST_READ_SIZE
+    while len(data) < EBML_READ_SIZE:
+        chunk = file.read(min(read_size, EBML_READ_SIZE - len(data)))
+        if not chunk:
+            break
+        data += chunk
+        if matroska_headers_read(data):
+            break
+        read_size *= 2
+    return bytes(data)
+
+
+def parse_matroska(data, fields=()):
+    """
+    Extract video duration and dimension from the start of a Matroska/WebM file
+
+    Of the optional fields, bitrate is not recorded in the headers and is
+    reported as None, and rotation is always 0 as Matroska has no display matrix.
+
+    Args:
+        data (bytes): Leading bytes of the file, holding at least Info and Tracks
+        fields (tuple): Optional fields to read as well, see VIDEO_FIELDS
+
+    Returns:
+        dict: Metadata containing duration and dimension, or None
+    """
+    if data[:4] != EBML_HEADER.to_bytes(4, 'big'):
+        return None
+
+    segment = next((element for element in iter_elements(data) if element[0] == MKV_SEGMENT), None)
+    if segment is None:
+        return None
+
+    timecode_scale, duration, width, height = 1000000, None, None, None
+    details = {}
+    for element_id, start, end in iter_elements(data, segment[1], segment[2]):
+        if element_id == MKV_INFO:
+            for child_id, child_start, child_end in iter_elements(data, start, end):
+                if child_id == MKV_TIMECODE_SCALE:
+                    timecode_scale = read_ebml_uint(data, child_start, child_end)
+                elif child_id == MKV_DURATION:
+                    duration = read_ebml_float(data, child_start, child_end)
+        elif element_id == MKV_TRACKS:
+            has_audio, found_video = False, False
+            for entry_id, entry_start, entry_end in iter_elements(data, start, end):
+                if entry_id != MKV_TRACK_ENTRY:
+                    continue
+                track = {child_id: (child_start, child_end)
+                         for child_id, child_start, child_end in iter_elements(data, entry_start, entry_end)}
+                track_type = read_ebml_uint(data, *track[MKV_TRACK_TYPE]) if MKV_TRACK_TYPE in track else None
+                has_audio = has_audio or track_type == 2
+                if track_type != 1 or found_video:
+                    continue
+                found_video = True
+                if MKV_VIDEO in track:
+                    video = {child_id: (child_start, child_end)
+                             for child_id, child_start, child_end in iter_elements(data, *track[MKV_VIDEO])}
+                    if MKV_PIXEL_WIDTH in video and MKV_PIXEL_HEIGHT in video:
+                        width = read_ebml_uint(data, *video[MKV_PIXEL_WIDTH])
+                        height = read_ebml_uint(data, *video[MKV_PIXEL_HEIGHT])
+                if 'codec' in fields:
+                    codec_id = track.get(MKV_CODEC_ID)
+                    details['codec'] = data[codec_id[0]:codec_id[1]].decode('latin-1') if codec_id else None
+                if 'frame_rate' in fields:
+                    # Nanoseconds per frame
+                    frame_duration = read_ebml_uint(data, *track[MKV_DEFAULT_DURATION]) if MKV_DEFAULT_DURATION in track else 0
+                    details['frame_rate'] = round(1e9 / frame_duration, 3) if frame_duration else None
+                # Only the audio tracks after the video one are left to look for
+                if 'has_audio' not in fields or has_audio:
+                    break
+            if 'has_audio' in fields:
+                details['has_audio'] = has_audio
+        elif element_id == MKV_CLUSTER:
+            break
+
+        if duration is not None and width is not None:
+            break
+
+    if not (duration and width and height):
+        return None
+    metadata = {
+        'duration': round(duration * timecode_scale / 1000000) / 1000,
+        'dimension': f'{width}x{height}'
+    }
+    if 'bitrate' in fields:
+        metadata['bitrate'] = None
+    if 'rotation' in fields:
+        metadata['rotation'] = 0
+    metadata.update(details)
+    return metadata
+
+
+def probe_video_metadata(file, fields=()):
+    """
+    Read video duration and dimension straight from the container headers
+
+    This is a fast path for MP4/MOV and Matroska/WebM that avoids running
+    libmediainfo; callers should fall back to MediaInfo when it returns None.
+
+    Args:
+        file: Seekable binary file object holding the (possibly partial) video
+        fields (tuple): Optional fields to read as well, see VIDEO_FIELDS
+
+    Returns:
+        dict: Metadata containing duration, dimension and the requested fields, or None
+    """
+    try:
+        file.seek(0)
+        head = file.read(16)
+        if is_iso_bmff(head):
+            return parse_mp4(file, fields)
+        if head[:4] != EBML_HEADER.to_bytes(4, 'big'):
+            return None
+        file.seek(4)
+        return parse_matroska(read_matroska_head(file, head[:4]), fields)
+    except (struct.error, IndexError, ValueError):
+        return None
+    finally:
+        file.seek(0)
+
+
+# JPEG start-of-frame markers; C4, C8 and CC share the range but are not frames
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# JPEG markers that have no length field
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xDA)) | {0x01}
+
+IMAGE_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',
+    b'GIF87a',
+    b'GIF89a',
+    b'\xff\xd8',
+    b'BM',
+)
+
+
+def is_sniffable_image(data):
+    """
+    Check whether sniff_image_size knows the format of an image
+
+    Args:
+        data (bytes): First bytes of the image (at least 12)
+
+    Returns:
+        bool: True if the dimensions can be read from the header
+    """
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return True
+    if data[4:8] == b'ftyp' and data[8:12] in (b'avif', b'avis', b'heic', b'heix', b'mif1', b'msf1'):
+        return True
+    return data.startswith(IMAGE_SIGNATURES)
+
+
+def sniff_jpeg_size(data):
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte
+            position += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            position += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            if position + 9 > len(data):
+                return None
+            height, width = struct.unpack_from('>HH', data, position + 5)
+            return width, height
+        position += 2 + struct.unpack_from('>H', data, position + 2)[0]
+    return None
+
+
+def sniff_webp_size(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack_from('<HH', data, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(data) >= 30:
+        return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+    return None
+
+
+def iter_item_properties(ipma):
+    """
+    Iterate over the item property associations of an ipma box payload
+
+    Yields:
+        tuple: (item_id, indexes) where indexes are 1-based positions in ipco
+    """
+    version, flags = ipma[0], int.from_bytes(ipma[1:4], 'big')
+    position = 8
+    for _ in range(struct.unpack_from('>I', ipma, 4)[0]):
+        if version < 1:
+            item_id = struct.unpack_from('>H', ipma, position)[0]
+            position += 2
+        else:
+            item_id = struct.unpack_from('>I', ipma, position)[0]
+            position += 4
+        indexes = []
+        for _ in range(ipma[position]):
+            # The top bit of each association marks it essential
+            if flags & 1:
+                indexes.append(struct.unpack_from('>H', ipma, position + 1)[0] & 0x7FFF)
+                position += 2
+            else:
+                indexes.append(ipma[position + 1] & 0x7F)
+                position += 1
+        position += 1
+        yield item_id, indexes
+
+
+def sniff_heif_size(data):
+    """
+    Read the dimensions of the primary item of an AVIF/HEIF image
+
+    Every item, thumbnails and the tiles of a grid included, carries its own
+    ispe property, so the one associated with the item named by pitm is used.
+    For a grid that is the size of the whole image.
+    """
+    # meta is a full box, so its children start after version and flags
+    meta = next((payload for box_type, payload in iter_boxes(data) if box_type == 'meta'), None)
+    if meta is None:
+        return None
+    pitm = find_box(meta[4:], 'pitm')
+    iprp = find_box(meta[4:], 'iprp')
+    if pitm is None or iprp is None:
+        return None
+    primary = struct.unpack_from('>H' if pitm[0] == 0 else '>I', pitm, 4)[0]
+    properties = list(iter_boxes(find_box(iprp, 'ipco') or b''))
+    ipma = find_box(iprp, 'ipma')
+    if ipma is None:
+        return None
+    for item_id, indexes in iter_item_properties(ipma):
+        if item_id != primary:
+            continue
+        associated = dict(properties[index - 1] for index in indexes if 0 < index <= len(properties))
+        ispe = associated.get('ispe')
+        if ispe is None or len(ispe) < 12:
+            return None
+        width, height = struct.unpack_from('>II', ispe, 4)
+        # irot turns the image by multiples of 90 degrees
+        if 'irot' in associated and associated['irot'][0] & 1:
+            return height, width
+        return width, height
+    return None
+
+
+def sniff_image_size(data):
+    """
+    Read image dimensions from the header bytes of a PNG, JPEG, GIF, WebP, BMP or AVIF/HEIF
+
+    Args:
+        data (bytes): Leading bytes of the image
+
+    Returns:
+        tuple: (width, height), or None if the format is unknown or more bytes are needed
+    """
+    try:
+        if data.startswith(b'\x89PNG\r\n\x1a\n'):
+            if len(data) >= 24 and data[12:16] == b'IHDR':
+                return struct.unpack_from('>II', data, 16)
+        elif data[:6] in (b'GIF87a', b'GIF89a'):
+            if len(data) >= 10:
+                return struct.unpack_from('<HH', data, 6)
+        elif data.startswith(b'\xff\xd8'):
+            return sniff_jpeg_size(data)
+        elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return sniff_webp_size(data)
+        elif data[4:8] == b'ftyp':
+            return sniff_heif_size(data)
+        elif data.startswith(b'BM'):
+            if len(data) >= 26:
+                if struct.unpack_from('<I', data, 14)[0] == 12:
+                    return struct.unpack_from('<HH', data, 18)
+                width, height = struct.unpack_from('<ii', data, 18)
+                return width, abs(height)
+    except (struct.error, IndexError):
+        return None
+    return None
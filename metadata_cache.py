@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from asset_fetch import is_unchanged
+from http_session import collect_validators
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.environ.get('ASSET_CACHE_PATH', 'asset_metadata_cache.sqlite3')
+
+# Entries younger than this are served without touching the network
+CACHE_TTL = int(os.environ.get('ASSET_CACHE_TTL', 24 * 60 * 60))
+
+CACHE_MAX_ENTRIES = int(os.environ.get('ASSET_CACHE_MAX_ENTRIES', 10000))
+
+
+class CacheEntry:
+    def __init__(self, metadata, etag=None, last_modified=None, validated_at=None):
+        self.metadata = metadata
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validated_at = time.time() if validated_at is None else validated_at
+
+    def is_fresh(self, ttl):
+        return time.time() - self.validated_at < ttl
+
+
+class MetadataCache:
+    """
+    Two-tier cache of asset metadata keyed by URL and asset type
+
+    Lookups go to an in-process LRU first and then to a SQLite file. Entries
+    older than the TTL are revalidated against the asset's ETag/Last-Modified
+    with a conditional HEAD request before they are served again.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        """
+        Args:
+            path (str): SQLite file for the on-disk tier, or None to keep the cache in memory only
+            ttl (int): Seconds an entry is served before it is revalidated
+            max_entries (int): Size of the in-process LRU
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'revalidated': 0,
+            'invalidated': 0,
+            'misses': 0,
+        }
+        self.db = None
+        if path:
+            try:
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS asset_metadata ('
+                    'url TEXT, asset_type TEXT, metadata TEXT, etag TEXT, '
+                    'last_modified TEXT, validated_at REAL, PRIMARY KEY (url, asset_type))'
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.error(f'Metadata cache disabled on disk: {e}')
+                self.db = None
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss counters and the number of entries held in memory
+        """
+        with self.lock:
+            return dict(self.counters, memory_entries=len(self.entries))
+
+    def remember(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def load(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry, 'memory_hits'
+            if self.db is None:
+                return None, None
+            try:
+                row = self.db.execute(
+                    'SELECT metadata, etag, last_modified, validated_at FROM asset_metadata '
+                    'WHERE url = ? AND asset_type = ?', key
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(e)
+                return None, None
+        if row is None:
+            return None, None
+        entry = CacheEntry(json.loads(row[0]), row[1], row[2], row[3])
+        self.remember(key, entry)
+        return entry, 'disk_hits'
+
+    def store(self, key, entry):
+        self.remember(key, entry)
+        if self.db is None:
+            return
+        with self.lock:
+            try:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO asset_metadata VALUES (?, ?, ?, ?, ?, ?)',
+                    key + (json.dumps(entry.metadata), entry.etag, entry.last_modified, entry.validated_at)
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.error(e)
+
+    def contains(self, url, asset_type):
+        """
+        Check whether fresh metadata of an asset is cached, without counting a hit or a miss
+
+        For callers that only decide whether to look an asset up, such as the
+        cache warmer; the lookup itself then counts the hit or miss.
+
+        Returns:
+            bool: True if the entry is within its TTL
+        """
+        entry, _ = self.load((url, asset_type))
+        return entry is not None and entry.is_fresh(self.ttl)
+
+    def get_hit(self, url, asset_type):
+        """
+        Return fresh cached metadata counting the hit, or None counting nothing
+
+        For callers that go through get_or_compute on a miss, which then counts it.
+
+        Returns:
+            dict: Metadata of the asset, or None on a miss or a stale entry
+        """
+        entry, tier = self.load((url, asset_type))
+        if entry is None or not entry.is_fresh(self.ttl):
+            return None
+        self.count(tier)
+        return entry.metadata
+
+    def get_fresh(self, url, asset_type):
+        """
+        Return cached metadata that is still within its TTL, without any network traffic
+
+        Args:
+            url (str): URL of the asset
+            asset_type (str): Type of asset - video or image
+
+        Returns:
+            dict: Metadata of the asset, or None on a miss or a stale entry
+        """
+        entry, tier = self.load((url, asset_type))
+        if entry is None:
+            self.count('misses')
+            return None
+        if not entry.is_fresh(self.ttl):
+            self.count('invalidated')
+            return None
+        self.count(tier)
+        return entry.metadata
+
+    def put(self, url, asset_type, metadata, etag=None, last_modified=None):
+        """
+        Store metadata computed outside get_or_compute
+
+        Args:
+            url (str): URL of the asset
+            asset_type (str): Type of asset - video or image
+            metadata (dict): Metadata of the asset
+            etag (str): ETag of the asset, if known
+            last_modified (str): Last-Modified of the asset, if known
+        """
+        self.store((url, asset_type), CacheEntry(metadata, etag, last_modified))
+
+    def get_or_compute(self, url, asset_type, compute):
+        """
+        Return cached metadata for an asset, computing and storing it on a miss
+
+        Args:
+            url (str): URL of the asset
+            asset_type (str): Type of asset - video or image
+            compute (callable): compute(url, asset_type) returning the metadata dict
+
+        Returns:
+            dict: Metadata of the asset
+        """
+        key = (url, asset_type)
+        entry, tier = self.load(key)
+        if entry is not None:
+            if entry.is_fresh(self.ttl):
+                self.count(tier)
+                return entry.metadata
+            if (entry.etag or entry.last_modified) and is_unchanged(url, entry.etag, entry.last_modified):
+                self.count('revalidated')
+                entry.validated_at = time.time()
+                self.store(key, entry)
+                return entry.metadata
+            self.count('invalidated')
+        else:
+            self.count('misses')
+
+        # The validators come from the responses compute reads, not from another request
+        with collect_validators() as validators:
+            metadata = compute(url, asset_type)
+        if not metadata:
+            return metadata
+        etag, last_modified = validators.get(url, (None, None))
+        self.store(key, CacheEntry(metadata, etag, last_modified))
+        return metadata
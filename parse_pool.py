@@ -0,0 +1,222 @@
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import context as mp_context, shared_memory
+
+from asset_fetch import RemoteFile, SparseFile
+from asset_metrics import phase_seconds, time_phase
+from deadline import check_deadline, wait_for
+from media_probe import probe_video_metadata
+from parse_worker import SharedFileUnavailable, media_info_metadata, parse_shared
+
+logger = logging.getLogger(__name__)
+
+# Worker processes MediaInfo.parse runs in; 0 parses on the calling thread
+PARSE_PROCESSES = int(os.environ.get('ASSET_PARSE_PROCESSES', 0))
+
+# Workers start from a clean server process, never as forks of a multithreaded service
+START_METHOD = os.environ.get('ASSET_PARSE_START_METHOD', 'forkserver')
+
+
+def proc_fd_dir():
+    # Spilled downloads are reopened by workers through procfs instead of being copied.
+    # Built on each use, as the service may have forked since import, e.g. gunicorn --preload
+    return f'/proc/{os.getpid()}/fd'
+
+
+@contextmanager
+def main_module_hidden():
+    """
+    Hide the service's entry script from multiprocessing while a worker is launched
+
+    forkserver and spawn children re-import __main__, which for `python app.py`
+    would build another engine, pools and cache connections in each parse
+    worker. The workers only need parse_worker.
+    """
+    main = sys.modules['__main__']
+    spec, path = main.__spec__, main.__dict__.pop('__file__', None)
+    main.__spec__ = None
+    try:
+        yield
+    finally:
+        main.__spec__ = spec
+        if path is not None:
+            main.__file__ = path
+
+
+class ForkServerWorker(mp_context.ForkServerProcess):
+    @staticmethod
+    def _Popen(process_obj):
+        with main_module_hidden():
+            return mp_context.ForkServerProcess._Popen(process_obj)
+
+
+class SpawnWorker(mp_context.SpawnProcess):
+    @staticmethod
+    def _Popen(process_obj):
+        with main_module_hidden():
+            return mp_context.SpawnProcess._Popen(process_obj)
+
+
+class ForkServerWorkerContext(mp_context.ForkServerContext):
+    Process = ForkServerWorker
+
+
+class SpawnWorkerContext(mp_context.SpawnContext):
+    Process = SpawnWorker
+
+
+def worker_context(method):
+    """
+    Returns:
+        BaseContext: Context of a start method whose processes do not import __main__
+    """
+    if method == 'forkserver':
+        context = ForkServerWorkerContext()
+        # The server preloads the workers' entry point only, not the service around it
+        context.set_forkserver_preload(['parse_worker'])
+        return context
+    if method == 'spawn':
+        return SpawnWorkerContext()
+    return multiprocessing.get_context(method)
+
+
+def release_block(block):
+    block.close()
+    block.unlink()
+
+
+class ParsePool:
+    """
+    Process pool for MediaInfo.parse, which holds the GIL for its whole run
+
+    Files are handed to workers without pickling their contents: a spilled
+    download is reopened through /proc, anything else is copied once into a
+    shared memory block. Once a worker fails to open a file through /proc,
+    spilled downloads are copied too. The cheap pure-Python container probe
+    still runs on the calling thread, so most lookups never leave the process.
+    """
+
+    def __init__(self, processes=PARSE_PROCESSES):
+        self.processes = processes
+        self.executor = None
+        self.lock = threading.Lock()
+        self.share_by_path = True
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=worker_context(START_METHOD),
+                )
+            return self.executor
+
+    def share(self, file):
+        """
+        Returns:
+            tuple: (arguments for parse_shared, release) where release() frees
+            what was shared once the worker is done with it
+        """
+        fd_dir = proc_fd_dir()
+        if self.share_by_path and getattr(file, 'spilled', False) and os.path.isdir(fd_dir):
+            # reader() flushes the temp file, or drops it if nothing was written
+            file.reader()
+            if file.file is not None:
+                # A descriptor of its own keeps the file, and its number, valid for the worker
+                # even if the caller gives up and closes the buffer before the worker opens it
+                fd = os.dup(file.file.fileno())
+                return ('fd', f'{fd_dir}/{fd}'), lambda: os.close(fd)
+
+        if isinstance(file, SparseFile):
+            size = sum(len(data) for _, data in file.segments)
+            block = shared_memory.SharedMemory(create=True, size=max(1, size))
+            position = 0
+            for _, data in file.segments:
+                block.buf[position:position + len(data)] = data
+                position += len(data)
+            layout = [(offset, len(data)) for offset, data in file.segments]
+            return ('sparse', block.name, file.size, layout), lambda: release_block(block)
+
+        file.seek(0, io.SEEK_END)
+        size = file.tell()
+        file.seek(0)
+        block = shared_memory.SharedMemory(create=True, size=max(1, size))
+        filled = 0
+        while filled < size:
+            count = file.readinto(block.buf[filled:size])
+            if not count:
+                break
+            filled += count
+        file.seek(0)
+        return ('memory', block.name, filled), lambda: release_block(block)
+
+    def media_info(self, file, fields=()):
+        """
+        Run MediaInfo on a file, in a worker process if the pool is enabled
+
+        Args:
+            file: Seekable binary file object
+            fields (tuple): Optional fields to read as well, see media_probe.VIDEO_FIELDS
+
+        Returns:
+            dict: Metadata containing duration and dimension, or None if there is no video track
+        """
+        check_deadline()
+        # A RemoteFile is fetched as it is parsed, so sharing it would mean downloading it first
+        if not self.processes or isinstance(file, RemoteFile):
+            with time_phase('mediainfo'):
+                return media_info_metadata(file, fields)
+
+        with time_phase('parse_pool'):
+            try:
+                metadata, seconds = self.parse_shared(file, fields)
+            except SharedFileUnavailable as e:
+                logger.warning(f'Parse workers cannot open files by path, copying them instead: {e}')
+                self.share_by_path = False
+                metadata, seconds = self.parse_shared(file, fields)
+        phase_seconds.observe(seconds, phase='mediainfo')
+        return metadata
+
+    def parse_shared(self, file, fields=()):
+        args, release = self.share(file)
+        try:
+            future = self.get_executor().submit(parse_shared, *args, fields=fields)
+        except Exception:
+            release()
+            raise
+        # Released once the worker is done, which may be after wait_for gave up on it
+        future.add_done_callback(lambda _: release())
+        return wait_for(future)
+
+    def parse_video(self, file, fields=()):
+        """
+        Extract video metadata, reading the container headers directly and
+        using MediaInfo only for layouts the probe does not understand
+
+        Args:
+            file: Seekable binary file object, e.g. a SpoolBuffer or SparseFile
+            fields (tuple): Optional fields to read as well, see media_probe.VIDEO_FIELDS
+
+        Returns:
+            dict: Metadata containing duration, dimension and the requested
+            fields, or None if there is no video track
+        """
+        with time_phase('probe'):
+            metadata = probe_video_metadata(file, fields)
+        if metadata:
+            return metadata
+        return self.media_info(file, fields)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+
+parse_pool = ParsePool()
@@ -0,0 +1,147 @@
+"""
+Entry point of the MediaInfo parse workers
+
+Kept apart from parse_pool, and free of side effects on import, so the
+forkserver can preload just this module for the workers it starts.
+"""
+import io
+import mmap
+import time
+from multiprocessing import shared_memory
+
+from pymediainfo import MediaInfo
+
+from asset_fetch import SparseFile
+
+
+class SharedFileUnavailable(Exception):
+    """
+    The worker could not open a file handed over by path, e.g. under procfs
+    hidepid, as another user or without /proc
+    """
+
+
+class MemoryFile(io.RawIOBase):
+    """
+    Read-only file over a buffer such as a shared memory block, without copying it
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self.buffer = memoryview(buffer).cast('B')
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.buffer)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        length = min(len(view), max(0, len(self.buffer) - self.position))
+        view[:length] = self.buffer[self.position:self.position + length]
+        self.position += length
+        return length
+
+    def close(self):
+        self.buffer.release()
+        super().close()
+
+
+def media_info_fields(media_info, track, fields):
+    """
+    Read the requested optional fields, see media_probe.VIDEO_FIELDS, from MediaInfo's tracks
+    """
+    details = {}
+    if 'codec' in fields:
+        details['codec'] = track.codec_id or track.format
+    if 'bitrate' in fields:
+        details['bitrate'] = int(track.bit_rate) if track.bit_rate else None
+    if 'frame_rate' in fields:
+        details['frame_rate'] = round(float(track.frame_rate), 3) if track.frame_rate else None
+    if 'rotation' in fields:
+        details['rotation'] = round(float(track.rotation or 0)) % 360
+    if 'has_audio' in fields:
+        details['has_audio'] = any(item.track_type == "Audio" for item in media_info.tracks)
+    return details
+
+
+def media_info_metadata(file, fields=()):
+    """
+    Extract duration and dimension of the first video track with MediaInfo
+
+    Args:
+        file: Binary file object of the video
+        fields (tuple): Optional fields to read as well, see media_probe.VIDEO_FIELDS
+
+    Returns:
+        dict: Metadata containing duration and dimension, or None if there is no video track
+    """
+    media_info = MediaInfo.parse(file)
+    for track in media_info.tracks:
+        if track.track_type == "Video":
+            metadata = {
+                'duration': track.duration / 1000,
+                'dimension': f"{track.width}x{track.height}"
+            }
+            if fields:
+                metadata.update(media_info_fields(media_info, track, fields))
+            return metadata
+    return None
+
+
+def parse_shared(kind, location, size=None, segments=None, fields=()):
+    """
+    Run MediaInfo in a worker process on a file shared by the parent
+
+    Args:
+        kind (str): 'fd' to reopen a file by path, 'memory' for a shared memory
+            block holding the file, 'sparse' for one holding the fetched segments
+        location (str): Path or shared memory name
+        size (int): Size of the file
+        segments (list): (offset, length) of each segment packed in the block
+        fields (tuple): Optional fields to read as well
+
+    Returns:
+        tuple: (metadata, seconds spent parsing)
+    """
+    started = time.perf_counter()
+    if kind == 'fd':
+        try:
+            file = open(location, 'rb')
+        except OSError as e:
+            raise SharedFileUnavailable(f'Cannot open {location}: {e}') from None
+        with file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            return media_info_metadata(view, fields), time.perf_counter() - started
+
+    block = shared_memory.SharedMemory(name=location)
+    views = []
+    try:
+        if kind == 'sparse':
+            position = 0
+            for offset, length in segments:
+                views.append((offset, block.buf[position:position + length]))
+                position += length
+            file = SparseFile(size, views)
+        else:
+            views.append((0, block.buf[:size]))
+            file = MemoryFile(views[0][1])
+        with file:
+            return media_info_metadata(file, fields), time.perf_counter() - started
+    finally:
+        # The block can only be closed once no views into it are left
+        for _, view in views:
+            view.release()
+        block.close()
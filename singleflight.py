@@ -0,0 +1,138 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from admission import IMAGE_QUEUE, IMAGE_WORKERS, VIDEO_QUEUE, VIDEO_WORKERS, Overloaded
+from asset_metrics import shed_total
+from deadline import SharedDeadline, current_deadline, deadline_scope, wait_for
+
+# Shared calls running at once; by default one per lookup the pools can hold, as any more are shed there anyway
+SINGLEFLIGHT_WORKERS = int(os.environ.get(
+    'ASSET_SINGLEFLIGHT_WORKERS', VIDEO_WORKERS + VIDEO_QUEUE + IMAGE_WORKERS + IMAGE_QUEUE,
+))
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one execution
+
+    The shared call runs on a bounded executor under a SharedDeadline, and
+    every caller, the first one included, waits for it until its own deadline
+    passes. The call is abandoned only once all of its callers have gone.
+    """
+
+    def __init__(self, workers=SINGLEFLIGHT_WORKERS):
+        """
+        Args:
+            workers (int): Shared calls allowed to run at once; further keys are shed
+        """
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = {'leaders': 0, 'followers': 0}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='singleflight')
+        self.slots = threading.BoundedSemaphore(workers)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, in_flight=len(self.calls))
+
+    def do(self, key, function, *args):
+        """
+        Run function(*args) unless a call for key is already in flight
+
+        Args:
+            key: Hashable identifier of the work, e.g. (url, asset_type)
+            function (callable): Work to run
+
+        Returns:
+            The result of the single shared call
+
+        Raises:
+            Overloaded: If as many shared calls as there are workers are already running
+        """
+        deadline = current_deadline.get()
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None and call[1].join(deadline):
+                self.counters['followers'] += 1
+            else:
+                if not self.slots.acquire(blocking=False):
+                    shed_total.inc(pool='singleflight', reason='queue_full')
+                    raise Overloaded('Too many lookups in flight, retry later', 429)
+                future, shared = Future(), SharedDeadline()
+                # Running, so a caller giving up cannot cancel it for the others
+                future.set_running_or_notify_cancel()
+                shared.join(deadline)
+                call = self.calls[key] = (future, shared)
+                self.counters['leaders'] += 1
+                context = contextvars.copy_context()
+                self.executor.submit(context.run, self.run, key, call, function, args)
+
+        future, shared = call
+        try:
+            return wait_for(future)
+        finally:
+            shared.leave(deadline)
+
+    def run(self, key, call, function, args):
+        future, shared = call
+        try:
+            with deadline_scope(shared):
+                result = function(*args)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            with self.lock:
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+            self.slots.release()
+            if not future.done():
+                future.set_exception(RuntimeError('Shared call was interrupted'))
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight for coroutine functions
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.counters = {'leaders': 0, 'followers': 0}
+
+    def stats(self):
+        return dict(self.counters, in_flight=len(self.calls))
+
+    async def do(self, key, function, *args):
+        """
+        Await function(*args) unless a call for key is already in flight
+
+        The shared call runs as its own task under a SharedDeadline, so a
+        caller that is cancelled or times out does not cancel the work for the
+        others. It is cancelled only once every caller waiting for it has gone.
+        """
+        deadline = current_deadline.get()
+        call = self.calls.get(key)
+        if call is not None and call[1].join(deadline):
+            self.counters['followers'] += 1
+        else:
+            self.counters['leaders'] += 1
+            shared = SharedDeadline()
+            shared.join(deadline)
+            call = self.calls[key] = (asyncio.ensure_future(self.run(shared, function, args)), shared)
+            call[0].add_done_callback(lambda _, call=call: self.calls.pop(key) if self.calls.get(key) is call else None)
+        task, shared = call
+        try:
+            return await asyncio.shield(task)
+        finally:
+            shared.leave(deadline)
+            if shared.cancelled.is_set() and not task.done():
+                task.cancel()
+
+    async def run(self, shared, function, args):
+        # The task, and the threads it hands parses to, see the shared deadline, not the leader's
+        with deadline_scope(shared):
+            return await function(*args)
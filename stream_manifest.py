@@ -0,0 +1,269 @@
+import re
+import xml.etree.ElementTree as ElementTree
+from urllib.parse import urljoin, urlsplit
+
+from media_probe import init_segment_dimension
+
+HLS_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+ISO_DURATION_RE = re.compile(
+    r'^P(?:(?P<days>\d+(?:\.\d+)?)D)?'
+    r'(?:T(?:(?P<hours>\d+(?:\.\d+)?)H)?(?:(?P<minutes>\d+(?:\.\d+)?)M)?(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$'
+)
+
+
+class ManifestError(Exception):
+    pass
+
+
+def manifest_kind(url, data=None):
+    """
+    Tell whether a URL, or its first bytes, is an HLS or DASH manifest
+
+    Args:
+        url (str): URL of the asset
+        data (bytes): First bytes of the asset, if already fetched
+
+    Returns:
+        str: 'hls', 'dash', or None for anything else
+    """
+    path = urlsplit(url).path.lower()
+    if path.endswith('.m3u8'):
+        return 'hls'
+    if path.endswith('.mpd'):
+        return 'dash'
+    if data:
+        head = data[:256].lstrip(b'\xef\xbb\xbf \t\r\n')
+        if head.startswith(b'#EXTM3U'):
+            return 'hls'
+        if b'<MPD' in data[:1024]:
+            return 'dash'
+    return None
+
+
+def parse_byte_range(value, hls=False):
+    """
+    Parse an HLS BYTERANGE ('length@offset') or a DASH range ('start-end')
+
+    Returns:
+        tuple: (start, end) inclusive, or None
+    """
+    if not value:
+        return None
+    if hls:
+        length, _, offset = value.partition('@')
+        start = int(offset or 0)
+        return start, start + int(length) - 1
+    start, end = value.split('-')
+    return int(start), int(end)
+
+
+def parse_hls_attributes(value):
+    return {key: item.strip('"') for key, item in HLS_ATTRIBUTE_RE.findall(value)}
+
+
+def parse_hls(text, base_url):
+    """
+    Parse an HLS playlist, either a master playlist or a media playlist
+
+    Returns:
+        dict: {'variants': [...]} for a master playlist, each variant holding its
+        uri, bandwidth and resolution. Otherwise {'duration', 'init'} where init
+        is (uri, byte_range) of the EXT-X-MAP init segment or None.
+
+    Raises:
+        ManifestError: If it is not a playlist or a tag or URI line is malformed
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != '#EXTM3U':
+        raise ManifestError('Not an HLS playlist')
+
+    variants, duration, init = [], 0.0, None
+    pending = None
+    for line in lines[1:]:
+        try:
+            if line.startswith('#EXT-X-STREAM-INF:'):
+                pending = parse_hls_attributes(line.partition(':')[2])
+            elif line.startswith('#EXTINF:'):
+                duration += float(line.partition(':')[2].split(',')[0])
+            elif line.startswith('#EXT-X-MAP:') and init is None:
+                attributes = parse_hls_attributes(line.partition(':')[2])
+                init = urljoin(base_url, attributes['URI']), parse_byte_range(attributes.get('BYTERANGE'), hls=True)
+            elif not line.startswith('#') and pending is not None:
+                width, _, height = pending.get('RESOLUTION', '').partition('x')
+                variants.append({
+                    'uri': urljoin(base_url, line),
+                    'bandwidth': int(pending.get('BANDWIDTH') or 0),
+                    'resolution': (int(width), int(height)) if width.isdigit() and height.isdigit() else None,
+                })
+                pending = None
+        except (ValueError, KeyError) as e:
+            raise ManifestError(f'Malformed HLS line {line!r}: {e}') from None
+
+    if variants:
+        return {'variants': variants}
+    return {'duration': duration, 'init': init}
+
+
+def parse_iso_duration(value):
+    """
+    Parse an ISO 8601 duration as used by DASH, e.g. 'PT1M35.5S'
+
+    Returns:
+        float: Seconds, or None if value is missing or malformed
+    """
+    match = ISO_DURATION_RE.match(value or '')
+    if not match:
+        return None
+    parts = {key: float(item or 0) for key, item in match.groupdict().items()}
+    return parts['days'] * 86400 + parts['hours'] * 3600 + parts['minutes'] * 60 + parts['seconds']
+
+
+def local_name(element):
+    return element.tag.rpartition('}')[2]
+
+
+def children(element, name):
+    return [child for child in element if local_name(child) == name]
+
+
+def join_base_url(base_url, element):
+    base = children(element, 'BaseURL')
+    return urljoin(base_url, base[0].text.strip()) if base and base[0].text else base_url
+
+
+def is_video_adaptation(adaptation):
+    if adaptation.get('contentType') == 'video' or (adaptation.get('mimeType') or '').startswith('video/'):
+        return True
+    return any(
+        (representation.get('mimeType') or '').startswith('video/') or representation.get('width')
+        for representation in children(adaptation, 'Representation')
+    )
+
+
+def dash_init_segment(base_url, representation, *parents):
+    """
+    Locate the init segment of a DASH representation
+
+    Returns:
+        tuple: (uri, byte_range), or None
+    """
+    for element in (representation,) + parents:
+        template = children(element, 'SegmentTemplate')
+        if template and template[0].get('initialization'):
+            uri = template[0].get('initialization')
+            uri = uri.replace('$RepresentationID$', representation.get('id', ''))
+            uri = uri.replace('$Bandwidth$', representation.get('bandwidth', ''))
+            return urljoin(base_url, uri), None
+        segment_base = children(element, 'SegmentBase')
+        initialization = children(segment_base[0], 'Initialization') if segment_base else []
+        if initialization:
+            uri = initialization[0].get('sourceURL')
+            byte_range = parse_byte_range(initialization[0].get('range'))
+            return urljoin(base_url, uri) if uri else base_url, byte_range
+    return None
+
+
+def parse_dash(text, base_url):
+    """
+    Parse a DASH MPD
+
+    Returns:
+        dict: {'duration', 'dimension', 'init'} where dimension is (width, height)
+        of the largest video representation if the MPD states it, and init is
+        (uri, byte_range) of that representation's init segment or None
+
+    Raises:
+        ManifestError: If it is not an MPD, has no video or a representation is malformed
+    """
+    try:
+        root = ElementTree.fromstring(text)
+    except ElementTree.ParseError as e:
+        raise ManifestError(f'Invalid MPD: {e}')
+    if local_name(root) != 'MPD':
+        raise ManifestError('Not a DASH MPD')
+
+    periods = children(root, 'Period')
+    duration = parse_iso_duration(root.get('mediaPresentationDuration'))
+    if duration is None:
+        period_durations = [parse_iso_duration(period.get('duration')) for period in periods]
+        duration = sum(period_durations) if period_durations and None not in period_durations else None
+
+    mpd_base = join_base_url(base_url, root)
+    best = None
+    for period in periods[:1]:
+        period_base = join_base_url(mpd_base, period)
+        for adaptation in children(period, 'AdaptationSet'):
+            if not is_video_adaptation(adaptation):
+                continue
+            adaptation_base = join_base_url(period_base, adaptation)
+            for representation in children(adaptation, 'Representation'):
+                try:
+                    width = int(representation.get('width') or adaptation.get('width') or 0)
+                    height = int(representation.get('height') or adaptation.get('height') or 0)
+                    rank = (width * height, int(representation.get('bandwidth') or 0))
+                    if best is None or rank > best[0]:
+                        representation_base = join_base_url(adaptation_base, representation)
+                        init = dash_init_segment(representation_base, representation, adaptation, period)
+                        best = rank, (width, height), init
+                except ValueError as e:
+                    raise ManifestError(f'Malformed Representation {representation.attrib} in MPD: {e}') from None
+
+    if best is None:
+        raise ManifestError('No video representation in MPD')
+    _, (width, height), init = best
+    return {'duration': duration, 'dimension': (width, height) if width and height else None, 'init': init}
+
+
+def stream_plan(url):
+    """
+    Plan the requests that read duration and dimension of an HLS or DASH stream
+
+    Durations come from the playlist segment durations or the MPD, and the
+    dimension from the variant or representation attributes. Only if those are
+    missing is the init segment of the chosen rendition fetched. Media segments
+    are never downloaded, so an HLS stream of MPEG-TS segments (no EXT-X-MAP)
+    whose master playlist states no RESOLUTION cannot be resolved.
+
+    Like the moov plans in asset_fetch this does no I/O itself: it yields
+    ('get', url, byte_range) and is sent back the response body.
+
+    Returns:
+        dict: Metadata containing duration and dimension
+
+    Raises:
+        ManifestError: If the manifest cannot be parsed, has no video or does not state its resolution
+    """
+    data = yield 'get', url, None
+    text = data.decode('utf-8-sig', errors='replace')
+    kind = manifest_kind(url, data)
+
+    if kind == 'dash':
+        manifest = parse_dash(text, url)
+        duration, dimension, init = manifest['duration'], manifest['dimension'], manifest['init']
+    elif kind == 'hls':
+        playlist = parse_hls(text, url)
+        dimension = None
+        if 'variants' in playlist:
+            variant = max(playlist['variants'], key=lambda item: (
+                item['resolution'][0] * item['resolution'][1] if item['resolution'] else 0, item['bandwidth'],
+            ))
+            dimension = variant['resolution']
+            data = yield 'get', variant['uri'], None
+            playlist = parse_hls(data.decode('utf-8-sig', errors='replace'), variant['uri'])
+            if 'variants' in playlist:
+                raise ManifestError('Nested HLS master playlists are not supported')
+        duration, init = playlist['duration'], playlist['init']
+    else:
+        raise ManifestError('Not an HLS or DASH manifest')
+
+    if dimension is None and init is not None:
+        uri, byte_range = init
+        dimension = init_segment_dimension((yield 'get', uri, byte_range))
+    if dimension is None:
+        raise ManifestError('Stream does not state its resolution')
+
+    return {
+        'duration': round(duration * 1000) / 1000 if duration is not None else None,
+        'dimension': f'{dimension[0]}x{dimension[1]}'
+    }
@@ -0,0 +1,310 @@
+import io
+import logging
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+from asset_metrics import time_phase
+from deadline import check_deadline, request_timeout
+from metadata_cache import CACHE_PATH, CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = os.environ.get('ASSET_FFMPEG', 'ffmpeg')
+
+# Seconds ffmpeg may take to decode a single keyframe
+DECODE_TIMEOUT = float(os.environ.get('ASSET_THUMBNAIL_DECODE_TIMEOUT', 10))
+
+THUMBNAIL_WIDTH = 320
+MAX_THUMBNAIL_WIDTH = 1920
+THUMBNAIL_QUALITY = int(os.environ.get('ASSET_THUMBNAIL_QUALITY', 80))
+
+# Keyframes larger than this are not fetched; even 4K intra frames rarely come close
+MAX_KEYFRAME_SIZE = 8 * 1024 * 1024
+
+# Bytes of encoded thumbnails held in the in-process cache tier
+THUMBNAIL_CACHE_BYTES = int(os.environ.get('ASSET_THUMBNAIL_CACHE_BYTES', 64 * 1024 * 1024))
+
+# Bytes of moov boxes held in memory, so further thumbnails of a video only fetch their keyframe
+MOOV_CACHE_BYTES = int(os.environ.get('ASSET_MOOV_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Output formats by the name used in requests, with their PIL format and content type
+THUMBNAIL_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+# Sample entry types of the codecs a keyframe can be decoded for, with ffmpeg's demuxer for them
+CODEC_DEMUXERS = {'avc1': 'h264', 'avc3': 'h264', 'hvc1': 'hevc', 'hev1': 'hevc'}
+
+START_CODE = b'\0\0\0\1'
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+def parse_options(keyframe=0, width=THUMBNAIL_WIDTH, image_format='jpeg'):
+    """
+    Validate the options of a thumbnail request
+
+    Returns:
+        tuple: (keyframe, width, image_format)
+
+    Raises:
+        ThumbnailError: If an option is out of range
+    """
+    try:
+        keyframe, width = int(keyframe), int(width)
+    except (TypeError, ValueError):
+        raise ThumbnailError('keyframe and width must be integers')
+    if keyframe < 0:
+        raise ThumbnailError('keyframe must not be negative')
+    if not 0 < width <= MAX_THUMBNAIL_WIDTH:
+        raise ThumbnailError(f'width must be between 1 and {MAX_THUMBNAIL_WIDTH}')
+    image_format = str(image_format).lower().replace('jpg', 'jpeg')
+    if image_format not in THUMBNAIL_FORMATS:
+        raise ThumbnailError(f'format must be one of {", ".join(THUMBNAIL_FORMATS)}')
+    return keyframe, width, image_format
+
+
+def to_annex_b(sample, nal_length_size, parameter_sets):
+    """
+    Turn an MP4 sample of length-prefixed NAL units into an Annex B stream a
+    decoder can read on its own, with the parameter sets in front
+    """
+    parts = [START_CODE + nal for nal in parameter_sets]
+    position = 0
+    while position + nal_length_size <= len(sample):
+        length = int.from_bytes(sample[position:position + nal_length_size], 'big')
+        position += nal_length_size
+        parts.append(START_CODE + sample[position:position + length])
+        position += length
+    return b''.join(parts)
+
+
+def decode_keyframe(codec, stream):
+    """
+    Decode the single frame of an Annex B stream with ffmpeg
+
+    Returns:
+        Image: The decoded frame
+
+    Raises:
+        ThumbnailError: If the codec is not supported or ffmpeg could not decode the frame
+    """
+    if codec not in CODEC_DEMUXERS:
+        raise ThumbnailError(f'Thumbnails are not supported for {codec} videos')
+    check_deadline()
+    command = [
+        FFMPEG, '-hide_banner', '-loglevel', 'error',
+        '-f', CODEC_DEMUXERS[codec], '-i', 'pipe:0',
+        '-frames:v', '1', '-f', 'image2pipe', '-c:v', 'png', 'pipe:1',
+    ]
+    # Decoding may take no longer than what is left of the caller's deadline
+    timeout = request_timeout((DECODE_TIMEOUT, DECODE_TIMEOUT))[1]
+    try:
+        with time_phase('decode'):
+            result = subprocess.run(command, input=stream, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        check_deadline()
+        raise ThumbnailError(f'Decoding the keyframe took over {timeout:.1f}s')
+    if result.returncode or not result.stdout:
+        error = result.stderr.decode(errors='replace').strip()[-200:]
+        raise ThumbnailError(f'Could not decode the keyframe: {error}')
+    return Image.open(io.BytesIO(result.stdout))
+
+
+def render_thumbnail(image, width, image_format, rotation=0, quality=THUMBNAIL_QUALITY):
+    """
+    Rotate a frame upright, scale it down to width and encode it
+
+    Returns:
+        bytes: The encoded thumbnail
+    """
+    if rotation:
+        # PIL rotates counter-clockwise, the display matrix clockwise
+        image = image.rotate(-rotation, expand=True)
+    image = image.convert('RGB')
+    image.thumbnail((width, MAX_THUMBNAIL_WIDTH * 4))
+    output = io.BytesIO()
+    image.save(output, THUMBNAIL_FORMATS[image_format][0], quality=quality)
+    return output.getvalue()
+
+
+class MoovCache:
+    """
+    In-process LRU of the moov boxes of videos by URL, bounded by bytes
+
+    A metadata lookup or thumbnail of an MP4/MOV video fetches its moov box
+    anyway. Kept here, the sample tables locate any other keyframe of the
+    video without fetching them again. Entries expire after the cache TTL,
+    like cached metadata.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_bytes=MOOV_CACHE_BYTES):
+        """
+        Args:
+            ttl (int): Seconds a moov box is used before it is fetched again
+            max_bytes (int): Size of the LRU in bytes
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.size)
+
+    def get(self, url):
+        """
+        Returns:
+            bytes: Payload of the moov box of the video, or None
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None or time.time() - entry[1] >= self.ttl:
+                self.counters['misses'] += 1
+                return None
+            self.entries.move_to_end(url)
+            self.counters['hits'] += 1
+            return entry[0]
+
+    def put(self, url, moov):
+        if len(moov) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(url, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self.entries[url] = (moov, time.time())
+            self.size += len(moov)
+            while self.size > self.max_bytes:
+                evicted, _ = self.entries.popitem(last=False)[1]
+                self.size -= len(evicted)
+
+
+class ThumbnailCache:
+    """
+    Two-tier cache of encoded thumbnails keyed by URL and thumbnail options
+
+    Like the metadata cache, an in-process LRU, bounded by bytes here, sits in
+    front of the SQLite file. Entries are served for the cache TTL and then
+    rendered again.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=THUMBNAIL_CACHE_BYTES):
+        """
+        Args:
+            path (str): SQLite file for the on-disk tier, or None to keep the cache in memory only
+            ttl (int): Seconds a thumbnail is served before it is rendered again
+            max_bytes (int): Size of the in-process LRU in bytes
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        self.db = None
+        if path:
+            try:
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS asset_thumbnails ('
+                    'url TEXT, options TEXT, image BLOB, stored_at REAL, PRIMARY KEY (url, options))'
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.error(f'Thumbnail cache disabled on disk: {e}')
+                self.db = None
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, memory_entries=len(self.entries), memory_bytes=self.size)
+
+    def remember(self, key, image, stored_at):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous[0])
+        self.entries[key] = (image, stored_at)
+        self.size += len(image)
+        while self.size > self.max_bytes and self.entries:
+            evicted, _ = self.entries.popitem(last=False)[1]
+            self.size -= len(evicted)
+
+    def load(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry, 'memory_hits'
+            if self.db is None:
+                return None, None
+            try:
+                row = self.db.execute(
+                    'SELECT image, stored_at FROM asset_thumbnails WHERE url = ? AND options = ?', key
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(e)
+                return None, None
+            if row is None:
+                return None, None
+            entry = (bytes(row[0]), row[1])
+            self.remember(key, *entry)
+            return entry, 'disk_hits'
+
+    def store(self, key, image):
+        stored_at = time.time()
+        with self.lock:
+            self.remember(key, image, stored_at)
+            if self.db is None:
+                return
+            try:
+                self.db.execute('INSERT OR REPLACE INTO asset_thumbnails VALUES (?, ?, ?, ?)', key + (image, stored_at))
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.error(e)
+
+    def get_hit(self, url, options):
+        """
+        Return a fresh cached thumbnail counting the hit, or None counting nothing
+        """
+        entry, tier = self.load((url, options))
+        if entry is None or time.time() - entry[1] >= self.ttl:
+            return None
+        with self.lock:
+            self.counters[tier] += 1
+        return entry[0]
+
+    def get_or_compute(self, url, options, compute):
+        """
+        Return the cached thumbnail of an asset, rendering and storing it on a miss
+
+        Args:
+            url (str): URL of the video
+            options (str): Thumbnail options the image was rendered with, e.g. '0:320:jpeg'
+            compute (callable): compute() returning the encoded thumbnail
+
+        Returns:
+            bytes: The encoded thumbnail
+        """
+        key = (url, options)
+        entry, tier = self.load(key)
+        if entry is not None and time.time() - entry[1] < self.ttl:
+            with self.lock:
+                self.counters[tier] += 1
+            return entry[0]
+        with self.lock:
+            self.counters['misses'] += 1
+        image = compute()
+        self.store(key, image)
+        return image